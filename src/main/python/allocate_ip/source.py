@@ -11,11 +11,16 @@ conditions of the subcomponent's license, as noted in the LICENSE file.
 Modifications for phpIPAM by John Bowdre (john@bowdre.net) 
 """
 
-import requests
 from vra_ipam_utils.ipam import IPAM
+from vra_ipam_utils.address_ids import AddressIdCache
+from vra_ipam_utils.client import PhpIpamClient
+from vra_ipam_utils.concurrency import concurrent_map, get_max_concurrency
+from vra_ipam_utils.exceptions import combined_exception
+from vra_ipam_utils.geometry import address_to_int, int_to_address, usable_bounds
+from vra_ipam_utils.streaming import iter_data
 import logging
+import threading
 from datetime import datetime
-import ipaddress
 
 """
 Example payload
@@ -80,111 +85,175 @@ def handler(context, inputs):
 
     return ipam.allocate_ip()
 
-def auth_session(uri, auth, cert):
-    auth_uri = f'{uri}/user/'
-    req = requests.post(auth_uri, auth=auth, verify=cert)
-    if req.status_code != 200:
-        raise requests.exceptions.RequestException('Authentication Failure!')
-    token = {"token": req.json()['data']['token']}
-    return token
-
 def do_allocate_ip(self, auth_credentials, cert):
-    # Build variables
-    username = auth_credentials["privateKeyId"]
-    password = auth_credentials["privateKey"]
-    hostname = self.inputs["endpoint"]["endpointProperties"]["hostName"]
-    apiAppId = self.inputs["endpoint"]["endpointProperties"]["apiAppId"]
-    uri = f'https://{hostname}/api/{apiAppId}/'
-    auth = (username, password)
-
-    # Auth to API
-    token = auth_session(uri, auth, cert)
-    bundle = {
-      'uri': uri,
-      'token': token,
-      'cert': cert
-    }
-    
-    allocation_result = []
-    try:
-        resource = self.inputs["resourceInfo"]
-        for allocation in self.inputs["ipAllocations"]:
-            allocation_result.append(allocate(resource, allocation, self.context, self.inputs["endpoint"], bundle))
-    except Exception as e:
-        try:
-            rollback(allocation_result, bundle)
-        except Exception as rollback_e:
-            logging.error(f"Error during rollback of allocation result {str(allocation_result)}")
-            logging.error(rollback_e)
-        raise e
+    endpointProperties = self.inputs["endpoint"]["endpointProperties"]
+    client = PhpIpamClient.from_endpoint(endpointProperties, auth_credentials, cert)
+
+    # NICs are allocated concurrently, but allocations from the same range are serialized
+    # so that they don't race each other for the same free address
+    range_locks = {}
+    for allocation in self.inputs["ipAllocations"]:
+        for range_id in allocation["ipRangeIds"]:
+            range_locks.setdefault(str(range_id), threading.Lock())
 
+    # The phpIPAM ids of the new addresses are kept for update_record
+    address_ids = AddressIdCache(client.uri)
+    resource = self.inputs["resourceInfo"]
+    maxConcurrency = get_max_concurrency(endpointProperties)
+    outcomes = concurrent_map(
+        lambda allocation: allocate(resource, allocation, self.context, self.inputs["endpoint"], client, range_locks, address_ids, maxConcurrency),
+        self.inputs["ipAllocations"],
+        maxConcurrency
+    )
+    allocation_result = [result for result, error in outcomes if error is None]
+    errors = [error for result, error in outcomes if error is not None]
+    if errors:
+        # All or nothing: release whatever was reserved for the other NICs
+        leaked = rollback(allocation_result, client, maxConcurrency)
+        for result in allocation_result:
+            for ip in result["ipAddresses"]:
+                address_ids.discard(ip)
+        address_ids.save()
+        if leaked:
+            raise combined_exception(f"{str(errors[0])} (rollback failed to release {', '.join(leaked)})", errors) from errors[0]
+        raise errors[0]
+
+    address_ids.save()
     assert len(allocation_result) > 0
     return {
         "ipAllocations": allocation_result
     }
 
-def allocate(resource, allocation, context, endpoint, bundle):
+def allocate(resource, allocation, context, endpoint, client, range_locks, address_ids, max_workers):
 
     last_error = None
     for range_id in allocation["ipRangeIds"]:
 
-        logging.info(f"Allocating from range {range_id}")
+        logging.info("Allocating from range %s", range_id)
         try:
-            return allocate_in_range(range_id, resource, allocation, context, endpoint, bundle)
+            with range_locks[str(range_id)]:
+                return allocate_in_range(range_id, resource, allocation, context, endpoint, client, address_ids, max_workers)
         except Exception as e:
             last_error = e
-            logging.error(f"Failed to allocate from range {range_id}: {str(e)}")
+            logging.error("Failed to allocate from range %s: %s", range_id, e)
 
     logging.error("No more ranges. Raising last error")
     raise last_error
 
 
-def allocate_in_range(range_id, resource, allocation, context, endpoint, bundle):
+def allocate_in_range(range_id, resource, allocation, context, endpoint, client, address_ids, max_workers):
+    vmName = resource['name']
+    # Attempt to grab 'owner' to work around bug in vRA 8.6 (fixed in 8.6.1)
+    try:
+      owner_string = f" for {resource['owner']} "
+    except:
+      owner_string = " "
+    payload = {
+      'hostname': vmName,
+      'description': f'Reserved by vRA{owner_string}at {datetime.now()}'
+    }
     if int(allocation['size']) ==1:
-      vmName = resource['name']
-      uri = bundle['uri']
-      token = bundle['token']
-      cert = bundle['cert']
-      # Attempt to grab 'owner' to work around bug in vRA 8.6 (fixed in 8.6.1)
-      try:
-        owner_string = f" for {resource['owner']} "
-      except:
-        owner_string = " "
-      payload = {
-        'hostname': vmName,
-        'description': f'Reserved by vRA{owner_string}at {datetime.now()}'
-      }
-      allocate_uri = f'{uri}/addresses/first_free/{str(range_id)}/'
-      allocate_req = requests.post(allocate_uri, data=payload, headers=token, verify=cert)
+      allocate_req = client.post('addresses', 'first_free', range_id, data=payload)
       allocate_req = allocate_req.json()
       if allocate_req['success']:
-        version = ipaddress.ip_address(allocate_req['data']).version
-        result = {
-          "ipAllocationId": allocation['id'],
-          "ipRangeId": range_id,
-          "ipVersion": "IPv" + str(version),
-          "ipAddresses": [allocate_req['data']] 
-        }
-        logging.info(f"Successfully reserved {str(result['ipAddresses'])} for {vmName}.")
+        ipAddresses = [allocate_req['data']]
+        # older phpIPAM versions don't return the id, update_record then looks the address up
+        if allocate_req.get('id') is not None:
+          address_ids.put(allocate_req['data'], allocate_req['id'])
       else:
         raise Exception("Unable to allocate IP!")
+    else:
+      ipAddresses = allocate_block(range_id, int(allocation['size']), payload, client, address_ids, max_workers)
+
+    version = address_to_int(ipAddresses[0])[0]
+    result = {
+      "ipAllocationId": allocation['id'],
+      "ipRangeId": range_id,
+      "ipVersion": "IPv" + str(version),
+      "ipAddresses": ipAddresses
+    }
+    logging.info("Successfully reserved %s for %s.", result['ipAddresses'], vmName)
+    return result
 
-      return result
+def allocate_block(range_id, size, payload, client, address_ids, max_workers):
+    """ Reserves a contiguous block of size addresses in a range.
+        The used addresses of the range are read once and the free run is searched locally,
+        then the addresses of the block are created concurrently, at most max_workers at a time.
+    """
+    subnet_req = client.get('subnets', range_id)
+    if subnet_req.status_code != 200:
+      raise Exception(f"Unable to find range {range_id}: {subnet_req.json().get('message')}")
+    subnet = subnet_req.json()['data']
+    version, network = address_to_int(subnet['subnet'])
+
+    # phpIPAM answers 404 rather than an empty list when a subnet has no addresses
+    addresses_req = client.get('subnets', range_id, 'addresses', stream=True)
+    used = []
+    if addresses_req.status_code == 200:
+      used = [address_to_int(address['ip'])[1] for address in iter_data(addresses_req)]
     else:
-      # TODO: implement allocation of continuous block of IPs
-      pass
-    raise Exception("Not implemented")
+      addresses_req.close()
+
+    # same usable range as the one advertised to vRA by get_ip_ranges
+    first, last = usable_bounds(version, network, int(subnet['mask']))
+    start = find_free_run(first, last, used, size)
+    if start is None:
+      raise Exception(f"No block of {size} contiguous free addresses in range {range_id}")
+    block = [int_to_address(start + offset, version) for offset in range(size)]
+
+    outcomes = concurrent_map(
+      lambda ip: reserve_address(range_id, ip, payload, client, address_ids),
+      block,
+      max_workers
+    )
+    errors = [error for result, error in outcomes if error is not None]
+    if errors:
+      reserved = [ip for ip, (result, error) in zip(block, outcomes) if error is None]
+      leaked = rollback([{"ipRangeId": range_id, "ipAddresses": reserved}], client, max_workers)
+      for ip in reserved:
+        address_ids.discard(ip)
+      if leaked:
+        raise combined_exception(f"{str(errors[0])} (rollback failed to release {', '.join(leaked)})", errors) from errors[0]
+      raise errors[0]
+
+    return block
+
+def find_free_run(first, last, used, size):
+    """ Returns the first address of the lowest run of size free addresses between first and last
+        (inclusive), or None. used is a list of the addresses already taken, as integers.
+    """
+    candidate = first
+    for address in sorted(used):
+      if address < candidate:
+        continue
+      if address > last or address - candidate >= size:
+        break
+      candidate = address + 1
+    if candidate + size - 1 <= last:
+      return candidate
+    return None
+
+def reserve_address(range_id, ip, payload, client, address_ids):
+    reserve_req = client.post('addresses', data=dict(payload, subnetId=range_id, ip=ip))
+    if not reserve_req.json().get('success'):
+      raise Exception(f"Unable to reserve {ip}: {reserve_req.json().get('message')}")
+    address_id = reserve_req.json().get('id')
+    if address_id is not None:
+      address_ids.put(ip, address_id)
+    return ip
 
 ## Rollback any previously allocated addresses in case this allocation request contains multiple ones and failed in the middle
-def rollback(allocation_result, bundle):
-    uri = bundle['uri']
-    token = bundle['token']
-    cert = bundle['cert']
-    for allocation in reversed(allocation_result):
-        logging.info(f"Rolling back allocation {str(allocation)}")
-        ipAddresses = allocation.get("ipAddresses", None)
-        for ipAddress in ipAddresses:
-          rollback_uri = f'{uri}/addresses/{allocation.get("id")}/'
-          requests.delete(rollback_uri, headers=token, verify=cert)
-
-    return
+def rollback(allocation_result, client, max_workers):
+    """ Releases every address of allocation_result concurrently.
+        Returns the addresses which could not be released, so that they can be reported.
+    """
+    addresses = [(ipAddress, allocation["ipRangeId"]) for allocation in allocation_result for ipAddress in allocation.get("ipAddresses", [])]
+    logging.info("Rolling back %s allocated addresses", len(addresses))
+    outcomes = concurrent_map(lambda address: client.release_address(*address), addresses, max_workers)
+
+    leaked = []
+    for (ipAddress, range_id), (result, error) in zip(addresses, outcomes):
+        if error is not None:
+          logging.error("Failed to roll back %s in range %s: %s", ipAddress, range_id, error)
+          leaked.append(f"{ipAddress} in range {range_id}")
+    return leaked
@@ -9,10 +9,17 @@ and license terms. Your use of these subcomponents is subject to the terms and
 conditions of the subcomponent's license, as noted in the LICENSE file.
 """
 
-import requests
 from vra_ipam_utils.ipam import IPAM
+from vra_ipam_utils.client import PhpIpamClient, error_message
+from vra_ipam_utils.geometry import BITS, address_to_int, find_free_prefix, int_to_address, network_bounds
+from vra_ipam_utils.ranges import build_ip_range
+from vra_ipam_utils.subnet_index import SubnetIndex
+from datetime import datetime
 import logging
 
+## Attempts at creating a range when a concurrent allocation takes the free space first
+MAX_ATTEMPTS = 10
+
 """
 Example payload
 
@@ -71,69 +78,124 @@ def handler(context, inputs):
     return ipam.allocate_ip_range()
 
 def do_allocate_ip_range(self, auth_credentials, cert):
-    # Your implemention goes here
-
-    username = auth_credentials["privateKeyId"]
-    password = auth_credentials["privateKey"]
+    client = PhpIpamClient.from_endpoint(self.inputs["endpoint"]["endpointProperties"], auth_credentials, cert)
 
     resource = self.inputs["resourceInfo"]
     allocation = self.inputs["ipRangeAllocation"]
-    ipRange = allocate(resource, allocation, self.context, self.inputs["endpoint"])
+    ipRange = allocate(resource, allocation, client)
 
     return {
         "ipRange": ipRange
     }
 
-def allocate(resource, allocation, context, endpoint):
+def allocate(resource, allocation, client):
 
     last_error = None
     for ip_block_id in allocation["ipBlockIds"]:
 
-        logging.info(f"Allocating from ip block {ip_block_id}")
+        logging.info("Allocating from ip block %s", ip_block_id)
         try:
-            return allocate_in_ip_block(ip_block_id, resource, allocation, context, endpoint)
+            return allocate_in_ip_block(ip_block_id, resource, allocation, client)
         except Exception as e:
             last_error = e
-            logging.error(f"Failed to allocate from ip block {ip_block_id}: {str(e)}")
+            logging.error("Failed to allocate from ip block %s: %s", ip_block_id, e)
 
     logging.error("No more ip blocks. Raising last error")
     raise last_error
 
-
-def allocate_in_ip_block(ip_block_id, resource, allocation, context, endpoint):
-
-    ## Plug your implementation here to allocate an ip range
-    ## ...
-    ## Allocation successful
-
-    result = {
-        "id": "range-new",
-
-        "name": "sample range new",
-
-        "startIPAddress": "10.10.40.1",
-
-        "endIPAddress": "10.10.40.10",
-
-        "description": "sampleDescription",
-
-        "ipVersion": "IPv4",
-
-        "addressSpaceId": "default",
-
-        "subnetPrefixLength": "24",
-
-        "gatewayAddress": "10.10.13.1",
-
-        "domain": "test.local",
-
-        "tags": [{
-            "key": "Building",
-            "value": "VMware main facility"
-        }],
-
-        "properties": {
-        }
+def get_prefix_length(allocation):
+    """ Returns the prefix length of the requested range, e.g. 28 for a subnetCidr of 192.168.197.0/28 """
+    if allocation.get("subnetPrefixLength"):
+        return int(allocation["subnetPrefixLength"])
+    return int(str(allocation["subnetCidr"]).split('/')[1])
+
+def get_used_intervals(client, block_id):
+    """ Returns the (start, end) integer intervals of the subnets nested in a block """
+    used = []
+    for child in client.stream('subnets', block_id, 'slaves'):
+      version, network = address_to_int(child['subnet'])
+      used.append(network_bounds(version, network, int(child['mask'])))
+    return used
+
+def get_section_intervals(client, block, block_start, block_end):
+    """ Returns the (start, end) integer intervals of the subnets of the block's section and VRF
+        which overlap the block, other than the block and the subnets containing it
+    """
+    vrf_id = str(block.get('vrfId') or '0')
+    index = SubnetIndex(subnet for subnet in client.stream('sections', block['sectionId'], 'subnets')
+                        if str(subnet.get('vrfId') or '0') == vrf_id)
+    version = address_to_int(block['subnet'])[0]
+    return [(start, end) for start, end, _, _ in index.overlapping(version, block_start, block_end)
+            if not (start <= block_start and end >= block_end)]
+
+def allocate_in_ip_block(ip_block_id, resource, allocation, client):
+    block_req = client.get('subnets', ip_block_id)
+    if block_req.status_code != 200:
+      raise Exception(f"Unable to find ip block {ip_block_id}: {error_message(block_req)}")
+    block = block_req.json()['data']
+    version, network = address_to_int(block['subnet'])
+    block_start, block_end = network_bounds(version, network, int(block['mask']))
+    prefix_length = get_prefix_length(allocation)
+    if not int(block['mask']) < prefix_length <= BITS[version]:
+      raise Exception(f"Ip block {block['subnet']}/{block['mask']} can't hold a /{prefix_length} range")
+
+    payload = {
+      'sectionId': block['sectionId'],
+      'masterSubnetId': block['id'],
+      'description': f"Reserved by vRA for {allocation.get('name') or resource['name']} at {datetime.now()}",
+      'nameserverId': block.get('nameserverId') or '0'
     }
-
+    # Another deployment may carve the same free space concurrently, or the candidate overlaps a
+    # subnet of the section outside the block. phpIPAM then rejects the overlapping subnet, and the
+    # subnets of the section are listed once so that the next candidate avoids all of them
+    used = get_used_intervals(client, ip_block_id)
+    section_listed = False
+    for attempt in range(MAX_ATTEMPTS):
+      start = find_free_prefix(block_start, block_end, used, BITS[version] - prefix_length)
+      if start is None:
+        raise Exception(f"No free /{prefix_length} range left in ip block {block['subnet']}/{block['mask']}")
+      subnet = int_to_address(start, version)
+      create_req = client.post('subnets', data=dict(payload, subnet=subnet, mask=prefix_length))
+      if create_req.status_code in (200, 201) and create_req.json().get('success'):
+        break
+      if create_req.status_code != 409 and 'overlap' not in error_message(create_req).lower():
+        raise Exception(f"Unable to create range {subnet}/{prefix_length}: {error_message(create_req)}")
+      logging.info("Range %s/%s overlaps another subnet, trying the next free one", subnet, prefix_length)
+      used.append(network_bounds(version, start, prefix_length))
+      if not section_listed:
+        used.extend(get_section_intervals(client, block, block_start, block_end))
+        section_listed = True
+    else:
+      raise Exception(f"Unable to create a /{prefix_length} range in ip block {block['subnet']}/{block['mask']} after {MAX_ATTEMPTS} attempts")
+
+    range_id = str(create_req.json()['id'])
+    logging.info("Created range %s/%s with id %s in ip block %s", subnet, prefix_length, range_id, ip_block_id)
+    # vRA never learns about a range whose allocation fails, so it is deleted rather than left behind
+    try:
+      subnet_req = client.get('subnets', range_id)
+      if subnet_req.status_code != 200:
+        raise Exception(f"Unable to read back range {subnet}/{prefix_length}: {error_message(subnet_req)}")
+      result = build_ip_range(subnet_req.json()['data'])
+      result['addressSpaceId'] = allocation.get('addressSpaceId', 'default')
+      if prefix_length < BITS[version] - 1:
+        result['gatewayAddress'] = reserve_gateway(client, range_id, result['startIPAddress'])
+    except Exception:
+      delete_range(client, range_id)
+      raise
     return result
+
+def delete_range(client, range_id):
+    """ Deletes a range created by a failed allocation, only logging a failure so that the original error is raised """
+    try:
+      delete_req = client.delete('subnets', range_id)
+      if delete_req.status_code not in (200, 404):
+        logging.error("Unable to delete range %s after a failed allocation: %s", range_id, error_message(delete_req))
+    except Exception as e:
+      logging.error("Unable to delete range %s after a failed allocation: %s", range_id, e)
+
+def reserve_gateway(client, range_id, ip):
+    """ Marks the first usable address of a new range as its gateway so that it is never allocated """
+    gateway_req = client.post('addresses', data={'subnetId': range_id, 'ip': ip, 'is_gateway': 1, 'description': 'Gateway'})
+    if not gateway_req.json().get('success'):
+      logging.warning("Unable to reserve gateway %s in range %s: %s", ip, range_id, error_message(gateway_req))
+    return ip
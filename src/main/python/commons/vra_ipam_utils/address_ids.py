@@ -0,0 +1,80 @@
+"""
+Copyright (c) 2020 VMware, Inc.
+
+This product is licensed to you under the Apache License, Version 2.0 (the "License").
+You may not use this product except in compliance with the License.
+
+This product may include a number of subcomponents with separate copyright notices
+and license terms. Your use of these subcomponents is subject to the terms and
+conditions of the subcomponent's license, as noted in the LICENSE file.
+"""
+
+import hashlib
+import json
+import logging
+import threading
+import time
+
+from vra_ipam_utils.cache import cache_path, write_private_file
+
+## vRA updates the records of a machine shortly after allocating its addresses, so the
+## phpIPAM ids returned at allocation time are only remembered for a day.
+DEFAULT_ADDRESS_ID_TTL = 86400
+MAX_ADDRESS_IDS = 10000
+
+class AddressIdCache(object):
+    """ Remembers the phpIPAM id of the addresses allocated by this integration, keyed by ip.
+
+        An id may be stale if the address was deleted and created again in the meantime,
+        so callers fall back to searching phpIPAM when the cached id is rejected.
+    """
+
+    def __init__(self, uri, ttl=DEFAULT_ADDRESS_ID_TTL):
+        self.path = cache_path("address_ids", hashlib.sha256(uri.encode()).hexdigest() + ".json")
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = None
+        self.updates = {}
+
+    def get(self, ip):
+        with self.lock:
+            if self.entries is None:
+                self.entries = self._load()
+            entry = self.updates.get(ip) or self.entries.get(ip)
+        if entry is None or entry['expires'] <= time.time():
+            return None
+        return entry['id']
+
+    def put(self, ip, address_id):
+        with self.lock:
+            self.updates[ip] = {'id': str(address_id), 'expires': time.time() + self.ttl}
+
+    def discard(self, ip):
+        with self.lock:
+            self.updates[ip] = {'id': None, 'expires': 0}
+
+    def save(self):
+        """ Merges the entries added or discarded since the cache was loaded into the file """
+        with self.lock:
+            if not self.updates:
+                return
+            now = time.time()
+            entries = self._load()
+            entries.update(self.updates)
+            entries = {ip: entry for ip, entry in entries.items() if entry['expires'] > now}
+            if len(entries) > MAX_ADDRESS_IDS:
+                newest = sorted(entries.items(), key=lambda item: item[1]['expires'])[-MAX_ADDRESS_IDS:]
+                entries = dict(newest)
+            try:
+                write_private_file(self.path, json.dumps(entries, separators=(",", ":")))
+            except OSError as e:
+                logging.warning("Unable to persist the address id cache: %s", e)
+            self.entries = entries
+            self.updates = {}
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
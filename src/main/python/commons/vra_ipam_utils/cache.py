@@ -0,0 +1,89 @@
+"""
+Copyright (c) 2020 VMware, Inc.
+
+This product is licensed to you under the Apache License, Version 2.0 (the "License").
+You may not use this product except in compliance with the License.
+
+This product may include a number of subcomponents with separate copyright notices
+and license terms. Your use of these subcomponents is subject to the terms and
+conditions of the subcomponent's license, as noted in the LICENSE file.
+"""
+
+import logging
+import os
+import stat
+import tempfile
+import threading
+
+## ABX keeps a container warm between consecutive runs of an action, so state written
+## under the temp directory can be picked up by the next invocation.
+CACHE_DIR = os.path.join(tempfile.gettempdir(), "vra_ipam_utils")
+
+## Directory used instead of CACHE_DIR when that one can't be trusted, see _cache_dir
+_private_dir = None
+_private_dir_lock = threading.Lock()
+
+def _is_private_dir(path):
+    """ Tells whether path is a real directory (not a symlink) owned by and only open to the current user """
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode):
+        return False
+    if hasattr(os, "getuid") and st.st_uid != os.getuid():
+        return False
+    return st.st_mode & 0o077 == 0
+
+def _cache_dir():
+    """ Returns CACHE_DIR, unless another user created it first (the temp directory is shared),
+        in which case that user could read or plant cached files. The cache then falls back
+        to a private directory which only lasts as long as the interpreter.
+    """
+    global _private_dir
+    os.makedirs(CACHE_DIR, mode=0o700, exist_ok=True)
+    if _is_private_dir(CACHE_DIR):
+        return CACHE_DIR
+    with _private_dir_lock:
+        if _private_dir is None:
+            logging.warning("%s is not private to the current user, caching in a private directory instead", CACHE_DIR)
+            _private_dir = tempfile.mkdtemp(prefix="vra_ipam_utils-")
+        return _private_dir
+
+def cache_path(*name):
+    """ Returns the path of a file in the cache directory, creating its parent directories """
+    path = os.path.join(_cache_dir(), *name)
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    return path
+
+def write_private_file(path, content):
+    """ Atomically replaces path with content, readable only by the current user """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+## Secrets which could not be persisted only last as long as the interpreter
+_secrets = {}
+_secrets_lock = threading.Lock()
+
+def get_secret(*name):
+    """ Returns the random 32 bytes secret stored at name in the cache directory, creating it if needed.
+        If it can't be persisted, a secret private to this interpreter is returned instead.
+    """
+    path = cache_path(*name)
+    with _secrets_lock:
+        secret = _secrets.get(path)
+        if secret is None:
+            try:
+                with open(path) as f:
+                    return bytes.fromhex(f.read())
+            except (OSError, ValueError):
+                pass
+            secret = os.urandom(32)
+            try:
+                write_private_file(path, secret.hex())
+            except OSError:
+                _secrets[path] = secret
+        return secret
@@ -0,0 +1,130 @@
+"""
+Copyright (c) 2020 VMware, Inc.
+
+This product is licensed to you under the Apache License, Version 2.0 (the "License").
+You may not use this product except in compliance with the License.
+
+This product may include a number of subcomponents with separate copyright notices
+and license terms. Your use of these subcomponents is subject to the terms and
+conditions of the subcomponent's license, as noted in the LICENSE file.
+"""
+
+from vra_ipam_utils.concurrency import get_max_concurrency
+from vra_ipam_utils.metrics import record_response
+from vra_ipam_utils.streaming import iter_data
+from vra_ipam_utils.token_cache import PhpIpamTokenAuth
+
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 120
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF_FACTOR = 0.5
+
+class PhpIpamClient(object):
+    """ Client for the phpIPAM REST API shared by all the actions.
+
+        Requests go through a single keep-alive connection pool, so the TCP and TLS
+        handshakes are paid once per action run rather than once per request.
+        Authentication is handled by PhpIpamTokenAuth.
+    """
+
+    def __init__(self, hostname, app_id, auth, cert, pool_size=None, connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout=DEFAULT_READ_TIMEOUT, max_retries=DEFAULT_MAX_RETRIES, backoff_factor=DEFAULT_BACKOFF_FACTOR):
+        # An explicit scheme is honoured so that the actions can be pointed at a local test server
+        base = hostname.rstrip('/') if '://' in hostname else f'https://{hostname}'
+        self.uri = f'{base}/api/{app_id}'
+        self.cert = cert
+        self.timeout = (connect_timeout, read_timeout)
+
+        # requests is only imported once a client is built, see vra_ipam_utils.lazy
+        from vra_ipam_utils.transport import build_session
+        self.session = build_session(cert, pool_size, max_retries, backoff_factor)
+        self.session.hooks['response'].append(record_response)
+        self.token_auth = PhpIpamTokenAuth(self.uri, auth, session=self.session, timeout=self.timeout)
+        self.session.auth = self.token_auth
+
+    @classmethod
+    def from_endpoint(cls, endpoint_properties, auth_credentials, cert):
+        """ Builds a client from the endpoint properties and auth credentials passed to an action """
+        auth = (auth_credentials["privateKeyId"], auth_credentials["privateKey"])
+        return cls(
+            endpoint_properties["hostName"],
+            endpoint_properties["apiAppId"],
+            auth,
+            cert,
+            pool_size=get_max_concurrency(endpoint_properties),
+            connect_timeout=_get_number(endpoint_properties, "connectTimeout", DEFAULT_CONNECT_TIMEOUT),
+            read_timeout=_get_number(endpoint_properties, "readTimeout", DEFAULT_READ_TIMEOUT),
+            max_retries=int(_get_number(endpoint_properties, "maxRetries", DEFAULT_MAX_RETRIES))
+        )
+
+    def url(self, *path):
+        return '/'.join([self.uri] + [str(segment).strip('/') for segment in path]) + '/'
+
+    def request(self, method, *path, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.request(method, self.url(*path), **kwargs)
+
+    def get(self, *path, **kwargs):
+        return self.request('GET', *path, **kwargs)
+
+    def post(self, *path, **kwargs):
+        return self.request('POST', *path, **kwargs)
+
+    def patch(self, *path, **kwargs):
+        return self.request('PATCH', *path, **kwargs)
+
+    def delete(self, *path, **kwargs):
+        return self.request('DELETE', *path, **kwargs)
+
+    def stream(self, *path, **kwargs):
+        """ Returns an iterator over the records listed at path, decoded as they are received.
+            phpIPAM answers 404 when a list is empty, which yields nothing.
+        """
+        req = self.get(*path, stream=True, **kwargs)
+        if req.status_code == 404:
+            req.close()
+            return iter(())
+        if req.status_code != 200:
+            message = error_message(req)
+            req.close()
+            raise Exception(f"Failed to list /{'/'.join(str(segment) for segment in path)}/: {message}")
+        return iter_data(req)
+
+    def release_address(self, ip, subnet_id):
+        """ Deletes address ip from subnet subnet_id.
+            Returns True if it was deleted and False if it didn't exist anymore, which isn't an
+            error so that retries are harmless.
+        """
+        req = self.delete('addresses', ip, subnet_id)
+        if req.status_code == 200:
+            return True
+        if req.status_code == 404:
+            return False
+        raise Exception(f"Unable to release {ip} from subnet {subnet_id}: {error_message(req)}")
+
+    def login(self):
+        """ Authenticates with the user credentials and returns the raw phpIPAM response """
+        return self.token_auth.login()
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def _get_number(endpoint_properties, name, default):
+    try:
+        value = float(endpoint_properties.get(name, default))
+        return value if value >= 0 else default
+    except (TypeError, ValueError):
+        return default
+
+def error_message(response):
+    """ Extracts the error message from a phpIPAM response """
+    try:
+        return f"HTTP {response.status_code}: {response.json()['message']}"
+    except (ValueError, KeyError, TypeError):
+        return f"HTTP {response.status_code}: {response.text}"
@@ -0,0 +1,58 @@
+"""
+Copyright (c) 2020 VMware, Inc.
+
+This product is licensed to you under the Apache License, Version 2.0 (the "License").
+You may not use this product except in compliance with the License.
+
+This product may include a number of subcomponents with separate copyright notices
+and license terms. Your use of these subcomponents is subject to the terms and
+conditions of the subcomponent's license, as noted in the LICENSE file.
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_MAX_CONCURRENCY = 8
+
+def get_max_concurrency(endpoint_properties):
+    """ Reads the size of the worker pool from the endpoint properties """
+    try:
+        return max(1, int(endpoint_properties.get("maxConcurrency", DEFAULT_MAX_CONCURRENCY)))
+    except (TypeError, ValueError):
+        return DEFAULT_MAX_CONCURRENCY
+
+def concurrent_map(func, items, max_workers, progress=None):
+    """ Applies func to every item on a bounded thread pool.
+
+        Returns a list of (result, error) tuples in the same order as items, so that
+        a failure on one item doesn't abort the processing of the others.
+        progress, if given, is called with (done, total) each time an item completes.
+    """
+    items = list(items)
+    done = [0]
+    lock = threading.Lock()
+
+    def call(item):
+        try:
+            return func(item), None
+        except Exception as e:
+            return None, e
+        finally:
+            if progress is not None:
+                with lock:
+                    done[0] += 1
+                    progress(done[0], len(items))
+
+    if max_workers <= 1 or len(items) <= 1:
+        return [call(item) for item in items]
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(call, items))
+
+def log_progress(action, step=10):
+    """ Returns a concurrent_map progress callback logging every step percent """
+    def progress(done, total):
+        if done == total or done * 100 // total // step != (done - 1) * 100 // total // step:
+            logging.info("%s: %s/%s done", action, done, total)
+    return progress
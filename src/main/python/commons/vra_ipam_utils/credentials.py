@@ -0,0 +1,105 @@
+"""
+Copyright (c) 2020 VMware, Inc.
+
+This product is licensed to you under the Apache License, Version 2.0 (the "License").
+You may not use this product except in compliance with the License.
+
+This product may include a number of subcomponents with separate copyright notices
+and license terms. Your use of these subcomponents is subject to the terms and
+conditions of the subcomponent's license, as noted in the LICENSE file.
+"""
+
+import base64
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from vra_ipam_utils.cache import cache_path, get_secret, write_private_file
+
+## Credentials edited in vRA keep their authCredentialsLink, so they are only cached briefly.
+## They are also dropped as soon as phpIPAM rejects them.
+DEFAULT_CREDENTIAL_TTL = 300
+
+## Credentials cached by the actions which ran in this interpreter, keyed by authCredentialsLink
+_memory = {}
+_memory_lock = threading.Lock()
+
+def get_credential_ttl(endpoint_properties):
+    """ Returns the credentialCacheTtl endpoint setting in seconds, 0 disabling the cache """
+    try:
+        ttl = int(endpoint_properties.get("credentialCacheTtl", DEFAULT_CREDENTIAL_TTL))
+    except (TypeError, ValueError):
+        return DEFAULT_CREDENTIAL_TTL
+    return max(ttl, 0)
+
+class CredentialCache(object):
+    """ Caches the credentials fetched from vRA, so that warm ABX containers skip that round trip.
+
+        Credentials are kept in memory, and on disk encrypted with Fernet when the cryptography
+        package is available. The key is derived from the authCredentialsLink and a random secret
+        which is itself a file of the cache directory, readable by the action's user only. The
+        encryption therefore only keeps the credentials out of casual reads of the cache files:
+        anyone able to copy the whole directory can decrypt them. Without cryptography, credentials
+        are never written to disk.
+    """
+
+    def __init__(self, ttl=DEFAULT_CREDENTIAL_TTL):
+        self.ttl = ttl
+
+    def get(self, link):
+        if self.ttl <= 0:
+            return None
+        with _memory_lock:
+            entry = _memory.get(link)
+        if entry is not None and entry['expires'] > time.time():
+            return dict(entry['credentials'])
+
+        fernet = self._fernet(link)
+        if fernet is None:
+            return None
+        from cryptography.fernet import InvalidToken
+        try:
+            with open(self._path(link), 'rb') as f:
+                credentials = json.loads(fernet.decrypt(f.read(), ttl=self.ttl))
+        except (OSError, ValueError, InvalidToken):
+            return None
+        with _memory_lock:
+            _memory[link] = {'credentials': credentials, 'expires': time.time() + self.ttl}
+        return dict(credentials)
+
+    def put(self, link, credentials):
+        if self.ttl <= 0:
+            return
+        with _memory_lock:
+            _memory[link] = {'credentials': dict(credentials), 'expires': time.time() + self.ttl}
+
+        fernet = self._fernet(link)
+        if fernet is None:
+            return
+        try:
+            write_private_file(self._path(link), fernet.encrypt(json.dumps(credentials).encode()).decode())
+        except OSError as e:
+            logging.warning("Unable to persist the credential cache: %s", e)
+
+    def invalidate(self, link):
+        with _memory_lock:
+            _memory.pop(link, None)
+        try:
+            os.remove(self._path(link))
+        except OSError:
+            pass
+
+    def _path(self, link):
+        return cache_path("credentials", hashlib.sha256(link.encode()).hexdigest() + ".fernet")
+
+    def _fernet(self, link):
+        """ Returns the Fernet cipher of link, or None if cryptography isn't installed """
+        try:
+            from cryptography.fernet import Fernet
+        except ImportError:
+            return None
+        key = hashlib.sha256(get_secret("credentials", "secret") + link.encode()).digest()
+        return Fernet(base64.urlsafe_b64encode(key))
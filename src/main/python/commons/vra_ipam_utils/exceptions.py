@@ -4,4 +4,19 @@ class InvalidCertificateException(Exception):
         super().__init__(message)
         
         self.host = host
-        self.port = port
\ No newline at end of file
+        self.port = port
+
+class InvalidFilterException(Exception):
+    pass
+
+class AuthenticationException(Exception):
+    """ phpIPAM rejected the credentials of the integration """
+    pass
+
+def combined_exception(message, errors):
+    """ Returns the exception reporting errors of concurrent requests as a whole. It is an
+        AuthenticationException if any of them is one, so that IPAM still drops the cached credentials.
+    """
+    if any(isinstance(error, AuthenticationException) for error in errors):
+        return AuthenticationException(message)
+    return Exception(message)
@@ -0,0 +1,116 @@
+"""
+Copyright (c) 2020 VMware, Inc.
+
+This product is licensed to you under the Apache License, Version 2.0 (the "License").
+You may not use this product except in compliance with the License.
+
+This product may include a number of subcomponents with separate copyright notices
+and license terms. Your use of these subcomponents is subject to the terms and
+conditions of the subcomponent's license, as noted in the LICENSE file.
+"""
+
+import re
+from collections import namedtuple
+
+from vra_ipam_utils.exceptions import InvalidFilterException
+
+## Subnet filters are written as conditions separated by ';' or new lines, for instance
+##   sectionId=3; vlanId=100,101; custom_Environment~^prod
+## '=' matches any of a comma separated list of values, '!=' none of them and '~' a regular expression.
+
+Condition = namedtuple('Condition', ['field', 'operator', 'values'])
+
+def parse_conditions(text):
+    """ Parses the filterConditions endpoint setting into a list of Condition """
+    conditions = []
+    for clause in re.split(r'[;\n]', text or ''):
+        clause = clause.strip()
+        if not clause:
+            continue
+        # the field name ends at the first operator, values may contain operator characters
+        match = re.search(r'!=|=|~', clause)
+        field = clause[:match.start()].strip() if match else ''
+        if not field:
+            raise InvalidFilterException(f"Invalid subnet filter condition '{clause}', expected <field>=<value>, <field>!=<value> or <field>~<regex>")
+        operator, value = match.group(), clause[match.end():]
+        if operator == '~':
+            try:
+                values = [re.compile(value.strip())]
+            except re.error as e:
+                raise InvalidFilterException(f"Invalid regular expression in subnet filter condition '{clause}': {str(e)}") from e
+        else:
+            values = [v.strip() for v in value.split(',')]
+        conditions.append(Condition(field, operator, values))
+    return conditions
+
+def get_filter(endpoint_properties):
+    """ Builds the SubnetFilter described by the endpoint properties, or None if filtering is disabled """
+    if str(endpoint_properties.get("enableFilter")).lower() != "true":
+        return None
+    conditions = parse_conditions(endpoint_properties.get("filterConditions"))
+    if not conditions and endpoint_properties.get("filterField"):
+        # single condition configured by earlier versions of the integration
+        conditions = [Condition(endpoint_properties["filterField"], '=', [str(endpoint_properties.get("filterValue", ""))])]
+    match_any = str(endpoint_properties.get("filterMatch", "all")).lower() == "any"
+    return SubnetFilter(conditions, match_any)
+
+class SubnetFilter(object):
+    """ Set of conditions subnets must match, either all of them or any of them.
+
+        plan() splits the conditions in the query phpIPAM can evaluate itself and the
+        residual conditions which are evaluated locally by matches().
+    """
+
+    def __init__(self, conditions, match_any=False):
+        self.conditions = conditions
+        self.match_any = match_any
+
+    def key(self):
+        return [self.match_any] + [[c.field, c.operator, [getattr(v, 'pattern', v) for v in c.values]] for c in self.conditions]
+
+    def plan(self):
+        """ Returns (path, params, residual): the subnets API path and query parameters to request,
+            and the conditions which still have to be checked on each returned subnet
+        """
+        path = ('subnets',)
+        params = {}
+        residual = list(self.conditions)
+        if not residual:
+            return path, params, residual
+
+        # A disjunction of several conditions can't be expressed with a single phpIPAM filter.
+        # Only filters phpIPAM evaluates the same way on every version are pushed down: the section
+        # and a single value equality. Value lists and regular expressions would need
+        # filter_match=regex, which servers without it treat as an equality that matches nothing,
+        # and rows the server doesn't send can't be brought back by the local check.
+        if self.match_any and len(residual) > 1:
+            return path, params, residual
+
+        for c in residual:
+            if c.field == 'sectionId' and c.operator == '=' and len(c.values) == 1:
+                path = ('sections', c.values[0], 'subnets')
+                residual.remove(c)
+                break
+
+        for c in residual:
+            if c.operator == '=' and len(c.values) == 1:
+                params = {'filter_by': c.field, 'filter_value': c.values[0]}
+                residual.remove(c)
+                break
+        return path, params, residual
+
+    def matches(self, subnet, conditions=None):
+        conditions = self.conditions if conditions is None else conditions
+        if not conditions:
+            return True
+        results = (_matches(c, subnet) for c in conditions)
+        return any(results) if self.match_any else all(results)
+
+def _matches(condition, subnet):
+    value = subnet.get(condition.field)
+    value = '' if value is None else str(value)
+    if condition.operator == '~':
+        return condition.values[0].search(value) is not None
+    if condition.operator == '!=':
+        return value not in condition.values
+    return value in condition.values
@@ -0,0 +1,86 @@
+"""
+Copyright (c) 2020 VMware, Inc.
+
+This product is licensed to you under the Apache License, Version 2.0 (the "License").
+You may not use this product except in compliance with the License.
+
+This product may include a number of subcomponents with separate copyright notices
+and license terms. Your use of these subcomponents is subject to the terms and
+conditions of the subcomponent's license, as noted in the LICENSE file.
+"""
+
+import socket
+from collections import namedtuple
+
+## Usable addresses of a subnet, computed with integer math rather than ipaddress objects:
+## - IPv4 subnets exclude their network and broadcast addresses.
+## - IPv6 subnets only exclude the Subnet-Router anycast address (the first one); there is no broadcast.
+## - Point-to-point prefixes (/31 and /127, RFC 3021 and RFC 6164) use both addresses.
+## - Host prefixes (/32 and /128) consist of their single address.
+
+RangeGeometry = namedtuple('RangeGeometry', ['version', 'prefix_length', 'first', 'last'])
+
+_FAMILIES = {4: (socket.AF_INET, 4), 6: (socket.AF_INET6, 16)}
+
+## Address length in bits of each IP version
+BITS = {4: 32, 6: 128}
+
+def address_to_int(address):
+    """ Returns (version, integer value) of an IPv4 or IPv6 address string """
+    version = 6 if ':' in address else 4
+    family = _FAMILIES[version][0]
+    try:
+        return version, int.from_bytes(socket.inet_pton(family, address), 'big')
+    except OSError:
+        raise ValueError(f"'{address}' does not appear to be an IPv{version} address") from None
+
+def int_to_address(value, version):
+    family, size = _FAMILIES[version]
+    return socket.inet_ntop(family, value.to_bytes(size, 'big'))
+
+def network_bounds(version, network, prefix_length):
+    """ Returns the (first, last) addresses of the network containing address network, as integers """
+    bits = BITS[version]
+    if not 0 <= prefix_length <= bits:
+        raise ValueError(f"Invalid IPv{version} prefix length {prefix_length}")
+    host_mask = (1 << (bits - prefix_length)) - 1
+    return network & ~host_mask, network | host_mask
+
+def usable_bounds(version, network, prefix_length):
+    """ Returns the (first, last) usable addresses of a network, as integers """
+    first, last = network_bounds(version, network, prefix_length)
+    if BITS[version] - prefix_length <= 1:
+        return first, last
+    if version == 4:
+        return first + 1, last - 1
+    return first + 1, last
+
+def range_geometry(subnet, mask):
+    """ Returns the RangeGeometry of the phpIPAM subnet address/mask, addresses formatted as strings """
+    version, network = address_to_int(str(subnet))
+    prefix_length = int(mask)
+    first, last = usable_bounds(version, network, prefix_length)
+    return RangeGeometry(version, prefix_length, int_to_address(first, version), int_to_address(last, version))
+
+def find_free_prefix(start, end, used, host_bits):
+    """ Returns the lowest network of 2**host_bits addresses, aligned on its size, which fits in
+        [start, end] without overlapping any of the used (start, end) intervals, or None.
+
+        Like a buddy allocator, candidates only ever sit on aligned boundaries, and the search
+        jumps past each used interval instead of probing the candidates in between. It is linear
+        in the number of used intervals whatever the size of the block.
+    """
+    size = 1 << host_bits
+    candidate = _align_up(start, size)
+    for used_start, used_end in sorted(used):
+        if used_end < candidate:
+            continue
+        if used_start > candidate + size - 1:
+            break
+        candidate = _align_up(used_end + 1, size)
+    if candidate + size - 1 <= end:
+        return candidate
+    return None
+
+def _align_up(value, size):
+    return (value + size - 1) & ~(size - 1)
@@ -10,10 +10,16 @@ conditions of the subcomponent's license, as noted in the LICENSE file.
 """
 
 import json
-import tempfile
+import hashlib
 import os
 import logging
-from vra_ipam_utils.exceptions import InvalidCertificateException
+from vra_ipam_utils import metrics
+from vra_ipam_utils.cache import cache_path, write_private_file
+from vra_ipam_utils.credentials import CredentialCache, get_credential_ttl
+from vra_ipam_utils.exceptions import AuthenticationException, InvalidCertificateException
+from vra_ipam_utils.lazy import preload
+from vra_ipam_utils.logs import get_log_level, setup_logging
+from vra_ipam_utils.validation import validate_response, validation_enabled
 
 class IPAM(object):
     """ IPAM holds util methods for interacting with vRA's IPAM service.
@@ -34,189 +40,53 @@ class IPAM(object):
         # Setup the logging globally
         self._setup_logger()
 
+        # Load requests while the credentials are fetched from vRA
+        preload()
+
     def validate_endpoint(self):
 
-        cert = None
         try:
-            auth_credentials = self._get_auth_credentials()
-            cert = self._get_cert()
-
-            return self.do_validate_endpoint(auth_credentials, cert)
+            return self._run("validate_endpoint", self.do_validate_endpoint)
         except InvalidCertificateException as e:
-            return {
-                "certificateInfo": {
-                    "certificate": self._fetch_server_certificate(e.host, e.port)
-                },
-                "error": self._build_error_response("3002", str(e))["error"] ## Return special status code "3002" on invalid certificate
-            }
-        finally:
-            if cert is not None and type(cert) is str:
-                os.unlink(cert)
+            try:
+                return {
+                    "certificateInfo": {
+                        "certificate": self._fetch_server_certificate(e.host, e.port)
+                    },
+                    "error": self._build_error_response("3002", str(e))["error"] ## Return special status code "3002" on invalid certificate
+                }
+            finally:
+                self.log_buffer.flush()
 
 
     def get_ip_ranges(self):
 
-        cert = None
-        try:
-            auth_credentials = self._get_auth_credentials()
-            cert = self._get_cert()
-
-            result = self.do_get_ip_ranges(auth_credentials, cert)
-
-            # Validation of returned result
-            err_msg = "{} is mandatory part of the response schema and must be present in the response"
-            assert result.get("ipRanges") is not None, err_msg.format("ipRanges")
-            assert isinstance(result["ipRanges"], list), "ipRanges must be a list type"
-            for i in range(len(result["ipRanges"])):
-                assert result["ipRanges"][i].get("id") is not None, err_msg.format(f"ipRanges[{i}]['id']")
-                assert result["ipRanges"][i].get("name") is not None, err_msg.format(f"ipRanges[{i}]['name']")
-                assert result["ipRanges"][i].get("startIPAddress") is not None, err_msg.format(f"ipRanges[{i}]['startIPAddress']")
-                assert result["ipRanges"][i].get("endIPAddress") is not None, err_msg.format(f"ipRanges[{i}]['endIPAddress']")
-                assert result["ipRanges"][i].get("ipVersion") is not None, err_msg.format(f"ipRanges[{i}]['ipVersion']")
-                assert result["ipRanges"][i].get("subnetPrefixLength") is not None, err_msg.format(f"ipRanges[{i}]['subnetPrefixLength']")
-
-            return result
-        finally:
-            if cert is not None and type(cert) is str:
-                os.unlink(cert)
+        return self._run("get_ip_ranges", self.do_get_ip_ranges)
 
 
     def allocate_ip(self):
 
-        cert = None
-        try:
-            auth_credentials = self._get_auth_credentials()
-            cert = self._get_cert()
-
-            result = self.do_allocate_ip(auth_credentials, cert)
-
-             # Validation of returned result
-            err_msg = "{} is mandatory part of the response schema and must be present in the response"
-            assert result.get("ipAllocations") is not None, err_msg.format("ipAllocations")
-            assert isinstance(result["ipAllocations"], list), "ipAllocations must be a list type"
-            assert len(result["ipAllocations"]) == len(self.inputs["ipAllocations"]), "Size of ipAllocations in the inputs is different than the one in the outputs"
-            for i in range(len(result["ipAllocations"])):
-                assert result["ipAllocations"][i].get("ipAllocationId") is not None, err_msg.format(f"ipAllocations[{i}]['ipAllocationId']")
-                assert result["ipAllocations"][i].get("ipRangeId") is not None, err_msg.format(f"ipAllocations[{i}]['ipRangeId']")
-                assert result["ipAllocations"][i].get("ipVersion") is not None, err_msg.format(f"ipAllocations[{i}]['ipVersion']")
-                assert result["ipAllocations"][i].get("ipAddresses") is not None, err_msg.format(f"ipAllocations[{i}]['ipAddresses']")
-                assert isinstance(result["ipAllocations"][i]["ipAddresses"], list), f"ipAllocations[{i}]['ipAddresses'] must be a list type"
-                assert len(result["ipAllocations"][i]["ipAddresses"]) > 0, f"ipAllocations[{i}]['ipAddresses'] must not be empty"
-
-                for allocation in self.inputs["ipAllocations"]:
-                    found = False
-                    if allocation["id"] == result["ipAllocations"][i]["ipAllocationId"]:
-                        found = True
-                        break
-
-                    assert found, f"Allocation result with id {result['ipAllocations'][i]['ipAllocationId']} not found"
-
-            return result
-        finally:
-            if cert is not None and type(cert) is str:
-                os.unlink(cert)
+        return self._run("allocate_ip", self.do_allocate_ip)
 
     def deallocate_ip(self):
 
-        cert = None
-        try:
-            auth_credentials = self._get_auth_credentials()
-            cert = self._get_cert()
-
-            result = self.do_deallocate_ip(auth_credentials, cert)
-
-            # Validation of returned result
-            err_msg = "{} is mandatory part of the response schema and must be present in the response"
-            assert result.get("ipDeallocations") is not None, err_msg.format("ipDeallocations")
-            assert isinstance(result["ipDeallocations"], list), "ipDeallocations must be a list type"
-            assert len(result["ipDeallocations"]) == len(self.inputs["ipDeallocations"]), "Size of ipDeallocations in the inputs is different than the one in the outputs"
-            for i in range(len(result["ipDeallocations"])):
-                assert result["ipDeallocations"][i].get("ipDeallocationId") is not None, err_msg.format(f"ipDeallocations[{i}]['ipDeallocationId']")
-
-                for deallocation in self.inputs["ipDeallocations"]:
-                    found = False
-                    if deallocation["id"] == result["ipDeallocations"][i]["ipDeallocationId"]:
-                        found = True
-                        break
-
-                    assert found, f"Deallocation result with id {result['ipDeallocations'][i]['ipDeallocationId']} not found"
-
-            return result
-        finally:
-            if cert is not None and type(cert) is str:
-                os.unlink(cert)
+        return self._run("deallocate_ip", self.do_deallocate_ip)
 
     def update_record(self):
 
-        cert = None
-        try:
-            auth_credentials = self._get_auth_credentials();
-            cert = self._get_cert()
-
-            return self.do_update_record(auth_credentials, cert)
-        finally:
-            if cert is not None and type(cert) is str:
-                os.unlink(cert)
+        return self._run("update_record", self.do_update_record)
 
     def get_ip_blocks(self):
 
-        cert = None
-        try:
-            auth_credentials = self._get_auth_credentials()
-            cert = self._get_cert()
-
-            result = self.do_get_ip_blocks(auth_credentials, cert)
-
-            # Validation of returned result
-            err_msg = "{} is mandatory part of the response schema and must be present in the response"
-            assert result.get("ipBlocks") is not None, err_msg.format("ipBlocks")
-            assert isinstance(result["ipBlocks"], list), "ipRanges must be a list type"
-            for i in range(len(result["ipBlocks"])):
-                assert result["ipBlocks"][i].get("id") is not None, err_msg.format(f"ipBlocks[{i}]['id']")
-                assert result["ipBlocks"][i].get("name") is not None, err_msg.format(f"ipBlocks[{i}]['name']")
-                assert result["ipBlocks"][i].get("ipBlockCIDR") is not None, err_msg.format(f"ipBlocks[{i}]['ipBlockCIDR']")
-                assert result["ipBlocks"][i].get("ipVersion") is not None, err_msg.format(f"ipBlocks[{i}]['ipVersion']")
-
-            return result
-        finally:
-            if cert is not None and type(cert) is str:
-                os.unlink(cert)
+        return self._run("get_ip_blocks", self.do_get_ip_blocks)
 
     def allocate_ip_range(self):
 
-        cert = None
-        try:
-            auth_credentials = self._get_auth_credentials()
-            cert = self._get_cert()
-
-            result = self.do_allocate_ip_range(auth_credentials, cert)
-
-             # Validation of returned result
-            err_msg = "{} is mandatory part of the response schema and must be present in the response"
-            assert result.get("ipRange") is not None, err_msg.format("ipRange")
-            assert result["ipRange"].get("id") is not None, err_msg.format(f"ipRange['id']")
-            assert result["ipRange"].get("name") is not None, err_msg.format(f"ipRange['name']")
-            assert result["ipRange"].get("startIPAddress") is not None, err_msg.format(f"ipRange['startIPAddress']")
-            assert result["ipRange"].get("endIPAddress") is not None, err_msg.format(f"ipRange['endIPAddress']")
-            assert result["ipRange"].get("ipVersion") is not None, err_msg.format(f"ipRange['ipVersion']")
-            assert result["ipRange"].get("subnetPrefixLength") is not None, err_msg.format(f"ipRange['subnetPrefixLength']")
-
-            return result
-        finally:
-            if cert is not None and type(cert) is str:
-                os.unlink(cert)
+        return self._run("allocate_ip_range", self.do_allocate_ip_range)
 
     def deallocate_ip_range(self):
 
-        cert = None
-        try:
-            auth_credentials = self._get_auth_credentials()
-            cert = self._get_cert()
-
-            return self.do_deallocate_ip_range(auth_credentials, cert)
-        finally:
-            if cert is not None and type(cert) is str:
-                os.unlink(cert)
+        return self._run("deallocate_ip_range", self.do_deallocate_ip_range)
 
     def do_validate_endpoint(self, auth_credentials, cert):
         raise Exception("Method do_validate_endpoint(self, auth_credentials, cert) not implemented")
@@ -243,14 +113,23 @@ class IPAM(object):
         raise Exception("Method do_deallocate_ip_range(self, auth_credentials, cert) not implemented")
 
 
+    """ Returns the path of the endpoint certificate, or True to use the default trust store.
+        Certificates are stored once per content hash so that later invocations reuse the same file.
+    """
     def _get_cert(self):
         inputs = self.inputs.get("endpoint", self.inputs)
         certificate = inputs["endpointProperties"].get("certificate", None)
         if certificate is not None:
-            cert = tempfile.NamedTemporaryFile(mode='w', delete=False)
-            cert.write(certificate)
-            cert.close()
-            return cert.name
+            cert = cache_path("certs", hashlib.sha256(certificate.encode()).hexdigest() + ".pem")
+            # the file is named after the certificate, but only its content says what it trusts
+            try:
+                with open(cert, newline='') as f:
+                    cached = f.read()
+            except OSError:
+                cached = None
+            if cached != certificate:
+                write_private_file(cert, certificate)
+            return cert
         else:
             return True
 
@@ -259,7 +138,7 @@ class IPAM(object):
     """
     def _fetch_server_certificate(self, hostname, port):
 
-        logging.info(f"Fetching certificate of {hostname}")
+        logging.info("Fetching certificate of %s", hostname)
         import ssl
         import socket
         from OpenSSL import SSL
@@ -274,7 +153,7 @@ class IPAM(object):
             o = urlparse(proxy)
             PROXY_ADDR = (o.hostname, o.port)
             CONNECT = "CONNECT %s:%s HTTP/1.0\r\nConnection: close\r\n\r\n" % (hostname, port)
-            logging.info(f"HTTP Proxy is configured. Sending CONNECT command to {proxy}: {CONNECT}")
+            logging.info("HTTP Proxy is configured. Sending CONNECT command to %s: %s", proxy, CONNECT)
             CONNECT = bytes(CONNECT, "utf-8")
             sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             sock.connect(PROXY_ADDR)
@@ -313,31 +192,87 @@ class IPAM(object):
             }
         }
 
-    """ Fetches the auth credentials from vRA """
-    def _get_auth_credentials(self):
+    """ Fetches the auth credentials from vRA, unless they were fetched by a recent action.
+        use_cache=False always fetches them, e.g. to validate credentials which were just edited.
+    """
+    def _get_auth_credentials(self, use_cache=True):
 
         if self._is_mock_request(): # Used for testing purposes within VMware
             return {"privateKeyId": "admin", "privateKey":"VMware"}
 
-        logging.info("Querying for auth credentials")
         inputs = self.inputs.get("endpoint", self.inputs)
         auth_credentials_link = inputs["authCredentialsLink"]
+        credential_cache = self._get_credential_cache()
+        if use_cache:
+            auth_credentials = credential_cache.get(auth_credentials_link)
+            if auth_credentials is not None:
+                logging.info("Using cached auth credentials")
+                return auth_credentials
+
+        logging.info("Querying for auth credentials")
         auth_credentials_response = self.context.request(auth_credentials_link, 'GET', '') ## Integrators can use context.request() to call CAS/Prelude REST endpoints
         if auth_credentials_response["status"] == 200:
             logging.info("Credentials obtained successfully!")
-            return json.loads(auth_credentials_response["content"])
+            auth_credentials = json.loads(auth_credentials_response["content"])
+            credential_cache.put(auth_credentials_link, auth_credentials)
+            return auth_credentials
 
         raise Exception('Failed to obtain auth credentials from {}: {}'.format(auth_credentials_link, str(auth_credentials_response)))
 
+    def _get_credential_cache(self):
+        inputs = self.inputs.get("endpoint", self.inputs)
+        return CredentialCache(get_credential_ttl(inputs["endpointProperties"]))
+
+    """ Forgets the cached credentials once phpIPAM rejected them, so that the next action fetches them again """
+    def _invalidate_auth_credentials(self):
+        if self._is_mock_request():
+            return
+        inputs = self.inputs.get("endpoint", self.inputs)
+        logging.info("phpIPAM rejected the auth credentials, dropping them from the cache")
+        self._get_credential_cache().invalidate(inputs["authCredentialsLink"])
 
+
+    """ Logs JSON records to stdout through a buffer flushed when the operation ends,
+        at the verbosity set by the logLevel endpoint setting
+    """
     def _setup_logger(self):
-        logger = logging.getLogger()
-        if logger.handlers:
-            for handler in logger.handlers:
-                logger.removeHandler(handler)
+        endpoint = self.inputs.get("endpoint", self.inputs)
+        self.log_buffer = setup_logging(get_log_level(endpoint.get("endpointProperties", {})))
+
+    """ Runs an operation: fetches the credentials and the certificate, calls do_operation with them
+        and validates its result. Each phase and every phpIPAM request is timed, and the metrics
+        summary is logged and returned in the result.
+    """
+    def _run(self, operation, do_operation):
+        collector = metrics.start_operation(operation)
+        try:
+            with collector.phase("credentials"):
+                auth_credentials = self._get_auth_credentials(use_cache=operation != "validate_endpoint")
+            with collector.phase("certificate"):
+                cert = self._get_cert()
+            with collector.phase(operation):
+                result = do_operation(auth_credentials, cert)
+            with collector.phase("validation"):
+                self._validate_response(operation, result)
+        except AuthenticationException:
+            self._invalidate_auth_credentials()
+            raise
+        finally:
+            summary = collector.summary()
+            logging.info("Metrics of %s", operation, extra={"metrics": summary})
+            self.log_buffer.flush()
+
+        result["metrics"] = summary
+        return result
 
-        logging.basicConfig(format="[%(asctime)s] [%(levelname)s] - %(message)s", level=logging.INFO)
-        logging.StreamHandler.emit = lambda self, record: print(logging.StreamHandler.format(self, record))
+    """ Checks the result of an operation against the response schema vRA expects, unless
+        validation is turned off with the validateResponses endpoint setting
+    """
+    def _validate_response(self, operation, result):
+        endpoint = self.inputs.get("endpoint", self.inputs)
+        if validation_enabled(endpoint["endpointProperties"]):
+            validate_response(operation, result, self.inputs)
+        return result
 
     def _is_mock_request(self):
         endpoint = self.inputs.get("endpoint", self.inputs)
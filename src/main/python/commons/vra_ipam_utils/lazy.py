@@ -0,0 +1,40 @@
+"""
+Copyright (c) 2020 VMware, Inc.
+
+This product is licensed to you under the Apache License, Version 2.0 (the "License").
+You may not use this product except in compliance with the License.
+
+This product may include a number of subcomponents with separate copyright notices
+and license terms. Your use of these subcomponents is subject to the terms and
+conditions of the subcomponent's license, as noted in the LICENSE file.
+"""
+
+import importlib
+import logging
+import sys
+import threading
+
+## Modules which pull in heavy dependencies (requests, urllib3 and the certifi trust store, about
+## 130ms on a cold container) and are needed by every operation once the credentials are known.
+## The other vra_ipam_utils modules only import them inside the functions which use them.
+HEAVY_MODULES = ("vra_ipam_utils.transport",)
+
+def preload(*names):
+    """ Imports the modules names in a background thread and returns the thread.
+        The import then overlaps the vRA credentials round trip rather than delaying the action
+        start. A module imported while the thread is still loading it waits for it to complete,
+        and import errors are left to be raised where the module is actually used.
+    """
+    names = [name for name in names or HEAVY_MODULES if name not in sys.modules]
+    if not names:
+        return None
+    thread = threading.Thread(target=_import_all, args=(names,), name="preload", daemon=True)
+    thread.start()
+    return thread
+
+def _import_all(names):
+    for name in names:
+        try:
+            importlib.import_module(name)
+        except Exception as e:
+            logging.debug("Unable to preload %s: %s", name, e)
@@ -0,0 +1,72 @@
+"""
+Copyright (c) 2020 VMware, Inc.
+
+This product is licensed to you under the Apache License, Version 2.0 (the "License").
+You may not use this product except in compliance with the License.
+
+This product may include a number of subcomponents with separate copyright notices
+and license terms. Your use of these subcomponents is subject to the terms and
+conditions of the subcomponent's license, as noted in the LICENSE file.
+"""
+
+import json
+import logging
+import sys
+from datetime import datetime, timezone
+from logging.handlers import MemoryHandler
+
+DEFAULT_LOG_LEVEL = "info"
+LOG_LEVELS = {
+    "debug": logging.DEBUG,
+    "info": logging.INFO,
+    "warning": logging.WARNING,
+    "error": logging.ERROR
+}
+
+## Records are buffered and written in batches of this size, and at the end of each operation.
+## Errors are written right away, together with the records buffered before them.
+BUFFER_CAPACITY = 1000
+
+## Attributes every LogRecord has; anything else was passed through extra= and is logged as a field
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+class JsonFormatter(logging.Formatter):
+    """ Formats each record as a single line JSON document, so that ABX run logs can be parsed.
+        Fields passed with extra= are added to the document as they are.
+    """
+
+    def format(self, record):
+        document = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage()
+        }
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRIBUTES:
+                document[name] = value
+        if record.exc_info:
+            document["exception"] = self.formatException(record.exc_info)
+        return json.dumps(document, default=str, separators=(",", ":"))
+
+def get_log_level(endpoint_properties):
+    """ Returns the logging level set by the logLevel endpoint setting """
+    level = str(endpoint_properties.get("logLevel") or DEFAULT_LOG_LEVEL).lower()
+    return LOG_LEVELS.get(level, LOG_LEVELS[DEFAULT_LOG_LEVEL])
+
+def setup_logging(level=logging.INFO, stream=None):
+    """ Routes the root logger through a buffer to stream (stdout by default, which ABX captures)
+        and returns the buffering handler, to be flushed when the operation ends.
+    """
+    logger = logging.getLogger()
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+
+    target = logging.StreamHandler(stream or sys.stdout)
+    target.setFormatter(JsonFormatter())
+    buffer = MemoryHandler(BUFFER_CAPACITY, flushLevel=logging.ERROR, target=target)
+    logger.addHandler(buffer)
+    logger.setLevel(level)
+    return buffer
@@ -0,0 +1,155 @@
+"""
+Copyright (c) 2020 VMware, Inc.
+
+This product is licensed to you under the Apache License, Version 2.0 (the "License").
+You may not use this product except in compliance with the License.
+
+This product may include a number of subcomponents with separate copyright notices
+and license terms. Your use of these subcomponents is subject to the terms and
+conditions of the subcomponent's license, as noted in the LICENSE file.
+"""
+
+import bisect
+import functools
+import re
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+## Upper bounds in milliseconds of the latency histogram buckets, the last bucket being unbounded
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+## Path segments which are ids or addresses are collapsed so that requests add up per API route
+_ID_SEGMENT = re.compile(r"^[0-9a-fA-F.:]+$")
+
+class Histogram(object):
+    """ Count, total, maximum and bucketed distribution of durations in milliseconds """
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def add(self, ms):
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS_MS, ms)] += 1
+
+    def summary(self):
+        bounds = [str(bound) for bound in LATENCY_BUCKETS_MS] + ["+Inf"]
+        return {
+            "count": self.count,
+            "totalMs": round(self.total_ms, 1),
+            "maxMs": round(self.max_ms, 1),
+            "histogramMs": {bound: n for bound, n in zip(bounds, self.buckets) if n}
+        }
+
+class Metrics(object):
+    """ Timings of the phases of an IPAM operation and of the HTTP requests it sends.
+
+        Phases are recorded with phase() or the timed() decorator. Requests are recorded by the
+        record_response() hook which PhpIpamClient installs on its session, and by the streaming
+        helpers for the bytes of responses which are decoded as they are received.
+    """
+
+    def __init__(self, operation=None):
+        self.operation = operation
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+        self.phases = {}
+        self.routes = {}
+        self.requests = Histogram()
+        self.errors = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            ms = (time.perf_counter() - start) * 1000
+            with self.lock:
+                self.phases.setdefault(name, Histogram()).add(ms)
+
+    def record_request(self, route, ms, status_code, bytes_sent, bytes_received):
+        with self.lock:
+            self.requests.add(ms)
+            self.routes.setdefault(route, Histogram()).add(ms)
+            if status_code >= 400:
+                self.errors += 1
+            self.bytes_sent += bytes_sent
+            self.bytes_received += bytes_received
+
+    def record_received(self, byte_count):
+        with self.lock:
+            self.bytes_received += byte_count
+
+    def summary(self):
+        with self.lock:
+            requests = self.requests.summary()
+            requests.update({
+                "errors": self.errors,
+                "bytesSent": self.bytes_sent,
+                "bytesReceived": self.bytes_received,
+                "routes": {route: histogram.summary() for route, histogram in sorted(self.routes.items())}
+            })
+            return {
+                "operation": self.operation,
+                "totalMs": round((time.perf_counter() - self.started) * 1000, 1),
+                "phases": {name: histogram.summary() for name, histogram in self.phases.items()},
+                "requests": requests
+            }
+
+## Metrics of the operation in progress. ABX runs one operation at a time per container,
+## so a module level collector lets the HTTP hooks record without threading it through every call.
+_current = Metrics()
+
+def current():
+    return _current
+
+def start_operation(operation):
+    """ Starts collecting the metrics of a new operation and returns its collector """
+    global _current
+    _current = Metrics(operation)
+    return _current
+
+def timed(name):
+    """ Decorator recording each call of the decorated function as the phase name """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with current().phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def route_of(method, url):
+    """ Returns the API route of a request, e.g. 'GET /subnets/{}/addresses/' """
+    segments = [segment for segment in urlparse(url).path.split('/') if segment]
+    # drop the /api/{app_id} prefix
+    segments = ['{}' if _ID_SEGMENT.match(segment) else segment for segment in segments[2:]]
+    return f"{method} /{'/'.join(segments)}/" if segments else f"{method} /"
+
+def record_response(response, **kwargs):
+    """ requests response hook recording the latency and size of every request sent by a session.
+        Responses requested with stream=True are consumed later, their size is recorded by iter_data.
+        A response is only recorded once, whichever of the hooks sees it first.
+    """
+    if getattr(response, '_metrics_recorded', False):
+        return response
+    response._metrics_recorded = True
+    ms = response.elapsed.total_seconds() * 1000
+    bytes_received = 0
+    if not kwargs.get('stream'):
+        start = time.perf_counter()
+        bytes_received = len(response.content)
+        ms += (time.perf_counter() - start) * 1000
+    body = response.request.body
+    bytes_sent = len(body.encode() if isinstance(body, str) else body) if body else 0
+    current().record_request(route_of(response.request.method, response.request.url), ms, response.status_code, bytes_sent, bytes_received)
+    return response
@@ -0,0 +1,62 @@
+"""
+Copyright (c) 2020 VMware, Inc.
+
+This product is licensed to you under the Apache License, Version 2.0 (the "License").
+You may not use this product except in compliance with the License.
+
+This product may include a number of subcomponents with separate copyright notices
+and license terms. Your use of these subcomponents is subject to the terms and
+conditions of the subcomponent's license, as noted in the LICENSE file.
+"""
+
+import base64
+import heapq
+import json
+import logging
+
+## vRA propagates the nextPageToken returned by a collection action as the pageToken of the
+## next request until no token is returned. The tokens are opaque to vRA, so they simply carry
+## the id of the last phpIPAM object that was returned.
+
+def encode_page_token(last_id):
+    state = json.dumps({"after": int(last_id)}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(state.encode()).decode()
+
+def decode_page_token(page_token):
+    """ Returns the id after which the next page starts, or None to start from the beginning """
+    if not page_token:
+        return None
+    try:
+        return int(json.loads(base64.urlsafe_b64decode(page_token.encode()))["after"])
+    except Exception:
+        logging.warning("Ignoring unrecognized page token %s", page_token)
+        return None
+
+def get_paging(inputs):
+    """ Returns the (max_results, after_id) requested through the pagingAndSorting input """
+    paging = inputs.get("pagingAndSorting") or {}
+    try:
+        max_results = int(paging.get("maxResults"))
+    except (TypeError, ValueError):
+        max_results = None
+    if max_results is not None and max_results <= 0:
+        max_results = None
+    return max_results, decode_page_token(paging.get("pageToken"))
+
+def paginate(records, max_results, after_id):
+    """ Orders records by id and returns the (page, next_page_token) following after_id.
+        records can be any iterable; only the requested page is kept in memory.
+    """
+    if after_id is not None:
+        records = (record for record in records if int(record['id']) > after_id)
+    if max_results is None:
+        return sorted(records, key=_record_id), None
+    # one extra record tells whether there is a next page
+    records = heapq.nsmallest(max_results + 1, records, key=_record_id)
+    if len(records) <= max_results:
+        return records, None
+    page = records[:max_results]
+    return page, encode_page_token(page[-1]['id'])
+
+def _record_id(record):
+    return int(record['id'])
@@ -0,0 +1,36 @@
+"""
+Copyright (c) 2020 VMware, Inc.
+
+This product is licensed to you under the Apache License, Version 2.0 (the "License").
+You may not use this product except in compliance with the License.
+
+This product may include a number of subcomponents with separate copyright notices
+and license terms. Your use of these subcomponents is subject to the terms and
+conditions of the subcomponent's license, as noted in the LICENSE file.
+"""
+
+import logging
+
+from vra_ipam_utils.geometry import range_geometry
+
+def parse_nameservers(nameservers):
+    # return empty set if no nameservers are defined in IPAM
+    try:
+      return [server.strip() for server in str(nameservers['namesrv1']).split(';')]
+    except:
+      return []
+
+def build_ip_range(subnet):
+    """ Builds the vRA ip range describing a phpIPAM subnet record """
+    ipRange = {}
+    ipRange['id'] = str(subnet['id'])
+    ipRange['name'] = f"{str(subnet['subnet'])}/{str(subnet['mask'])}"
+    ipRange['description'] = str(subnet['description'])
+    logging.debug("Found subnet: %s - %s.", ipRange['name'], ipRange['description'])
+    geometry = range_geometry(subnet['subnet'], subnet['mask'])
+    ipRange['ipVersion'] = f"IPv{geometry.version}"
+    ipRange['startIPAddress'] = geometry.first
+    ipRange['endIPAddress'] = geometry.last
+    ipRange['subnetPrefixLength'] = str(subnet['mask'])
+    ipRange['dnsServerAddresses'] = parse_nameservers(subnet.get('nameservers'))
+    return ipRange
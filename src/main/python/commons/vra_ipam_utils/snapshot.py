@@ -0,0 +1,99 @@
+"""
+Copyright (c) 2020 VMware, Inc.
+
+This product is licensed to you under the Apache License, Version 2.0 (the "License").
+You may not use this product except in compliance with the License.
+
+This product may include a number of subcomponents with separate copyright notices
+and license terms. Your use of these subcomponents is subject to the terms and
+conditions of the subcomponent's license, as noted in the LICENSE file.
+"""
+
+import hashlib
+import json
+import logging
+import time
+
+from vra_ipam_utils.cache import cache_path, write_private_file
+
+## Nameserver sets are separate phpIPAM objects, so editing one doesn't touch the subnets using it.
+## Snapshots are therefore only trusted for a limited time and rebuilt from scratch afterwards.
+DEFAULT_SNAPSHOT_TTL = 900
+
+## Fields of a phpIPAM subnet which end up in the vRA ip range. Volatile fields such as
+## lastScan are left out so that a discovery scan doesn't invalidate the snapshot.
+SUBNET_FIELDS = ('id', 'subnet', 'mask', 'description', 'nameservers', 'nameserverId', 'editDate')
+
+## Bumped whenever the way ranges are built changes, so that older snapshots are ignored
+SNAPSHOT_VERSION = 2
+
+def get_snapshot_ttl(endpoint_properties):
+    """ Returns the snapshotTtl endpoint setting in seconds, 0 disabling the snapshot """
+    try:
+        ttl = int(endpoint_properties.get("snapshotTtl", DEFAULT_SNAPSHOT_TTL))
+    except (TypeError, ValueError):
+        return DEFAULT_SNAPSHOT_TTL
+    return max(ttl, 0)
+
+def subnet_hash(subnet):
+    content = json.dumps([subnet.get(field) for field in SUBNET_FIELDS], separators=(",", ":"), default=str)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+class RangeSnapshot(object):
+    """ Snapshot of the ip ranges built during previous runs of get_ip_ranges, stored as JSON lines.
+
+        The first line holds the creation time of the snapshot, every following line one
+        {"id", "hash", "range"} entry. A range is only reused while the hash of the phpIPAM
+        subnet it was built from is unchanged.
+    """
+
+    def __init__(self, uri, settings, ttl=DEFAULT_SNAPSHOT_TTL):
+        key = hashlib.sha256(json.dumps([SNAPSHOT_VERSION, uri, settings], sort_keys=True, default=str).encode()).hexdigest()
+        self.path = cache_path("snapshots", f"{key}.jsonl")
+        self.ttl = ttl
+        self.created = time.time()
+        self.entries = {}
+        self.hits = 0
+        if ttl > 0:
+            self._load()
+
+    def get(self, subnet):
+        """ Returns a copy of the snapshotted range for subnet, or None if it changed since """
+        entry = self.entries.get(str(subnet['id']))
+        if entry is None or entry['hash'] != subnet_hash(subnet):
+            return None
+        self.hits += 1
+        return dict(entry['range'])
+
+    def put(self, subnet, ip_range):
+        self.entries[str(subnet['id'])] = {'id': str(subnet['id']), 'hash': subnet_hash(subnet), 'range': ip_range}
+
+    def save(self, subnet_ids=None):
+        """ Writes the snapshot back, dropping entries whose subnet isn't in subnet_ids anymore """
+        if self.ttl <= 0:
+            return
+        if subnet_ids is not None:
+            subnet_ids = {str(subnet_id) for subnet_id in subnet_ids}
+            self.entries = {k: v for k, v in self.entries.items() if k in subnet_ids}
+        lines = [json.dumps({'created': self.created})]
+        lines.extend(json.dumps(entry, separators=(",", ":")) for entry in self.entries.values())
+        try:
+            write_private_file(self.path, "\n".join(lines) + "\n")
+        except OSError as e:
+            logging.warning("Unable to persist the ip range snapshot: %s", e)
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                header = json.loads(f.readline())
+                if header['created'] + self.ttl <= time.time():
+                    logging.info("Ip range snapshot has expired, rebuilding it")
+                    return
+                entries = {}
+                for line in f:
+                    entry = json.loads(line)
+                    entries[entry['id']] = entry
+        except (OSError, ValueError, KeyError, TypeError):
+            return
+        self.created = header['created']
+        self.entries = entries
@@ -0,0 +1,124 @@
+"""
+Copyright (c) 2020 VMware, Inc.
+
+This product is licensed to you under the Apache License, Version 2.0 (the "License").
+You may not use this product except in compliance with the License.
+
+This product may include a number of subcomponents with separate copyright notices
+and license terms. Your use of these subcomponents is subject to the terms and
+conditions of the subcomponent's license, as noted in the LICENSE file.
+"""
+
+import codecs
+import json
+
+from vra_ipam_utils import metrics
+
+## phpIPAM wraps every result in an envelope like {"code": 200, "success": true, "data": [...]}.
+## Large inventories are decoded record by record from the response body instead of
+## materializing the whole document, so memory stays bounded by what the caller keeps.
+CHUNK_SIZE = 64 * 1024
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = ' \t\n\r'
+## Characters which may follow the part of a number decoded so far, e.g. when '3.14' is split as '3.' + '14'
+_NUMBER_CONTINUATION = frozenset('.eE+-0123456789')
+
+class _Reader(object):
+    """ Text buffer over an iterator of byte chunks """
+
+    def __init__(self, chunks, encoding):
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder(encoding)()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """ Appends the next chunk to the buffer, returns False at the end of the stream """
+        if self.eof:
+            return False
+        # drop what was consumed already so the buffer doesn't grow with the document
+        self.buffer = self.buffer[self.pos:]
+        self.pos = 0
+        for chunk in self.chunks:
+            if chunk:
+                self.buffer += self.decoder.decode(chunk)
+                return True
+        self.buffer += self.decoder.decode(b'', final=True)
+        self.eof = True
+        return False
+
+    def peek(self):
+        """ Returns the next non-whitespace character without consuming it, '' at the end of the stream """
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Malformed JSON response: expected '{char}' at offset {self.pos}")
+        self.pos += 1
+
+    def value(self):
+        """ Decodes the next complete JSON value """
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+                # a number ending the buffer, or followed by the start of its fraction or exponent,
+                # may continue in the next chunk
+                if self.eof or (end < len(self.buffer) and not (_is_number(value) and self.buffer[end] in _NUMBER_CONTINUATION)):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill()
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def iter_json_array(chunks, key='data', encoding='utf-8'):
+    """ Yields the items of the array stored under key in the top level object read from chunks.
+        Yields nothing if the object has no such key or if it isn't an array.
+    """
+    reader = _Reader(chunks, encoding)
+    reader.expect('{')
+    if reader.peek() == '}':
+        return
+    while True:
+        name = reader.value()
+        reader.expect(':')
+        if name == key and reader.peek() == '[':
+            reader.expect('[')
+            if reader.peek() == ']':
+                return
+            while True:
+                yield reader.value()
+                if reader.peek() == ']':
+                    return
+                reader.expect(',')
+        reader.value()
+        if reader.peek() == '}':
+            return
+        reader.expect(',')
+
+def iter_data(response, key='data'):
+    """ Streams the records of a phpIPAM response requested with stream=True, closing it afterwards """
+    received = [0]
+
+    def chunks():
+        for chunk in response.iter_content(CHUNK_SIZE):
+            received[0] += len(chunk)
+            yield chunk
+
+    try:
+        yield from iter_json_array(chunks(), key, response.encoding or 'utf-8')
+    finally:
+        response.close()
+        metrics.current().record_received(received[0])
@@ -0,0 +1,86 @@
+"""
+Copyright (c) 2020 VMware, Inc.
+
+This product is licensed to you under the Apache License, Version 2.0 (the "License").
+You may not use this product except in compliance with the License.
+
+This product may include a number of subcomponents with separate copyright notices
+and license terms. Your use of these subcomponents is subject to the terms and
+conditions of the subcomponent's license, as noted in the LICENSE file.
+"""
+
+import bisect
+
+from vra_ipam_utils.geometry import address_to_int, network_bounds
+
+## The index is never cached: it is built from a listing fetched by the caller when needed, so that
+## decisions taken from it can't rely on subnets which have been deleted or resized since.
+
+class SubnetIndex(object):
+    """ Sorted interval index of phpIPAM subnets, one per IP version.
+
+        CIDR subnets are either nested or disjoint, so each interval records its closest enclosing
+        interval. Containment and overlap queries are a bisect over the interval starts followed
+        by a walk up at most one enclosing interval per prefix length.
+    """
+
+    def __init__(self, subnets=()):
+        intervals = {4: [], 6: []}
+        for subnet in subnets:
+            if str(subnet.get('isFolder', '0')) == '1' or not subnet.get('subnet'):
+                continue
+            version, network = address_to_int(str(subnet['subnet']))
+            prefix_length = int(subnet['mask'])
+            start, end = network_bounds(version, network, prefix_length)
+            intervals[version].append((start, end, prefix_length, str(subnet['id'])))
+
+        self.starts = {}
+        self.parents = {}
+        for version, entries in intervals.items():
+            # enclosing subnets sort before the subnets they contain
+            entries.sort(key=lambda entry: (entry[0], -entry[1]))
+            parents = []
+            stack = []
+            for start, end, _, _ in entries:
+                while stack and entries[stack[-1]][1] < start:
+                    stack.pop()
+                parents.append(stack[-1] if stack else None)
+                stack.append(len(parents) - 1)
+            self.starts[version] = [entry[0] for entry in entries]
+            self.parents[version] = parents
+        self.intervals = intervals
+
+    def __len__(self):
+        return sum(len(entries) for entries in self.intervals.values())
+
+    def _enclosing(self, version, value):
+        """ Returns the position of the most specific interval containing value, or None """
+        i = bisect.bisect_right(self.starts[version], value) - 1
+        entries, parents = self.intervals[version], self.parents[version]
+        while i is not None and i >= 0:
+            if entries[i][1] >= value:
+                return i
+            i = parents[i]
+        return None
+
+    def find(self, address):
+        """ Returns the id of the most specific subnet containing address, or None """
+        version, value = address_to_int(address)
+        i = self._enclosing(version, value)
+        return None if i is None else self.intervals[version][i][3]
+
+    def overlapping(self, version, start, end):
+        """ Returns the (start, end, prefix_length, id) of every subnet overlapping [start, end],
+            the subnets containing start first, from the most specific one
+        """
+        entries = self.intervals[version]
+        starts = self.starts[version]
+        found = []
+        i = self._enclosing(version, start)
+        while i is not None:
+            found.append(entries[i])
+            i = self.parents[version][i]
+        lo = bisect.bisect_right(starts, start)
+        hi = bisect.bisect_right(starts, end)
+        found.extend(entries[lo:hi])
+        return found
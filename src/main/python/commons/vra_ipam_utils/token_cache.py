@@ -0,0 +1,193 @@
+"""
+Copyright (c) 2020 VMware, Inc.
+
+This product is licensed to you under the Apache License, Version 2.0 (the "License").
+You may not use this product except in compliance with the License.
+
+This product may include a number of subcomponents with separate copyright notices
+and license terms. Your use of these subcomponents is subject to the terms and
+conditions of the subcomponent's license, as noted in the LICENSE file.
+"""
+
+import hashlib
+import hmac
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+
+from vra_ipam_utils.cache import cache_path, get_secret, write_private_file
+from vra_ipam_utils.exceptions import AuthenticationException
+from vra_ipam_utils.metrics import record_response
+
+## phpIPAM extends a token's validity every time it is used (6 hours by default), so a cached
+## token is only trusted for a conservative period and renewed shortly before that runs out.
+## A shorter validity reported by phpIPAM at login caps that period.
+DEFAULT_TOKEN_TTL = 3600
+DEFAULT_REFRESH_MARGIN = 60
+
+class TokenCache(object):
+    """ Keeps phpIPAM API tokens on local disk so that consecutive actions running in
+        the same ABX container don't have to log in again.
+
+        Tokens are keyed by an HMAC of the API uri (host and app id) and the credentials, with a
+        random secret of the cache directory, so that the file doesn't hold a hash of the password
+        which could be brute forced.
+    """
+
+    def __init__(self, path=None, ttl=DEFAULT_TOKEN_TTL, refresh_margin=DEFAULT_REFRESH_MARGIN):
+        self.path = path or cache_path("tokens.json")
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.lock = threading.Lock()
+
+    def key(self, uri, auth):
+        message = "\0".join((uri,) + tuple(auth)).encode()
+        return hmac.new(get_secret("tokens.secret"), message, hashlib.sha256).hexdigest()
+
+    def get(self, key):
+        """ Returns the cached token, or None if there is none or it is about to expire """
+        entry = self._load().get(key)
+        if entry is None or entry["expires"] - self.refresh_margin <= time.time():
+            return None
+        return entry["token"]
+
+    def put(self, key, token, expires=None):
+        """ Caches token for the TTL of the cache, or until expires (a timestamp) if that comes first """
+        with self.lock:
+            entries = self._load()
+            now = time.time()
+            entries = {k: v for k, v in entries.items() if v["expires"] > now}
+            lifetime = self.ttl
+            # a validity already over means the clocks or time zones disagree, it is ignored
+            if expires is not None and expires > now:
+                lifetime = min(lifetime, expires - now)
+            entries[key] = {"token": token, "expires": now + lifetime}
+            self._save(entries)
+
+    def invalidate(self, key):
+        with self.lock:
+            entries = self._load()
+            if entries.pop(key, None) is not None:
+                self._save(entries)
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, entries):
+        try:
+            write_private_file(self.path, json.dumps(entries))
+        except OSError as e:
+            logging.warning("Unable to persist the phpIPAM token cache: %s", e)
+
+class PhpIpamTokenAuth(object):
+    """ requests authentication handler for the phpIPAM 'SSL with User Token' API security.
+
+        A cached token is reused when available; otherwise the handler logs in on the first request.
+        Requests rejected because the token is no longer valid are retried once with a fresh token.
+        requests accepts any callable as auth, so this module doesn't need to import it.
+    """
+
+    def __init__(self, uri, auth, cache=None, session=None, timeout=None):
+        self.uri = uri
+        self.auth = auth
+        self.cache = cache or TokenCache()
+        if session is None:
+            import requests
+            session = requests.Session()
+        self.session = session
+        self.timeout = timeout
+        self.key = self.cache.key(uri, auth)
+        self.token = None
+        self.lock = threading.Lock()
+
+    def login(self):
+        """ Authenticates with the user credentials and returns the raw phpIPAM response """
+        return self.session.post(f'{self.uri}/user/', auth=self.auth, timeout=self.timeout)
+
+    def remember(self, data):
+        """ Keeps the token of the data of a successful login response """
+        self.token = data['token']
+        self.cache.put(self.key, self.token, parse_expires(data.get('expires')))
+
+    def new_token(self):
+        req = self.login()
+        if req.status_code != 200:
+            raise AuthenticationException('Authentication Failure!')
+        data = req.json()['data']
+        token = data['token']
+        self.cache.put(self.key, token, parse_expires(data.get('expires')))
+        logging.info("Obtained a new phpIPAM API token")
+        return token
+
+    def get_token(self):
+        with self.lock:
+            if self.token is None:
+                self.token = self.cache.get(self.key)
+                if self.token is None:
+                    self.token = self.new_token()
+            return self.token
+
+    def refresh_token(self, rejected_token):
+        with self.lock:
+            # another thread may have renewed the token in the meantime
+            if self.token == rejected_token:
+                logging.info("phpIPAM API token was rejected, logging in again")
+                self.cache.invalidate(self.key)
+                self.token = self.new_token()
+            return self.token
+
+    def handle_rejected_token(self, r, **kwargs):
+        if not is_token_rejected(r):
+            return r
+
+        record_response(r, **kwargs)
+        # Consume content and release the original connection before retrying
+        r.content
+        r.close()
+        prep = r.request.copy()
+        prep.headers['token'] = self.refresh_token(r.request.headers['token'])
+        # the retry is sent by the adapter directly, which doesn't run the response hooks
+        _r = r.connection.send(prep, **kwargs)
+        _r.history.append(r)
+        _r.request = prep
+        record_response(_r, **kwargs)
+        return _r
+
+    def __call__(self, r):
+        r.headers['token'] = self.get_token()
+        r.register_hook('response', self.handle_rejected_token)
+        return r
+
+def is_token_rejected(r):
+    """ phpIPAM answers 401 when the token is missing and 403 when it is invalid or expired """
+    if r.status_code == 401:
+        return True
+    if r.status_code == 403:
+        try:
+            return 'token' in str(r.json().get('message', '')).lower()
+        except ValueError:
+            return False
+    return False
+
+def parse_expires(value):
+    """ Returns the timestamp of the token expiry reported by phpIPAM at login, or None.
+        phpIPAM reports it as 'YYYY-MM-DD HH:MM:SS' in its own time zone, which isn't known here,
+        so it is read as UTC and only ever used to shorten the time a token is cached.
+    """
+    if value is None:
+        return None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    try:
+        expires = datetime.fromisoformat(str(value).strip())
+    except ValueError:
+        return None
+    if expires.tzinfo is None:
+        expires = expires.replace(tzinfo=timezone.utc)
+    return expires.timestamp()
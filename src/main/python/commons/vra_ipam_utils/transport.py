@@ -0,0 +1,93 @@
+"""
+Copyright (c) 2020 VMware, Inc.
+
+This product is licensed to you under the Apache License, Version 2.0 (the "License").
+You may not use this product except in compliance with the License.
+
+This product may include a number of subcomponents with separate copyright notices
+and license terms. Your use of these subcomponents is subject to the terms and
+conditions of the subcomponent's license, as noted in the LICENSE file.
+"""
+
+import ssl
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+## Only requests which can safely be sent twice are retried on a 5xx or a dropped connection.
+## POST is left out so that a retry can never reserve a second address.
+RETRY_METHODS = frozenset(["GET", "HEAD", "OPTIONS", "PATCH", "DELETE"])
+RETRY_STATUSES = frozenset([500, 502, 503, 504])
+
+## SSL contexts built from the endpoint certificate, keyed by its path. The certificate files are
+## content-addressed (see IPAM._get_cert), so a warm container parses each CA bundle only once.
+_ssl_contexts = {}
+_ssl_contexts_lock = threading.Lock()
+
+def get_ssl_context(cert):
+    """ Returns a verifying SSL context trusting the certificate at path cert """
+    with _ssl_contexts_lock:
+        context = _ssl_contexts.get(cert)
+        if context is None:
+            context = ssl.create_default_context(cafile=cert)
+            _ssl_contexts[cert] = context
+        return context
+
+class SSLContextAdapter(HTTPAdapter):
+    """ HTTPAdapter whose connection pools share a prebuilt SSL context.
+
+        For every request, requests passes the pool either its own certifi based context (verify=True)
+        or a CA bundle path (verify=<path>, or REQUESTS_CA_BUNDLE from the environment), each of which
+        would override the pool manager's context. With an SSL context set, the adapter hides the
+        verify setting from those two steps so that the pools verify against that context only.
+    """
+
+    def __init__(self, ssl_context=None, **kwargs):
+        self.ssl_context = ssl_context
+        super().__init__(**kwargs)
+
+    def get_connection_with_tls_context(self, request, verify, proxies=None, cert=None):
+        if self.ssl_context is not None and verify is not False:
+            # neither True nor a path: the pool keeps the context of the pool manager and verifies
+            verify = None
+        return super().get_connection_with_tls_context(request, verify, proxies=proxies, cert=cert)
+
+    def cert_verify(self, conn, url, verify, cert):
+        if self.ssl_context is not None and verify is not False:
+            # don't load a CA bundle into the shared context on every new connection
+            verify = True
+        super().cert_verify(conn, url, verify, cert)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.ssl_context is not None:
+            kwargs['ssl_context'] = self.ssl_context
+        return super().init_poolmanager(*args, **kwargs)
+
+    def proxy_manager_for(self, proxy, **proxy_kwargs):
+        if self.ssl_context is not None:
+            proxy_kwargs['ssl_context'] = self.ssl_context
+        return super().proxy_manager_for(proxy, **proxy_kwargs)
+
+def build_session(cert, pool_size, max_retries, backoff_factor):
+    """ Returns a requests session sending through a single keep-alive connection pool,
+        which retries idempotent requests and trusts cert (a path, or True for the default trust store)
+    """
+    retry = Retry(
+        total=max_retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=RETRY_METHODS,
+        raise_on_status=False
+    )
+    # A custom certificate is trusted through a shared SSL context rather than requests'
+    # verify=<path>, which would load the CA file again for every new connection
+    ssl_context = get_ssl_context(cert) if isinstance(cert, str) else None
+    adapter = SSLContextAdapter(ssl_context=ssl_context, pool_connections=1, pool_maxsize=pool_size or 1, max_retries=retry)
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.verify = cert if ssl_context is None else True
+    return session
@@ -0,0 +1,83 @@
+"""
+Copyright (c) 2020 VMware, Inc.
+
+This product is licensed to you under the Apache License, Version 2.0 (the "License").
+You may not use this product except in compliance with the License.
+
+This product may include a number of subcomponents with separate copyright notices
+and license terms. Your use of these subcomponents is subject to the terms and
+conditions of the subcomponent's license, as noted in the LICENSE file.
+"""
+
+from collections import namedtuple
+
+ERR_MSG = "{} is mandatory part of the response schema and must be present in the response"
+
+## What vRA expects back from an IPAM operation:
+## - key: the response field holding the results.
+## - is_list: whether that field is a list of results or a single one.
+## - required: the fields every result must contain.
+## - non_empty_lists: the fields of every result which must be non-empty lists.
+## - inputs: the input list the results answer, one result per input, or None.
+## - id_field: the result field holding the id of the input it answers, or None.
+ResponseSchema = namedtuple('ResponseSchema', ['key', 'is_list', 'required', 'non_empty_lists', 'inputs', 'id_field'])
+ResponseSchema.__new__.__defaults__ = (False, (), (), None, None)
+
+RESPONSE_SCHEMAS = {
+    "validate_endpoint": ResponseSchema("message"),
+    "get_ip_ranges": ResponseSchema("ipRanges", True, ("id", "name", "startIPAddress", "endIPAddress", "ipVersion", "subnetPrefixLength")),
+    "allocate_ip": ResponseSchema("ipAllocations", True, ("ipAllocationId", "ipRangeId", "ipVersion", "ipAddresses"), ("ipAddresses",),
+                                  "ipAllocations", "ipAllocationId"),
+    "deallocate_ip": ResponseSchema("ipDeallocations", True, ("ipDeallocationId",), (), "ipDeallocations", "ipDeallocationId"),
+    "update_record": ResponseSchema("updateResults", True, (), (), "addressInfos"),
+    "get_ip_blocks": ResponseSchema("ipBlocks", True, ("id", "name", "ipBlockCIDR", "ipVersion")),
+    "allocate_ip_range": ResponseSchema("ipRange", False, ("id", "name", "startIPAddress", "endIPAddress", "ipVersion", "subnetPrefixLength")),
+    "deallocate_ip_range": ResponseSchema("message"),
+}
+
+def validation_enabled(endpoint_properties):
+    """ Tells whether responses should be validated, which the validateResponses endpoint setting can turn off """
+    return str(endpoint_properties.get("validateResponses", "true")).lower() != "false"
+
+def validate_response(operation, result, inputs):
+    """ Checks the result of an IPAM operation against its ResponseSchema in a single pass.
+        Raises AssertionError describing the first violation found.
+    """
+    schema = RESPONSE_SCHEMAS[operation]
+    _check(isinstance(result, dict), f"The {operation} response must be an object")
+    value = result.get(schema.key)
+    _check(value is not None, ERR_MSG.format(schema.key))
+    if not schema.is_list:
+        _check_item(schema, value, schema.key)
+        return
+
+    _check(isinstance(value, list), f"{schema.key} must be a list type")
+    input_ids = None
+    if schema.inputs is not None:
+        _check(len(value) == len(inputs[schema.inputs]), f"Size of {schema.key} in the inputs is different than the one in the outputs")
+        if schema.id_field is not None:
+            input_ids = {item["id"] for item in inputs[schema.inputs]}
+    seen = set()
+    for i, item in enumerate(value):
+        path = f"{schema.key}[{i}]"
+        _check_item(schema, item, path)
+        if input_ids is not None:
+            item_id = item[schema.id_field]
+            _check(item_id in input_ids, f"{path} with id {item_id} doesn't match any of the inputs {schema.inputs}")
+            _check(item_id not in seen, f"{path} with id {item_id} answers an input which already has a result")
+            seen.add(item_id)
+
+def _check_item(schema, item, path):
+    if not schema.required and not schema.non_empty_lists:
+        return
+    _check(isinstance(item, dict), f"{path} must be an object")
+    for field in schema.required:
+        _check(item.get(field) is not None, ERR_MSG.format(f"{path}['{field}']"))
+    for field in schema.non_empty_lists:
+        _check(isinstance(item.get(field), list), f"{path}['{field}'] must be a list type")
+        _check(len(item[field]) > 0, f"{path}['{field}'] must not be empty")
+
+def _check(condition, message):
+    # an explicit raise rather than assert, which python -O would strip
+    if not condition:
+        raise AssertionError(message)
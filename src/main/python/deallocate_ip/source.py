@@ -11,8 +11,10 @@ conditions of the subcomponent's license, as noted in the LICENSE file.
 Modifications for phpIPAM by John Bowdre (john@bowdre.net) 
 """
 
-import requests
 from vra_ipam_utils.ipam import IPAM
+from vra_ipam_utils.client import PhpIpamClient
+from vra_ipam_utils.concurrency import concurrent_map, get_max_concurrency
+from vra_ipam_utils.exceptions import combined_exception
 import logging
 
 """
@@ -67,51 +69,45 @@ def handler(context, inputs):
 
     return ipam.deallocate_ip()
 
-def auth_session(uri, auth, cert):
-    auth_uri = f'{uri}/user/'
-    req = requests.post(auth_uri, auth=auth, verify=cert)
-    if req.status_code != 200:
-      raise requests.exceptions.RequestException('Authentication Failure!')
-    token = {"token": req.json()['data']['token']}
-    return token
-
 def do_deallocate_ip(self, auth_credentials, cert):
-    # Build variables
-    username = auth_credentials["privateKeyId"]
-    password = auth_credentials["privateKey"]
-    hostname = self.inputs["endpoint"]["endpointProperties"]["hostName"]
-    apiAppId = self.inputs["endpoint"]["endpointProperties"]["apiAppId"]
-    uri = f'https://{hostname}/api/{apiAppId}/'
-    auth = (username, password)
-
-    # Auth to API
-    token = auth_session(uri, auth, cert)
-    bundle = {
-      'uri': uri,
-      'token': token,
-      'cert': cert
-    }
+    endpointProperties = self.inputs["endpoint"]["endpointProperties"]
+    client = PhpIpamClient.from_endpoint(endpointProperties, auth_credentials, cert)
+
+    deallocations = self.inputs["ipDeallocations"]
+    outcomes = concurrent_map(
+        lambda deallocation: deallocate(self.inputs["resourceInfo"], deallocation, client),
+        deallocations,
+        get_max_concurrency(endpointProperties)
+    )
 
     deallocation_result = []
-    for deallocation in self.inputs["ipDeallocations"]:
-        deallocation_result.append(deallocate(self.inputs["resourceInfo"], deallocation, bundle))
+    failures = []
+    for deallocation, (result, error) in zip(deallocations, outcomes):
+        if error is not None:
+            logging.error("Failed to deallocate ip %s from range %s: %s", deallocation['ipAddress'], deallocation['ipRangeId'], error)
+            failures.append(f"{deallocation['ipAddress']} ({str(error)})")
+        else:
+            deallocation_result.append(result)
+
+    # Report the failure to vRA rather than claiming success, so that the deallocation is retried
+    if failures:
+        raise combined_exception(f"Failed to deallocate {len(failures)} of {len(deallocations)} addresses: {'; '.join(failures)}", [error for _, error in outcomes])
 
     assert len(deallocation_result) > 0
     return {
         "ipDeallocations": deallocation_result
     }
 
-def deallocate(resource, deallocation, bundle):
-    uri = bundle['uri']
-    token = bundle['token']
-    cert = bundle['cert']
+def deallocate(resource, deallocation, client):
     ip_range_id = deallocation["ipRangeId"]
     ip = deallocation["ipAddress"]
 
-    logging.info(f"Deallocating ip {ip} from range {ip_range_id}")
+    logging.info("Deallocating ip %s from range %s", ip, ip_range_id)
 
-    deallocate_uri = f'{uri}/addresses/{ip}/{ip_range_id}/'
-    requests.delete(deallocate_uri, headers=token, verify=cert)
+    # An address already gone from its range was released by an earlier attempt. It is never looked
+    # up in other subnets, which may be overlapping subnets of other sections holding unrelated hosts
+    if not client.release_address(ip, ip_range_id):
+      logging.info("Ip %s was already released from range %s", ip, ip_range_id)
     return {
         "ipDeallocationId": deallocation["id"],
         "message": "Success"
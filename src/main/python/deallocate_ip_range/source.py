@@ -9,8 +9,10 @@ and license terms. Your use of these subcomponents is subject to the terms and
 conditions of the subcomponent's license, as noted in the LICENSE file.
 """
 
-import requests
 from vra_ipam_utils.ipam import IPAM
+from vra_ipam_utils.client import PhpIpamClient, error_message
+from vra_ipam_utils.concurrency import concurrent_map, get_max_concurrency, log_progress
+from vra_ipam_utils.exceptions import combined_exception
 import logging
 
 """
@@ -51,24 +53,56 @@ def handler(context, inputs):
     return ipam.deallocate_ip_range()
 
 def do_deallocate_ip_range(self, auth_credentials, cert):
-    # Your implemention goes here
+    endpointProperties = self.inputs["endpoint"]["endpointProperties"]
+    client = PhpIpamClient.from_endpoint(endpointProperties, auth_credentials, cert)
 
-    username = auth_credentials["privateKeyId"]
-    password = auth_credentials["privateKey"]
-    deallocation_result = deallocate(self.inputs["resourceInfo"], self.inputs["ipRangeDeallocation"])
+    deallocation_result = deallocate(self.inputs["resourceInfo"], self.inputs["ipRangeDeallocation"], client, get_max_concurrency(endpointProperties))
 
     return {
         "message": f"Successfully deallocated {str(deallocation_result)}"
     }
 
-def deallocate(resource, deallocation):
+def deallocate(resource, deallocation, client, max_workers):
     ip_range_id = deallocation["ipRangeId"]
-    resource_id = resource["id"]
 
-    logging.info(f"Deallocating ip range {ip_range_id}")
+    logging.info("Deallocating ip range %s", ip_range_id)
 
-    ## Plug your implementation here to deallocate an already allocated ip address
-    ## ...
-    ## Deallocation successful
+    subnet_req = client.get('subnets', ip_range_id)
+    if subnet_req.status_code == 404:
+      # already removed, e.g. when vRA retries a deallocation which timed out
+      logging.info("Ip range %s doesn't exist anymore", ip_range_id)
+      return f"ip range {ip_range_id} (already removed)"
+    if subnet_req.status_code != 200:
+      raise Exception(f"Unable to find ip range {ip_range_id}: {error_message(subnet_req)}")
+    subnet = subnet_req.json()['data']
+    name = f"{subnet['subnet']}/{subnet['mask']}"
 
-    return "Deallocated!"
+    release_addresses(ip_range_id, name, client, max_workers)
+
+    delete_req = client.delete('subnets', ip_range_id)
+    if delete_req.status_code not in (200, 404):
+      raise Exception(f"Released the addresses of ip range {name} but failed to delete it: {error_message(delete_req)}")
+    logging.info("Deleted ip range %s", name)
+    return f"ip range {name}"
+
+def release_addresses(ip_range_id, name, client, max_workers):
+    """ Removes every address of a range before the range itself is deleted """
+    # phpIPAM can truncate a subnet in a single request
+    truncate_req = client.delete('subnets', ip_range_id, 'truncate')
+    if truncate_req.status_code == 200:
+      logging.info("Truncated ip range %s", name)
+      return
+
+    # otherwise the addresses are listed once and deleted concurrently
+    logging.info("Unable to truncate ip range %s (%s), deleting its addresses one by one", name, error_message(truncate_req))
+    addresses = [address['ip'] for address in client.stream('subnets', ip_range_id, 'addresses')]
+    outcomes = concurrent_map(
+      lambda ip: client.release_address(ip, ip_range_id),
+      addresses,
+      max_workers,
+      log_progress(f"Releasing the addresses of ip range {name}")
+    )
+    failures = [f"{ip} ({str(error)})" for ip, (_, error) in zip(addresses, outcomes) if error is not None]
+    if failures:
+      # the range is left in place so that a retry picks up the remaining addresses
+      raise combined_exception(f"Failed to release {len(failures)} of {len(addresses)} addresses of ip range {name}: {'; '.join(failures[:10])}", [error for _, error in outcomes])
@@ -9,8 +9,12 @@ and license terms. Your use of these subcomponents is subject to the terms and
 conditions of the subcomponent's license, as noted in the LICENSE file.
 """
 
-import requests
 from vra_ipam_utils.ipam import IPAM
+from vra_ipam_utils.client import PhpIpamClient
+from vra_ipam_utils.filters import get_filter
+from vra_ipam_utils.geometry import address_to_int
+from vra_ipam_utils.paging import get_paging, paginate
+from vra_ipam_utils.ranges import parse_nameservers
 import logging
 
 '''
@@ -39,92 +43,75 @@ def handler(context, inputs):
     return ipam.get_ip_blocks()
 
 def do_get_ip_blocks(self, auth_credentials, cert):
-    # Your implemention goes here
-    username = auth_credentials["privateKeyId"]
-    password = auth_credentials["privateKey"]
-
-    ## If many IP blocks are expected on the IPAM server, it is considered a best practice
-    ## to return them page by page instead of all at once.
-    ## The vRA IPAM Service will propagate a pageToken string with each consecutive request
-    ## until all pages are exhausted
-    pageToken = self.inputs['pagingAndSorting'].get('pageToken', None) ## The first request that vRA sends is with 'None' pageToken
-
-    ## Plug your implementation here to collect all the ip blocks from the external IPAM system
-    result_ip_blocks, next_page_token = collect_ip_blocks(pageToken)
-
+    # Build variables
+    endpointProperties = self.inputs["endpoint"]["endpointProperties"]
+    subnetFilter = get_filter(endpointProperties)
+    maxResults, afterId = get_paging(self.inputs)
+
+    client = PhpIpamClient.from_endpoint(endpointProperties, auth_credentials, cert)
+
+    ## An ip block is a master subnet, i.e. a subnet other subnets are nested in. The subnet
+    ## records don't tell whether they have children, so every subnet is read once from a single
+    ## streamed listing and only the ones matching the filter are kept as candidates.
+    masterIds = set()
+    candidates = []
+    for subnet in client.stream('subnets'):
+        if str(subnet.get('masterSubnetId', '0')) != '0':
+          masterIds.add(str(subnet['masterSubnetId']))
+        if str(subnet.get('isFolder', '0')) == '1' or not subnet.get('subnet'):
+          continue
+        if subnetFilter is None or subnetFilter.matches(subnet):
+          candidates.append(subnet)
+    blocks = (subnet for subnet in candidates if str(subnet['id']) in masterIds)
+    blocks, nextPageToken = paginate(blocks, maxResults, afterId)
+    logging.info("Returning %s ip blocks in this page", len(blocks))
+
+    # Details shared by many blocks are fetched in bulk, once per page at most
+    nameservers = LazyMap(lambda: {str(ns['id']): ns for ns in client.stream('tools', 'nameservers')})
+    sections = LazyMap(lambda: {str(section['id']): section for section in client.stream('sections')})
+
+    ipBlocks = []
+    for subnet in blocks:
+        ipBlocks.append(build_ip_block(subnet, nameservers, sections))
+
+    # Return results to vRA
     result = {
-        "ipBlocks": result_ip_blocks
+        "ipBlocks": ipBlocks
     }
-
-    ## Return the next page token so that vRA can process the first page and then fetch the second page or ip blocks with the next request
-    if next_page_token is not None:
-        result["nextPageToken"] = next_page_token
-
+    if nextPageToken is not None:
+        result["nextPageToken"] = nextPageToken
     return result
 
-def collect_ip_blocks(pageToken):
-    logging.info("Collecting ip blocks")
-
-    ip_block1 = {
-        "id": "block1",
-
-        "name": "sample name 1",
-
-        "ipBlockCIDR": "10.10.0.0/16",
-
-        "description": "sampleDescription",
-
-        "ipVersion": "IPv4",
-
-        "addressSpaceId": "default",
-
-        "gatewayAddress": "10.10.13.1",
-
-        "domain": "test.local",
-
-        "tags": [{
-            "key": "Building",
-            "value": "VMware main facility"
-        }],
-
-        "properties": {
-        }
-    }
-
-    ip_block2 = {
-        "id": "block2",
-
-        "name": "sample name 2",
-
-        "ipBlockCIDR": "10.10.40.0/24",
-
-        "description": "sampleDescription",
-
-        "ipVersion": "IPv4",
-
-        "addressSpaceId": "default",
-
-        "dnsServerAddresses": ["10.10.17.3", "10.10.22.1"],
-
-        "dnsSearchDomains": ["com", "net", "test.local"],
-
-        "domain": "test.local",
-
-        "tags": [{
-            "key": "Building",
-            "value": "VMware main facility"
-        }],
-
-        "properties": {
-        }
-    }
-
-    result = []
-    next_page_token = None
-    if pageToken is None:
-        result = [ip_block1]
-        next_page_token = "87811419dec2112cda2aa29685685d650ac1f61f"
+def build_ip_block(subnet, nameservers, sections):
+    ipBlock = {}
+    ipBlock['id'] = str(subnet['id'])
+    ipBlock['ipBlockCIDR'] = f"{str(subnet['subnet'])}/{str(subnet['mask'])}"
+    ipBlock['name'] = ipBlock['ipBlockCIDR']
+    ipBlock['description'] = str(subnet.get('description') or '')
+    ipBlock['ipVersion'] = f"IPv{address_to_int(str(subnet['subnet']))[0]}"
+    ipBlock['addressSpaceId'] = 'default'
+    logging.debug("Found ip block: %s - %s.", ipBlock['name'], ipBlock['description'])
+    if subnet.get('nameservers') is None and str(subnet.get('nameserverId', '0')) != '0':
+      ipBlock['dnsServerAddresses'] = parse_nameservers(nameservers.get(str(subnet['nameserverId'])))
     else:
-        result = [ip_block2]
-
-    return result, next_page_token
+      ipBlock['dnsServerAddresses'] = parse_nameservers(subnet.get('nameservers'))
+    section = sections.get(str(subnet.get('sectionId')))
+    ipBlock['tags'] = [{"key": "section", "value": section['name']}] if section else []
+    ipBlock['properties'] = {}
+    return ipBlock
+
+class LazyMap(object):
+    """ Dictionary loaded by load() on first access """
+
+    def __init__(self, load):
+        self.load = load
+        self.data = None
+
+    def get(self, key):
+        if self.data is None:
+          try:
+            self.data = self.load()
+          except Exception as e:
+            logging.warning("Bulk lookup failed: %s", e)
+            self.data = {}
+        return self.data.get(key)
@@ -11,10 +11,17 @@ conditions of the subcomponent's license, as noted in the LICENSE file.
 Modifications for phpIPAM by John Bowdre (john@bowdre.net) 
 """
 
-import requests
 from vra_ipam_utils.ipam import IPAM
+from vra_ipam_utils.client import PhpIpamClient
+from vra_ipam_utils.concurrency import concurrent_map, get_max_concurrency
+from vra_ipam_utils.filters import get_filter
+from vra_ipam_utils.metrics import timed
+from vra_ipam_utils.paging import get_paging, paginate
+from vra_ipam_utils.ranges import build_ip_range, parse_nameservers
+from vra_ipam_utils.snapshot import RangeSnapshot, get_snapshot_ttl
+from vra_ipam_utils.streaming import iter_data
 import logging
-import ipaddress
+import functools
 
 '''
 Example payload:
@@ -41,67 +48,109 @@ def handler(context, inputs):
 
     return ipam.get_ip_ranges()
 
-def auth_session(uri, auth, cert):
-    auth_uri = f'{uri}/user/'
-    req = requests.post(auth_uri, auth=auth, verify=cert)
-    if req.status_code != 200:
-        raise requests.exceptions.RequestException('Authentication Failure!')
-    token = {"token": req.json()['data']['token']}
-    return token
+@timed("gateways")
+def get_gateways(client):
+    """ Fetches every address flagged as a gateway in a single query and indexes them by subnet id.
+        Returns None if the phpIPAM server can't list addresses in bulk so the caller can fall back
+        to querying each subnet individually.
+    """
+    gw_req = client.get('addresses', params={'filter_by': 'is_gateway', 'filter_value': 1}, stream=True)
+    if gw_req.status_code != 200:
+      gw_req.close()
+      logging.info("Bulk gateway lookup is not supported by this phpIPAM server; falling back to per-subnet queries")
+      return None
+    gateways = {}
+    for address in iter_data(gw_req):
+      # keep the first gateway found for each subnet, matching the per-subnet lookup
+      gateways.setdefault(str(address['subnetId']), address['ip'])
+    logging.info("Found %s gateway addresses", len(gateways))
+    return gateways
+
+def get_subnet_gateway(client, subnet_id):
+    gw_req = client.get('subnets', subnet_id, 'addresses', params={'filter_by': 'is_gateway', 'filter_value': 1})
+    if gw_req.status_code == 200 and 'data' in gw_req.json():
+      return gw_req.json()['data'][0]['ip']
+    return None
+
+def get_nameservers(client, nameserver_id):
+    ns_req = client.get('tools', 'nameservers', nameserver_id)
+    if ns_req.status_code == 200 and 'data' in ns_req.json():
+      return ns_req.json()['data']
+    return None
 
 def do_get_ip_ranges(self, auth_credentials, cert):
     # Build variables
-    username = auth_credentials["privateKeyId"]
-    password = auth_credentials["privateKey"]
-    hostname = self.inputs["endpoint"]["endpointProperties"]["hostName"]
-    apiAppId = self.inputs["endpoint"]["endpointProperties"]["apiAppId"]
-    enableFilter = self.inputs["endpoint"]["endpointProperties"]["enableFilter"]
-    filterField = self.inputs["endpoint"]["endpointProperties"]["filterField"]
-    filterValue = self.inputs["endpoint"]["endpointProperties"]["filterValue"]
-    uri = f'https://{hostname}/api/{apiAppId}/'
-    auth = (username, password)
-
-    # Auth to API
-    token = auth_session(uri, auth, cert)
-
-    # Request list of subnets
-    subnet_uri = f'{uri}/subnets/'
-    if enableFilter == "true":
-      queryFilter = f'filter_by={filterField}&filter_value={filterValue}'
-      logging.info(f"Searching for subnets matching filter: {queryFilter}")
+    endpointProperties = self.inputs["endpoint"]["endpointProperties"]
+    subnetFilter = get_filter(endpointProperties)
+    maxConcurrency = get_max_concurrency(endpointProperties)
+    maxResults, afterId = get_paging(self.inputs)
+
+    # The client's connection pool is shared by all the enrichment workers
+    client = PhpIpamClient.from_endpoint(endpointProperties, auth_credentials, cert)
+
+    # Request list of subnets, letting phpIPAM evaluate as much of the filter as it can
+    if subnetFilter is not None:
+      path, queryFilter, residual = subnetFilter.plan()
+      logging.info("Searching for subnets matching filter: %s on /%s/, %s condition(s) checked locally", queryFilter, '/'.join(path), len(residual))
     else:
-      queryFilter = ''
-      logging.info(f"Searching for all known subnets")
+      path, queryFilter, residual = ('subnets',), {}, []
+      logging.info("Searching for all known subnets")
     ipRanges = []
-    subnets = requests.get(f'{subnet_uri}?{queryFilter}', headers=token, verify=cert)
-    subnets = subnets.json()['data']
+    # Subnets are decoded one at a time and only the requested page is kept; vRA asks for the next
+    # one with nextPageToken. The ids of all matching subnets are kept to prune the snapshot.
+    subnetIds = []
+    def matching_subnets():
+        for subnet in client.stream(*path, params=queryFilter):
+          if not residual or subnetFilter.matches(subnet, residual):
+            subnetIds.append(subnet['id'])
+            yield subnet
+    subnets, nextPageToken = paginate(matching_subnets(), maxResults, afterId)
+    logging.info("Returning %s subnets in this page", len(subnets))
+    gateways = get_gateways(client)
+    # Ranges built by a previous run are reused as long as their subnet hasn't changed
+    snapshot = RangeSnapshot(client.uri, subnetFilter and subnetFilter.key(), get_snapshot_ttl(endpointProperties))
+    changed = []
     for subnet in subnets:
-        ipRange = {}
-        ipRange['id'] = str(subnet['id'])
-        ipRange['name'] = f"{str(subnet['subnet'])}/{str(subnet['mask'])}"
-        ipRange['description'] = str(subnet['description'])
-        logging.info(f"Found subnet: {ipRange['name']} - {ipRange['description']}.")
-        network = ipaddress.ip_network(str(subnet['subnet']) + '/' + str(subnet['mask']))
-        ipRange['ipVersion'] = 'IPv' + str(network.version)
-        ipRange['startIPAddress'] = str(network[1])
-        ipRange['endIPAddress'] = str(network[-2])
-        ipRange['subnetPrefixLength'] = str(subnet['mask'])
-        # return empty set if no nameservers are defined in IPAM
-        try:
-          ipRange['dnsServerAddresses'] = [server.strip() for server in str(subnet['nameservers']['namesrv1']).split(';')]
-        except:
-          ipRange['dnsServerAddresses'] = []
-        # try to get the address marked as the gateway in IPAM  
-        gw_req = requests.get(f"{subnet_uri}/{subnet['id']}/addresses/?filter_by=is_gateway&filter_value=1", headers=token, verify=cert)
-        if gw_req.status_code == 200 and 'data' in gw_req.json():
-          gateway = gw_req.json()['data'][0]['ip']
-          ipRange['gatewayAddress'] = gateway
-        logging.debug(ipRange)
+        ipRange = snapshot.get(subnet)
+        if ipRange is None:
+          ipRange = build_ip_range(subnet)
+          changed.append((subnet, ipRange))
+        if gateways is not None:
+          # gateways come from a single bulk query, so they are always current
+          ipRange.pop('gatewayAddress', None)
+          if str(subnet['id']) in gateways:
+            ipRange['gatewayAddress'] = gateways[str(subnet['id'])]
         ipRanges.append(ipRange)
+    logging.info("Reused %s unchanged subnets from the snapshot, rebuilding %s", snapshot.hits, len(changed))
+
+    # Subnets which only reference their nameserver set share the lookup
+    @functools.lru_cache(maxsize=None)
+    def lookup_nameservers(nameserver_id):
+        return get_nameservers(client, nameserver_id)
+
+    # Details which can't be fetched in bulk are looked up concurrently, one subnet per task
+    def enrich(item):
+        subnet, ipRange = item
+        if subnet.get('nameservers') is None and str(subnet.get('nameserverId', '0')) != '0':
+          ipRange['dnsServerAddresses'] = parse_nameservers(lookup_nameservers(str(subnet['nameserverId'])))
+        if gateways is None:
+          # try to get the address marked as the gateway in IPAM
+          gateway = get_subnet_gateway(client, subnet['id'])
+          if gateway is not None:
+            ipRange['gatewayAddress'] = gateway
+        logging.debug("Built ip range %s", ipRange)
+
+    for (subnet, ipRange), (_, error) in zip(changed, concurrent_map(enrich, changed, maxConcurrency)):
+        if error is not None:
+          logging.error("Failed to look up details for subnet %s: %s", ipRange['name'], error)
+        else:
+          snapshot.put(subnet, ipRange)
+    snapshot.save(subnetIds)
 
     # Return results to vRA
     result = {
         "ipRanges" : ipRanges
     }
+    if nextPageToken is not None:
+        result["nextPageToken"] = nextPageToken
     return result
- 
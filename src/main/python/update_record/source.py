@@ -9,8 +9,11 @@ and license terms. Your use of these subcomponents is subject to the terms and
 conditions of the subcomponent's license, as noted in the LICENSE file.
 """
 
-import requests
 from vra_ipam_utils.ipam import IPAM
+from vra_ipam_utils.address_ids import AddressIdCache
+from vra_ipam_utils.client import PhpIpamClient, error_message
+from vra_ipam_utils.concurrency import concurrent_map, get_max_concurrency
+from vra_ipam_utils.metrics import timed
 import logging
 
 """
@@ -66,27 +69,70 @@ def handler(context, inputs):
     return ipam.update_record()
 
 def do_update_record(self, auth_credentials, cert):
-    # Your implemention goes here
+    endpointProperties = self.inputs["endpoint"]["endpointProperties"]
+    client = PhpIpamClient.from_endpoint(endpointProperties, auth_credentials, cert)
 
-    username = auth_credentials["privateKeyId"]
-    password = auth_credentials["privateKey"]
-    update_result = []
+    # ids remembered when the addresses were allocated spare a search per record
+    address_ids = AddressIdCache(client.uri)
     resource = self.inputs["resourceInfo"]
-    for update_record in self.inputs["addressInfos"]:
-        update_result.append(update(resource, self.inputs, update_record))
+    update_records = self.inputs["addressInfos"]
+    outcomes = concurrent_map(
+        lambda update_record: update(resource, self.inputs, update_record, client, address_ids),
+        update_records,
+        get_max_concurrency(endpointProperties)
+    )
+    address_ids.save()
+
+    update_result = []
+    for update_record, (result, error) in zip(update_records, outcomes):
+        if error is not None:
+            raise error
+        update_result.append(result)
 
     assert len(update_result) > 0
     return {
         "updateResults": update_result
     }
 
-def update(resource, inputs, update_record):
+def update(resource, inputs, update_record, client, address_ids):
     try:
-        ## Plug your implementation here to update the MAC address of an already allocate ip record
-        ## Search the record and update its MAC
-        mac = update_record["macAddress"]
+        ip = update_record["address"]
+        payload = {'mac': update_record["macAddress"]}
+        if resource.get("name"):
+          payload['hostname'] = resource["name"]
 
+        address_id = address_ids.get(ip)
+        if address_id is not None:
+          update_req = client.patch('addresses', address_id, data=payload)
+          if update_req.status_code == 200:
+            logging.info("Updated record %s with mac %s", ip, payload['mac'])
+            return "Success"
+          # the cached id is stale, e.g. the address was deleted and created again
+          logging.info("Cached id %s of %s was rejected: %s", address_id, ip, error_message(update_req))
+          address_ids.discard(ip)
+
+        address_id = find_address_id(client, ip, resource.get("name"))
+        update_req = client.patch('addresses', address_id, data=payload)
+        if update_req.status_code != 200:
+          raise Exception(f"Unable to update {ip}: {error_message(update_req)}")
+        address_ids.put(ip, address_id)
+        logging.info("Updated record %s with mac %s", ip, payload['mac'])
         return "Success"
     except Exception as e:
-        logging.error(f"Failed to update record {update_record}: {e}")
+        logging.error("Failed to update record %s: %s", update_record, e)
         raise e
+
+@timed("address_search")
+def find_address_id(client, ip, hostname):
+    """ Searches phpIPAM for the address ip. When the same ip exists in several sections, only the
+        record reserved for hostname is used; another section's host is never picked by guess.
+    """
+    records = list(client.stream('addresses', 'search', ip))
+    if not records:
+      raise Exception(f"Address {ip} not found in phpIPAM")
+    if len(records) == 1:
+      return str(records[0]['id'])
+    matches = [record for record in records if hostname and record.get('hostname') == hostname]
+    if len(matches) != 1:
+      raise Exception(f"Address {ip} matches {len(records)} records in phpIPAM and {len(matches)} of them have hostname {hostname}, unable to tell which one to update")
+    return str(matches[0]['id'])
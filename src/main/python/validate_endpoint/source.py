@@ -11,9 +11,10 @@ conditions of the subcomponent's license, as noted in the LICENSE file.
 Modifications for phpIPAM by John Bowdre (john@bowdre.net) 
 """
 
-import requests
 from vra_ipam_utils.ipam import IPAM
-from vra_ipam_utils.exceptions import InvalidCertificateException
+from vra_ipam_utils.client import PhpIpamClient
+from vra_ipam_utils.exceptions import AuthenticationException, InvalidCertificateException
+from vra_ipam_utils.filters import get_filter
 import logging
 
 
@@ -34,38 +35,25 @@ def handler(context, inputs):
 
     return ipam.validate_endpoint()
 
-def auth_session(uri, auth, cert):
-    auth_uri = f'{uri}/user/'
-    req = requests.post(auth_uri, auth=auth, verify=cert)
-    ## We don't need to handle errors or save the token here since we're just validating the endpoint
-    # if req.status_code != 200:
-    #     raise requests.exceptions.RequestException('Authentication Failed!')
-    # logging.info('Authentication successful.')
-    # token = {"token": req.json()['data']['token']}
-    # return token
-    return req
-
 def do_validate_endpoint(self, auth_credentials, cert):
-    # Build variables
-    username = auth_credentials["privateKeyId"]
-    password = auth_credentials["privateKey"]
-    hostname = self.inputs["endpointProperties"]["hostName"]
-    apiAppId = self.inputs["endpointProperties"]["apiAppId"]
-    uri = f'https://{hostname}/api/{apiAppId}/'
-    auth = (username, password)
+    # Reject malformed subnet filters now rather than during the next IP range collection
+    get_filter(self.inputs["endpointProperties"])
+    client = PhpIpamClient.from_endpoint(self.inputs["endpointProperties"], auth_credentials, cert)
 
     # Test auth connection
     try:
-        response = auth_session(uri, auth, cert)
+        response = client.login()
 
         if response.status_code == 200:
+            # Warm the token cache for the actions which run next in this container
+            client.token_auth.remember(response.json()['data'])
             return {
                 "message": "Validated successfully",
                 "statusCode": "200"
             }
         elif response.status_code == 500 and response.json()['message'] == 'Invalid username or password':
-            logging.error(f"Invalid credentials error: {str(response.content)}")
-            raise Exception(f"Invalid credentials error: {str(response.content)}")
+            logging.error("Invalid credentials error: %s", response.content)
+            raise AuthenticationException(f"Invalid credentials error: {str(response.content)}")
         else:
             raise Exception(f"Failed to connect: {str(response.content)}")
     except Exception as e:
@@ -0,0 +1,232 @@
+"""
+Runs every ABX action against the offline phpIPAM simulator and compares wall time, request
+count and peak RSS with a recorded baseline, exiting with status 1 on a regression.
+
+Each scenario imports and runs its action in a fresh interpreter, so that its wall time includes
+the cold start and its peak RSS isn't polluted by the simulator or by the previous scenarios.
+Scenarios sharing a cache run with the same temp directory, like consecutive runs of an action
+in a warm ABX container.
+
+Usage (from the repository root):
+    python src/test/python/benchmarks/action_benchmark.py [--subnets N] [--addresses N] [--latency S]
+    python src/test/python/benchmarks/action_benchmark.py --update-baseline
+
+Wall times depend on the machine, so the baseline should be recorded on the machine comparing
+against it. Request counts are deterministic and compared strictly.
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+TEST_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SOURCE_DIR = os.path.join(TEST_DIR, '..', '..', 'main', 'python')
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'action_benchmark_baseline.json')
+
+sys.path.insert(0, os.path.join(TEST_DIR, 'simulator'))
+
+## Allowed growth before a metric counts as a regression. Small absolute slacks keep
+## very short scenarios from failing on scheduling noise.
+TIME_TOLERANCE = 1.5
+TIME_SLACK = 0.05
+RSS_TOLERANCE = 1.2
+RSS_SLACK_MB = 2
+
+def endpoint_properties(host, **properties):
+    return dict({
+        "hostName": host,
+        "apiAppId": "vra",
+        "enableFilter": "true",
+        "filterField": "custom_vRA_Range",
+        "filterValue": "1",
+        "isMockRequest": True
+    }, **properties)
+
+def endpoint(host, **properties):
+    return {"id": "benchmark", "authCredentialsLink": "/credentials", "endpointProperties": endpoint_properties(host, **properties)}
+
+RESOURCE = {"id": "benchmark-vm", "name": "benchmark-vm", "owner": "benchmark", "type": "VM", "properties": {}}
+
+## Network interfaces of the virtual machine whose addresses are allocated, updated and released
+NICS = 4
+
+def allocation_results(name):
+    """ Stores the addresses allocated by a scenario for the scenarios updating and releasing them """
+    def collect(result, state):
+        state[name] = result["ipAllocations"]
+    return collect
+
+def scenarios(args):
+    """ Returns the scenarios in the order they run. Later scenarios act on what earlier ones allocated. """
+    return [
+        {"name": "validate_endpoint", "action": "validate_endpoint",
+         "inputs": lambda host, state: {"authCredentialsLink": "/credentials", "endpointProperties": endpoint_properties(host)}},
+
+        {"name": "get_ip_ranges", "action": "get_ip_ranges", "cache": "ranges",
+         "inputs": lambda host, state: {"endpoint": endpoint(host), "pagingAndSorting": {"maxResults": args.subnets}}},
+        {"name": "get_ip_ranges_warm", "action": "get_ip_ranges", "cache": "ranges",
+         "inputs": lambda host, state: {"endpoint": endpoint(host), "pagingAndSorting": {"maxResults": args.subnets}}},
+        {"name": "get_ip_ranges_per_subnet", "action": "get_ip_ranges", "bulk_addresses": False,
+         "inputs": lambda host, state: {"endpoint": endpoint(host, snapshotTtl="0"), "pagingAndSorting": {"maxResults": 1000}}},
+        {"name": "get_ip_blocks", "action": "get_ip_blocks",
+         "inputs": lambda host, state: {"endpoint": endpoint(host, enableFilter="false"), "pagingAndSorting": {"maxResults": 1000}}},
+
+        {"name": "allocate_ip", "action": "allocate_ip", "cache": "vm", "collect": allocation_results("nics"),
+         "inputs": lambda host, state: {"endpoint": endpoint(host), "resourceInfo": RESOURCE,
+                                        "ipAllocations": [{"id": f"nic{i}", "ipRangeIds": [str(2 + i)], "nicIndex": str(i), "isPrimary": str(i == 0).lower(),
+                                                           "size": "1", "properties": {}} for i in range(NICS)]}},
+        {"name": "allocate_ip_block", "action": "allocate_ip", "cache": "vm", "collect": allocation_results("block"),
+         "inputs": lambda host, state: {"endpoint": endpoint(host), "resourceInfo": RESOURCE,
+                                        "ipAllocations": [{"id": "block", "ipRangeIds": [str(2 + NICS)], "nicIndex": str(NICS), "isPrimary": "false", "size": "16", "properties": {}}]}},
+        {"name": "update_record", "action": "update_record", "cache": "vm",
+         "inputs": lambda host, state: {"endpoint": endpoint(host), "resourceInfo": RESOURCE,
+                                        "addressInfos": [{"nicIndex": i, "address": nic["ipAddresses"][0], "macAddress": f"00:50:56:00:00:{i:02x}"}
+                                                         for i, nic in enumerate(state["nics"])]}},
+        {"name": "deallocate_ip", "action": "deallocate_ip", "cache": "vm",
+         "inputs": lambda host, state: {"endpoint": endpoint(host), "resourceInfo": RESOURCE,
+                                        "ipDeallocations": [{"id": nic["ipAllocationId"], "ipRangeId": nic["ipRangeId"], "ipAddress": nic["ipAddresses"][0]}
+                                                            for nic in state["nics"]]}},
+
+        {"name": "allocate_ip_range", "action": "allocate_ip_range", "collect": lambda result, state: state.update(ip_range=result["ipRange"]),
+         "inputs": lambda host, state: {"endpoint": endpoint(host), "resourceInfo": RESOURCE,
+                                        "ipRangeAllocation": {"name": "benchmark-net", "ipBlockIds": ["1"], "subnetCidr": "0.0.0.0/24", "addressSpaceId": "default", "properties": {}}}},
+        {"name": "deallocate_ip_range", "action": "deallocate_ip_range",
+         "inputs": lambda host, state: {"endpoint": endpoint(host), "resourceInfo": RESOURCE,
+                                        "ipRangeDeallocation": {"id": "benchmark-net", "ipRangeId": state["ip_range"]["id"]}}},
+    ]
+
+def run_action(action, inputs_path, output_path):
+    """ Runs in the child interpreter: imports action, calls its handler and records their cost.
+        The import is timed with the handler, as the dependencies it defers are loaded by the handler.
+    """
+    with open(inputs_path) as f:
+        inputs = json.load(f)
+
+    start = time.perf_counter()
+    sys.path.insert(0, os.path.join(SOURCE_DIR, 'commons'))
+    spec = importlib.util.spec_from_file_location(f"{action}_source", os.path.join(SOURCE_DIR, action, 'source.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    result = module.handler(None, inputs)
+    seconds = time.perf_counter() - start
+
+    with open(output_path, 'w') as f:
+        json.dump({"seconds": seconds, "max_rss_mb": peak_rss_mb(), "result": result}, f)
+
+def peak_rss_mb():
+    """ Returns the peak resident set size of the current process in MiB """
+    # Linux carries ru_maxrss over from the forking process across exec, which would report the
+    # peak of the benchmark driver and its simulator, so the high water mark of this process is used
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+def run_scenario(scenario, sim, state, cache_dirs, workdir, verbose):
+    inputs_path = os.path.join(workdir, f"{scenario['name']}.inputs.json")
+    output_path = os.path.join(workdir, f"{scenario['name']}.output.json")
+    with open(inputs_path, 'w') as f:
+        json.dump(scenario["inputs"](sim.host_name, state), f)
+
+    cache = scenario.get("cache", scenario["name"])
+    if cache not in cache_dirs:
+        cache_dirs[cache] = tempfile.mkdtemp(dir=workdir)
+    env = dict(os.environ, TMPDIR=cache_dirs[cache])
+
+    sim.bulk_addresses = scenario.get("bulk_addresses", True)
+    sim.reset_counters()
+    child = subprocess.run([sys.executable, os.path.abspath(__file__), "--run", scenario["action"], inputs_path, output_path],
+                           env=env, stdout=None if verbose else subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    if child.returncode != 0:
+        raise Exception(f"Scenario {scenario['name']} failed:\n{child.stderr}")
+    with open(output_path) as f:
+        output = json.load(f)
+    if output["result"].get("error"):
+        raise Exception(f"Scenario {scenario['name']} returned an error: {output['result']['error']}")
+    if "collect" in scenario:
+        scenario["collect"](output["result"], state)
+    return {"seconds": round(output["seconds"], 4), "requests": sim.request_count, "max_rss_mb": round(output["max_rss_mb"], 1)}, dict(sim.requests)
+
+def regressions(name, measured, baseline):
+    """ Returns the description of every metric of measured which regressed against baseline """
+    found = []
+    if measured["requests"] > baseline["requests"]:
+        found.append(f"{name}: {measured['requests']} requests, baseline {baseline['requests']}")
+    if measured["seconds"] > baseline["seconds"] * TIME_TOLERANCE + TIME_SLACK:
+        found.append(f"{name}: {measured['seconds']:.3f}s, baseline {baseline['seconds']:.3f}s")
+    if measured["max_rss_mb"] > baseline["max_rss_mb"] * RSS_TOLERANCE + RSS_SLACK_MB:
+        found.append(f"{name}: {measured['max_rss_mb']:.1f} MiB peak RSS, baseline {baseline['max_rss_mb']:.1f} MiB")
+    return found
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--subnets", type=int, default=10000)
+    parser.add_argument("--addresses", type=int, default=100, help="addresses per subnet")
+    parser.add_argument("--latency", type=float, default=0.002, help="seconds added to every simulated request")
+    parser.add_argument("--only", action="append", help="only run the named scenario, may be repeated")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--update-baseline", action="store_true", help="record the measurements as the new baseline")
+    parser.add_argument("--verbose", action="store_true", help="show the action logs and the requests per route")
+    args = parser.parse_args()
+
+    from phpipam_sim import Inventory, Simulator
+
+    settings = {"subnets": args.subnets, "addresses": args.addresses, "latency": args.latency}
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            recorded = json.load(f)
+        if recorded.get("settings") == settings:
+            baseline = recorded["scenarios"]
+        elif not args.update_baseline:
+            print(f"Baseline was recorded with {recorded.get('settings')}, not comparing")
+
+    inventory = Inventory(args.subnets, args.addresses)
+    print(f"{len(inventory.subnets)} subnets, {inventory.address_count} addresses, {args.latency * 1000:.0f}ms latency")
+    print(f"{'scenario':<26} {'seconds':>9} {'requests':>9} {'rss MiB':>8}")
+
+    measurements = {}
+    failures = []
+    state = {}
+    with Simulator(inventory, latency=args.latency) as sim, tempfile.TemporaryDirectory() as workdir:
+        cache_dirs = {}
+        for scenario in scenarios(args):
+            if args.only and scenario["name"] not in args.only:
+                continue
+            measured, routes = run_scenario(scenario, sim, state, cache_dirs, workdir, args.verbose)
+            measurements[scenario["name"]] = measured
+            found = regressions(scenario["name"], measured, baseline[scenario["name"]]) if scenario["name"] in baseline else []
+            failures.extend(found)
+            print(f"{scenario['name']:<26} {measured['seconds']:>9.3f} {measured['requests']:>9} {measured['max_rss_mb']:>8.1f}{'  REGRESSION' if found else ''}")
+            if args.verbose:
+                for route, count in sorted(routes.items()):
+                    print(f"    {count:>6} {route}")
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({"settings": settings, "scenarios": measurements}, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    for failure in failures:
+        print(f"Regression in {failure}")
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    if len(sys.argv) == 5 and sys.argv[1] == "--run":
+        run_action(*sys.argv[2:])
+    else:
+        sys.exit(main())
@@ -0,0 +1,161 @@
+"""
+Measures the cold start of every ABX action with python -X importtime and compares it with a
+recorded baseline, exiting with status 1 on a regression or when a heavy dependency is imported
+by an action module rather than deferred to the code which uses it.
+
+Each action is imported in fresh interpreters, the best of --runs being kept. Two figures are
+reported: the import of source.py, which delays the start of every run, and the deferred import
+of the heavy modules preloaded by vra_ipam_utils.lazy while the credentials are fetched.
+The packages weighing the most on the whole cold start are listed for each action.
+
+Usage (from the repository root):
+    python src/test/python/benchmarks/import_time.py [--runs N] [--top N]
+    python src/test/python/benchmarks/import_time.py --python-dir target/python
+    python src/test/python/benchmarks/import_time.py --update-baseline
+
+--python-dir target/python measures the actions with the dependencies collected by the build.
+Import times depend on the machine, so the baseline should be recorded on the machine comparing
+against it. The heavy dependency check doesn't depend on timings and always applies.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+TEST_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SOURCE_DIR = os.path.join(TEST_DIR, '..', '..', 'main', 'python')
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'import_time_baseline.json')
+
+sys.path.insert(0, os.path.join(SOURCE_DIR, 'commons'))
+
+## Packages which must only be imported once an operation needs them
+HEAVY_PACKAGES = ("requests", "urllib3", "certifi", "charset_normalizer", "idna", "cryptography", "OpenSSL", "cffi")
+
+## Allowed growth before an import time counts as a regression. Import times are a few
+## milliseconds per module, so the absolute slack absorbs the disk cache and scheduling noise.
+TIME_TOLERANCE = 1.5
+TIME_SLACK_MS = 15
+
+def actions(python_dir):
+    return sorted(name for name in os.listdir(python_dir)
+                  if os.path.isfile(os.path.join(python_dir, name, 'source.py')))
+
+def parse_importtime(stderr):
+    """ Returns (module, depth, self_us, cumulative_us) for every line of the -X importtime output.
+        Lines are listed in the order the imports complete, so a module follows all its imports.
+    """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        module = name.strip()
+        imports.append((module, (len(name) - len(name.lstrip()) - 1) // 2, int(self_us), int(cumulative_us)))
+    return imports
+
+def subtree(imports, module):
+    """ Returns the imports done by the top level import of module, module last,
+        or nothing if module was already imported by an earlier import
+    """
+    end = next((i for i, entry in enumerate(imports) if entry[0] == module and entry[1] == 0), None)
+    if end is None:
+        return []
+    start = end
+    while start > 0 and imports[start - 1][1] > 0:
+        start -= 1
+    return imports[start:end + 1]
+
+def measure_once(python_dir, action):
+    """ Imports the action and then its deferred modules in a fresh interpreter """
+    from vra_ipam_utils.lazy import HEAVY_MODULES
+
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([os.path.join(python_dir, action), os.path.join(python_dir, 'commons')]))
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    statements = ["import source"] + [f"import {module}" for module in HEAVY_MODULES]
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", "; ".join(statements)],
+                               cwd=os.path.join(python_dir, action), env=env, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"Importing {action} failed:\n{completed.stderr}")
+
+    imports = parse_importtime(completed.stderr)
+    source = subtree(imports, "source")
+    deferred = [entry for module in HEAVY_MODULES for entry in subtree(imports, module)]
+    packages = {}
+    for module, _, self_us, _ in source + deferred:
+        package = module.split('.')[0]
+        packages[package] = packages.get(package, 0) + self_us
+    return {
+        "source_ms": source[-1][3] / 1000,
+        "deferred_ms": sum(entry[3] for entry in deferred if entry[1] == 0) / 1000,
+        "modules": len(source) + len(deferred),
+        "eager_heavy": sorted({module.split('.')[0] for module, _, _, _ in source} & set(HEAVY_PACKAGES)),
+        "packages": packages
+    }
+
+def measure(python_dir, action, runs):
+    """ Keeps the best of runs measurements, the others being slowed down by unrelated activity """
+    # the first run compiles the bytecode, which an ABX container finds already cached
+    measure_once(python_dir, action)
+    samples = [measure_once(python_dir, action) for _ in range(runs)]
+    best = min(samples, key=lambda sample: sample["source_ms"] + sample["deferred_ms"])
+    best["source_ms"] = round(min(sample["source_ms"] for sample in samples), 1)
+    best["deferred_ms"] = round(min(sample["deferred_ms"] for sample in samples), 1)
+    return best
+
+def regressions(action, measured, baseline):
+    found = [f"{action}: {', '.join(measured['eager_heavy'])} imported by source.py"] if measured["eager_heavy"] else []
+    for metric in ("source_ms", "deferred_ms"):
+        if metric in baseline and measured[metric] > baseline[metric] * TIME_TOLERANCE + TIME_SLACK_MS:
+            found.append(f"{action} {metric}: {measured[metric]} > {baseline[metric]}")
+    return found
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--python-dir", default=SOURCE_DIR, help="directory holding commons and the action directories")
+    parser.add_argument("--runs", type=int, default=5, help="interpreters started per action, the best run being kept")
+    parser.add_argument("--top", type=int, default=5, help="packages listed per action, 0 for none")
+    parser.add_argument("--only", action="append", help="only measure the named action, may be repeated")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--update-baseline", action="store_true", help="record the measurements as the new baseline")
+    parser.add_argument("--report", help="also write the measurements to this JSON file")
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.update_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["actions"]
+
+    print(f"{'action':<22} {'source ms':>10} {'deferred ms':>12} {'modules':>8}")
+    measurements = {}
+    failures = []
+    for action in actions(args.python_dir):
+        if args.only and action not in args.only:
+            continue
+        measured = measure(args.python_dir, action, args.runs)
+        found = regressions(action, measured, baseline.get(action, {}))
+        failures.extend(found)
+        print(f"{action:<22} {measured['source_ms']:>10.1f} {measured['deferred_ms']:>12.1f} {measured['modules']:>8}{'  REGRESSION' if found else ''}")
+        heaviest = sorted(measured["packages"].items(), key=lambda item: item[1], reverse=True)[:args.top]
+        for package, us in heaviest:
+            print(f"    {us / 1000:>7.1f} {package}")
+        measurements[action] = {"source_ms": measured["source_ms"], "deferred_ms": measured["deferred_ms"]}
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump({"python": sys.version.split()[0], "actions": measurements}, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({"python": sys.version.split()[0], "actions": measurements}, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline written to {args.baseline}")
+
+    for failure in failures:
+        print(f"Regression in {failure}")
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,60 @@
+"""
+Compares the ip range geometry helper with the ipaddress based computation
+get_ip_ranges used previously, on synthetic phpIPAM subnets.
+
+Usage (from the repository root):
+    python src/test/python/benchmarks/range_geometry_benchmark.py [subnet_count]
+"""
+
+import ipaddress
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..', 'main', 'python', 'commons'))
+from vra_ipam_utils.geometry import range_geometry
+
+def synthetic_subnets(count, seed=42):
+    rng = random.Random(seed)
+    subnets = []
+    for i in range(count):
+        if i % 4 == 3:
+            mask = rng.choice([48, 56, 64, 64, 64, 126])
+            network = ipaddress.ip_network((0x20010db8 << 96 | rng.getrandbits(64) << 64, mask), strict=False)
+        else:
+            mask = rng.choice([16, 20, 22, 24, 24, 24, 26, 28, 30])
+            network = ipaddress.ip_network((0x0A000000 | rng.getrandbits(24), mask), strict=False)
+        subnets.append({'subnet': str(network.network_address), 'mask': str(mask)})
+    return subnets
+
+def with_ipaddress(subnet):
+    network = ipaddress.ip_network(str(subnet['subnet']) + '/' + str(subnet['mask']))
+    return 'IPv' + str(network.version), str(network[1]), str(network[-2])
+
+def with_geometry(subnet):
+    geometry = range_geometry(subnet['subnet'], subnet['mask'])
+    return f"IPv{geometry.version}", geometry.first, geometry.last
+
+def bench(name, func, subnets, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for subnet in subnets:
+            func(subnet)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"{name:<10} {best:8.3f}s  {best / len(subnets) * 1e6:6.2f}us/subnet")
+    return best
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    subnets = synthetic_subnets(count)
+    # both implementations agree on every prefix handled identically (IPv4 up to /30)
+    for subnet in subnets:
+        if ':' not in subnet['subnet']:
+            assert with_ipaddress(subnet) == with_geometry(subnet), subnet
+    print(f"{count} synthetic subnets")
+    baseline = bench('ipaddress', with_ipaddress, subnets)
+    geometry = bench('geometry', with_geometry, subnets)
+    print(f"speedup    {baseline / geometry:8.2f}x")
@@ -0,0 +1,439 @@
+"""
+Offline stand-in for the phpIPAM REST API, used to exercise the ABX actions without a live IPAM server.
+
+Only the subset of the phpIPAM 1.5 API used by this integration is implemented. The inventory is
+synthetic: subnets are generated up front, but the addresses of a subnet are only materialized
+the first time it is looked at, so that a large inventory (10k subnets / 1M addresses) stays
+cheap to build and serve.
+
+Usage (from the repository root):
+    python src/test/python/simulator/phpipam_sim.py [--subnets N] [--addresses N] [--latency S] [--port P]
+
+The actions reach it by setting the endpoint hostName to the printed http:// url and apiAppId to "vra".
+"""
+
+import argparse
+import base64
+import ipaddress
+import json
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+## Path segments which are ids or addresses are collapsed in the request counters,
+## so that "GET /subnets/12/addresses/" and "GET /subnets/13/addresses/" add up.
+_ID_SEGMENT = re.compile(r"^[0-9a-f.:]+$")
+
+class Inventory(object):
+    """ Synthetic phpIPAM inventory.
+
+        block_count /16 master subnets (172.16.0.0/16, 172.17.0.0/16, ...) come first, followed by
+        subnet_count /24 subnets (10.0.0.0/24, 10.0.1.0/24, ...) flagged with custom_vRA_Range=1.
+        Each /24 holds addresses_per_subnet addresses once materialized, the first one being its gateway.
+    """
+
+    def __init__(self, subnet_count=100, addresses_per_subnet=10, block_count=1):
+        self.lock = threading.RLock()
+        self.sections = {"1": {"id": "1", "name": "vRA", "description": "vRA managed networks"}}
+        self.nameservers = {"1": {"id": "1", "name": "lab", "namesrv1": "10.0.0.53;10.0.0.54", "permissions": "1"}}
+        self.subnets = {}
+        self.networks = {}
+        self.addresses = {}
+        self.address_ids = {}
+        self.addresses_per_subnet = addresses_per_subnet
+        self.next_subnet_id = 1
+        self.next_address_id = 1
+        for b in range(block_count):
+            self.add_subnet(f"172.{16 + b}.0.0", 16, description=f"block {b}", custom_vRA_Range=None)
+        for i in range(subnet_count):
+            network = ipaddress.ip_network((0x0A000000 + (i << 8), 24))
+            self.add_subnet(str(network.network_address), 24, description=f"subnet {i}",
+                            vlanId=str(100 + i % 50), nameserverId="1" if i % 2 else "0")
+
+    @property
+    def address_count(self):
+        """ Number of addresses the inventory holds, whether materialized or not """
+        return sum(len(self.addresses[subnet_id]) if subnet_id in self.addresses else self._generated_count(subnet_id)
+                   for subnet_id in self.subnets)
+
+    def add_subnet(self, subnet, mask, **fields):
+        subnet_id = str(self.next_subnet_id)
+        self.next_subnet_id += 1
+        record = {
+            "id": subnet_id,
+            "subnet": subnet,
+            "mask": str(mask),
+            "sectionId": "1",
+            "description": "",
+            "masterSubnetId": "0",
+            "nameserverId": "0",
+            "vlanId": "0",
+            "isFolder": "0",
+            "isPool": "0",
+            "editDate": None,
+            "lastScan": None,
+            "custom_vRA_Range": "1",
+        }
+        record.update(fields)
+        self.subnets[subnet_id] = record
+        self.networks[subnet_id] = ipaddress.ip_network(f"{subnet}/{mask}")
+        return record
+
+    def remove_subnet(self, subnet_id):
+        del self.subnets[subnet_id]
+        del self.networks[subnet_id]
+        for record in self.addresses.pop(subnet_id, {}).values():
+            self.address_ids.pop(record["id"], None)
+
+    def subnet_record(self, subnet_id):
+        record = dict(self.subnets[subnet_id])
+        ns = self.nameservers.get(record["nameserverId"])
+        if ns is not None:
+            record["nameservers"] = ns
+        return record
+
+    def _generated_count(self, subnet_id):
+        """ Number of addresses generated for a subnet which hasn't been materialized yet """
+        subnet = self.subnets[subnet_id]
+        if subnet["masterSubnetId"] != "0" or int(subnet["mask"]) < 24:
+            return 0
+        return min(self.addresses_per_subnet, max(self.networks[subnet_id].num_addresses - 2, 0))
+
+    def subnet_addresses(self, subnet_id):
+        """ Returns the addresses of a subnet keyed by ip, materializing them on first access """
+        if subnet_id not in self.addresses:
+            network = self.networks[subnet_id]
+            self.addresses[subnet_id] = {}
+            for offset in range(1, self._generated_count(subnet_id) + 1):
+                self.add_address(subnet_id, str(network.network_address + offset),
+                                 is_gateway="1" if offset == 1 else "0", hostname=f"host{offset}")
+        return self.addresses[subnet_id]
+
+    def add_address(self, subnet_id, ip, **fields):
+        address_id = str(self.next_address_id)
+        self.next_address_id += 1
+        record = {"id": address_id, "subnetId": subnet_id, "ip": ip, "is_gateway": "0",
+                  "hostname": "", "description": "", "mac": "", "editDate": None}
+        record.update(fields)
+        self.addresses.setdefault(subnet_id, {})[ip] = record
+        self.address_ids[address_id] = record
+        return record
+
+    def remove_address(self, record):
+        del self.addresses[record["subnetId"]][record["ip"]]
+        del self.address_ids[record["id"]]
+
+    def truncate(self, subnet_id):
+        for record in list(self.subnet_addresses(subnet_id).values()):
+            self.remove_address(record)
+
+    def gateways(self):
+        """ Gateways are the first address of a generated subnet, so they are listed without materializing it """
+        for subnet_id in self.subnets:
+            if subnet_id in self.addresses:
+                for record in self.addresses[subnet_id].values():
+                    if record["is_gateway"] == "1":
+                        yield record
+            elif self._generated_count(subnet_id):
+                yield {"id": f"gw{subnet_id}", "subnetId": subnet_id, "ip": str(self.networks[subnet_id].network_address + 1), "is_gateway": "1"}
+
+    def search(self, ip):
+        """ Returns the records of ip in every subnet, only materializing the subnets containing it """
+        address = ipaddress.ip_address(ip)
+        return [self.subnet_addresses(subnet_id)[ip] for subnet_id, network in self.networks.items()
+                if address in network and ip in self.subnet_addresses(subnet_id)]
+
+def apply_filter(records, query):
+    """ Applies the filter_by / filter_value / filter_match query parameters of phpIPAM """
+    field = query.get("filter_by")
+    if field is None:
+        return list(records)
+    value = query.get("filter_value", "")
+    match = query.get("filter_match", "full")
+    if match == "regex":
+        pattern = re.compile(value)
+        return [r for r in records if r.get(field) is not None and pattern.search(str(r.get(field)))]
+    if match == "partial":
+        return [r for r in records if value in str(r.get(field))]
+    return [r for r in records if str(r.get(field)) == value]
+
+class Simulator(object):
+    """ Threaded HTTP server exposing an Inventory through the phpIPAM REST API.
+
+        Every request waits latency seconds before being served, to stand in for the round trip
+        to a remote server. requests counts the requests served per route.
+        bulk_addresses=False mimics older phpIPAM versions which can't list addresses in bulk.
+    """
+
+    def __init__(self, inventory=None, latency=0.0, app_id="vra", username="admin", password="VMware",
+                 bulk_addresses=True, host="127.0.0.1", port=0):
+        self.inventory = inventory or Inventory()
+        self.latency = latency
+        self.app_id = app_id
+        self.credentials = (username, password)
+        self.bulk_addresses = bulk_addresses
+        self.tokens = set()
+        self.requests = Counter()
+        self.logins = 0
+        self.counter_lock = threading.Lock()
+        simulator = self
+
+        class Handler(_Handler):
+            sim = simulator
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def host_name(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def request_count(self):
+        return sum(self.requests.values())
+
+    def reset_counters(self):
+        with self.counter_lock:
+            self.requests.clear()
+            self.logins = 0
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+class _Handler(BaseHTTPRequestHandler):
+    sim = None
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, code, body):
+        payload = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _ok(self, data=None, code=200, **extra):
+        body = {"code": code, "success": True}
+        if data is not None:
+            body["data"] = data
+        body.update(extra)
+        body["time"] = 0.001
+        self._send(code, body)
+
+    def _error(self, code, message):
+        self._send(code, {"code": code, "success": False, "message": message, "time": 0.001})
+
+    def _body(self):
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            return json.loads(self.raw_body or "{}")
+        return {k: v[0] for k, v in parse_qs(self.raw_body).items()}
+
+    def _dispatch(self, method):
+        sim = self.sim
+        length = int(self.headers.get("Content-Length") or 0)
+        self.raw_body = self.rfile.read(length).decode() if length else ""
+        if sim.latency:
+            time.sleep(sim.latency)
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        parts = [p for p in url.path.split("/") if p]
+        if len(parts) < 2 or parts[0] != "api" or parts[1] != sim.app_id:
+            return self._error(400, "Invalid application id")
+        parts = parts[2:]
+        route = "/".join("{}" if _ID_SEGMENT.match(p) and p != "addresses" else p for p in parts)
+        with sim.counter_lock:
+            sim.requests[f"{method} /{route}/"] += 1
+
+        if parts == ["user"] and method == "POST":
+            return self._login()
+        if self.headers.get("token") not in sim.tokens:
+            return self._error(401, "Please provide token")
+
+        handler = getattr(self, f"_{method.lower()}_{parts[0]}", None) if parts else None
+        if handler is None:
+            return self._error(400, "Invalid request")
+        with sim.inventory.lock:
+            return handler(parts[1:], query)
+
+    def _login(self):
+        auth = self.headers.get("Authorization", "")
+        try:
+            username, password = base64.b64decode(auth.split(" ", 1)[1]).decode().split(":", 1)
+        except Exception:
+            return self._error(500, "Please provide username and password")
+        if (username, password) != self.sim.credentials:
+            return self._error(500, "Invalid username or password")
+        token = uuid.uuid4().hex
+        with self.sim.counter_lock:
+            self.sim.logins += 1
+            self.sim.tokens.add(token)
+        return self._ok({"token": token, "expires": "2099-01-01 00:00:00"})
+
+    ## subnets
+    def _get_subnets(self, parts, query):
+        inv = self.sim.inventory
+        if not parts:
+            records = apply_filter((inv.subnet_record(i) for i in inv.subnets), query)
+            return self._ok(records) if records else self._error(404, "No subnets found")
+        subnet_id = parts[0]
+        if subnet_id not in inv.subnets:
+            return self._error(404, "No subnets found")
+        if len(parts) == 1:
+            return self._ok(inv.subnet_record(subnet_id))
+        if parts[1] == "addresses":
+            records = apply_filter(inv.subnet_addresses(subnet_id).values(), query)
+            return self._ok(records) if records else self._error(404, "No addresses found")
+        if parts[1] == "slaves":
+            records = [inv.subnet_record(i) for i, s in inv.subnets.items() if s["masterSubnetId"] == subnet_id]
+            return self._ok(records) if records else self._error(404, "No slaves")
+        return self._error(400, "Invalid request")
+
+    def _post_subnets(self, parts, query):
+        inv = self.sim.inventory
+        body = self._body()
+        network = ipaddress.ip_network(f"{body['subnet']}/{body['mask']}")
+        for subnet_id, subnet in inv.subnets.items():
+            if subnet["sectionId"] == str(body.get("sectionId")) and subnet["masterSubnetId"] == str(body.get("masterSubnetId", "0")):
+                if inv.networks[subnet_id].overlaps(network):
+                    return self._error(409, f"Subnet overlaps with {subnet['subnet']}/{subnet['mask']}")
+        fields = {k: str(v) for k, v in body.items() if k not in ("subnet", "mask")}
+        record = inv.add_subnet(str(network.network_address), network.prefixlen, **fields)
+        inv.addresses[record["id"]] = {}
+        return self._ok(code=201, message="Subnet created", id=record["id"])
+
+    def _delete_subnets(self, parts, query):
+        inv = self.sim.inventory
+        subnet_id = parts[0] if parts else None
+        if subnet_id not in inv.subnets:
+            return self._error(404, "Invalid subnet Id")
+        if len(parts) > 1 and parts[1] == "truncate":
+            inv.truncate(subnet_id)
+            return self._ok(message="Subnet truncated")
+        inv.remove_subnet(subnet_id)
+        return self._ok(message="Subnet deleted")
+
+    ## addresses
+    def _get_addresses(self, parts, query):
+        inv = self.sim.inventory
+        if not parts:
+            # only the gateway lookup of get_ip_ranges lists addresses in bulk
+            if not self.sim.bulk_addresses or query.get("filter_by") != "is_gateway":
+                return self._error(400, "Address id required")
+            records = apply_filter(inv.gateways(), query)
+            return self._ok(records) if records else self._error(404, "No addresses found")
+        if parts[0] == "search" and len(parts) == 2:
+            records = inv.search(parts[1])
+            return self._ok(records) if records else self._error(404, "Address not found")
+        record = inv.address_ids.get(parts[0])
+        return self._ok(record) if record else self._error(404, "Address not found")
+
+    def _post_addresses(self, parts, query):
+        inv = self.sim.inventory
+        body = self._body()
+        if parts and parts[0] == "first_free":
+            subnet_id = parts[1] if len(parts) > 1 else None
+            if subnet_id not in inv.subnets:
+                return self._error(404, "Invalid subnet Id")
+            used = inv.subnet_addresses(subnet_id)
+            for host in inv.networks[subnet_id].hosts():
+                if str(host) not in used:
+                    record = inv.add_address(subnet_id, str(host), **{k: str(v) for k, v in body.items()})
+                    return self._ok(record["ip"], code=201, message="Address created", id=record["id"], subnetId=subnet_id)
+            return self._error(404, "No free addresses found")
+        subnet_id = str(body.pop("subnetId", ""))
+        if subnet_id not in inv.subnets:
+            return self._error(404, "Invalid subnet Id")
+        if body.get("ip") in inv.subnet_addresses(subnet_id):
+            return self._error(409, "IP address already exists")
+        record = inv.add_address(subnet_id, body.pop("ip"), **{k: str(v) for k, v in body.items()})
+        return self._ok(code=201, message="Address created", id=record["id"])
+
+    def _patch_addresses(self, parts, query):
+        record = self.sim.inventory.address_ids.get(parts[0]) if parts else None
+        if record is None:
+            return self._error(404, "Address not found")
+        record.update({k: str(v) for k, v in self._body().items()})
+        return self._ok(message="Address updated")
+
+    def _delete_addresses(self, parts, query):
+        inv = self.sim.inventory
+        if len(parts) == 2:
+            ip, subnet_id = parts
+            record = inv.subnet_addresses(subnet_id).get(ip) if subnet_id in inv.subnets else None
+        else:
+            record = inv.address_ids.get(parts[0]) if parts else None
+        if record is None:
+            return self._error(404, "Address does not exist")
+        inv.remove_address(record)
+        return self._ok(message="Address deleted")
+
+    ## sections and tools
+    def _get_sections(self, parts, query):
+        inv = self.sim.inventory
+        if not parts:
+            return self._ok(list(inv.sections.values()))
+        if len(parts) == 2 and parts[1] == "subnets":
+            records = apply_filter((inv.subnet_record(i) for i, s in inv.subnets.items() if s["sectionId"] == parts[0]), query)
+            return self._ok(records) if records else self._error(404, "No subnets found")
+        return self._ok(inv.sections[parts[0]]) if parts[0] in inv.sections else self._error(404, "Section not found")
+
+    def _get_tools(self, parts, query):
+        inv = self.sim.inventory
+        if parts and parts[0] == "nameservers":
+            if len(parts) == 1:
+                return self._ok(list(inv.nameservers.values()))
+            ns = inv.nameservers.get(parts[1])
+            return self._ok(ns) if ns else self._error(404, "Nameserver not found")
+        return self._error(400, "Invalid request")
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_PATCH(self):
+        self._dispatch("PATCH")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serves a synthetic phpIPAM inventory until interrupted")
+    parser.add_argument("--subnets", type=int, default=10000)
+    parser.add_argument("--addresses", type=int, default=100, help="addresses per subnet")
+    parser.add_argument("--blocks", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args()
+
+    inventory = Inventory(args.subnets, args.addresses, args.blocks)
+    with Simulator(inventory, latency=args.latency, port=args.port) as sim:
+        print(f"Serving {len(inventory.subnets)} subnets and {inventory.address_count} addresses at {sim.host_name}/api/{sim.app_id}/ (admin / VMware)")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
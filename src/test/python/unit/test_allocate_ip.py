@@ -0,0 +1,203 @@
+"""
+Checks the search of contiguous free addresses by allocate_ip, and the rollback of a block whose
+reservation fails partway, against a fake phpIPAM client.
+
+Usage (from the repository root):
+    python -m pytest src/test/python/unit
+"""
+
+import importlib.util
+import ipaddress
+import json
+import os
+import sys
+import threading
+import unittest
+
+SOURCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'main', 'python')
+
+sys.path.insert(0, os.path.join(SOURCE_DIR, 'commons'))
+
+from vra_ipam_utils.exceptions import AuthenticationException
+from vra_ipam_utils.geometry import address_to_int, usable_bounds
+
+def load_action(name):
+    """ Imports the source.py of an action under a name of its own, every action having one """
+    spec = importlib.util.spec_from_file_location(f"{name}_source", os.path.join(SOURCE_DIR, name, 'source.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+action = load_action('allocate_ip')
+
+def bounds(cidr):
+    network = ipaddress.ip_network(cidr)
+    return usable_bounds(network.version, int(network.network_address), network.prefixlen)
+
+class FindFreeRunTest(unittest.TestCase):
+
+    def test_empty_range(self):
+        self.assertEqual(action.find_free_run(10, 20, [], 11), 10)
+        self.assertIsNone(action.find_free_run(10, 20, [], 12))
+
+    def test_used_addresses_outside_the_range_are_ignored(self):
+        self.assertEqual(action.find_free_run(10, 20, [1, 5, 9, 21, 30], 11), 10)
+
+    def test_gap_exactly_size_wide(self):
+        # 12 to 14 are free, 15 is used
+        self.assertEqual(action.find_free_run(10, 20, [10, 11, 15], 3), 12)
+        self.assertEqual(action.find_free_run(10, 20, [10, 11, 15], 4), 16)
+
+    def test_run_ending_on_the_last_address(self):
+        self.assertEqual(action.find_free_run(10, 20, [12], 8), 13)
+        self.assertIsNone(action.find_free_run(10, 20, [12], 9))
+
+    def test_unsorted_and_duplicate_used_addresses(self):
+        self.assertEqual(action.find_free_run(10, 20, [13, 11, 10, 11, 12], 5), 14)
+
+    def test_full_range(self):
+        self.assertIsNone(action.find_free_run(10, 20, list(range(10, 21)), 1))
+        self.assertIsNone(action.find_free_run(10, 20, list(range(0, 30)), 1))
+
+    def test_point_to_point_and_host_prefixes(self):
+        first, last = bounds('10.0.0.0/31')
+        self.assertEqual(action.find_free_run(first, last, [], 2), address_to_int('10.0.0.0')[1])
+        self.assertEqual(action.find_free_run(first, last, [first], 1), address_to_int('10.0.0.1')[1])
+        first, last = bounds('10.0.0.7/32')
+        self.assertEqual(action.find_free_run(first, last, [], 1), address_to_int('10.0.0.7')[1])
+        self.assertIsNone(action.find_free_run(first, last, [], 2))
+
+    def test_ipv6_bounds(self):
+        # the Subnet-Router anycast address is left out, the last address is usable
+        first, last = bounds('2001:db8::/126')
+        self.assertEqual((first, last), (address_to_int('2001:db8::1')[1], address_to_int('2001:db8::3')[1]))
+        self.assertEqual(action.find_free_run(first, last, [], 3), first)
+        self.assertEqual(action.find_free_run(first, last, [first], 2), first + 1)
+        self.assertIsNone(action.find_free_run(first, last, [last], 3))
+
+class FakeResponse(object):
+
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+        self.encoding = 'utf-8'
+
+    def json(self):
+        return self.body
+
+    def iter_content(self, chunk_size):
+        content = json.dumps(self.body).encode()
+        for i in range(0, len(content), chunk_size):
+            yield content[i:i + chunk_size]
+
+    def close(self):
+        pass
+
+class FakeClient(object):
+    """ A single phpIPAM range. Reserving an address of fail_reserve fails with the exception given,
+        and releasing an address of fail_release raises.
+    """
+
+    def __init__(self, range_id, cidr, used=(), fail_reserve=None, fail_release=(), with_ids=True):
+        network = ipaddress.ip_network(cidr)
+        self.range_id = range_id
+        self.subnet = {'id': range_id, 'subnet': str(network.network_address), 'mask': str(network.prefixlen)}
+        self.addresses = {ip: str(i) for i, ip in enumerate(used)}
+        self.fail_reserve = fail_reserve or {}
+        self.fail_release = set(fail_release)
+        self.with_ids = with_ids
+        self.released = []
+        self.lock = threading.Lock()
+
+    def get(self, *path, **kwargs):
+        if path == ('subnets', self.range_id):
+            return FakeResponse(200, {'success': True, 'data': self.subnet})
+        if path == ('subnets', self.range_id, 'addresses'):
+            if not self.addresses:
+                return FakeResponse(404, {'success': False, 'message': 'No addresses found'})
+            return FakeResponse(200, {'success': True, 'data': [{'ip': ip} for ip in self.addresses]})
+        return FakeResponse(404, {'success': False, 'message': 'Not found'})
+
+    def post(self, *path, data=None):
+        ip = data['ip']
+        error = self.fail_reserve.get(ip)
+        if isinstance(error, Exception):
+            raise error
+        with self.lock:
+            if error is not None or ip in self.addresses:
+                return FakeResponse(409, {'success': False, 'message': error or 'IP address already exists'})
+            address_id = str(1000 + len(self.addresses))
+            self.addresses[ip] = address_id
+        return FakeResponse(201, dict({'success': True}, **({'id': address_id} if self.with_ids else {})))
+
+    def release_address(self, ip, subnet_id):
+        if ip in self.fail_release:
+            raise Exception(f"Unable to release {ip}")
+        with self.lock:
+            self.released.append(ip)
+            return self.addresses.pop(ip, None) is not None
+
+class FakeAddressIds(object):
+
+    def __init__(self):
+        self.ids = {}
+        self.lock = threading.Lock()
+
+    def put(self, ip, address_id):
+        with self.lock:
+            self.ids[ip] = address_id
+
+    def discard(self, ip):
+        with self.lock:
+            self.ids[ip] = None
+
+PAYLOAD = {'hostname': 'vm-01', 'description': 'Reserved by vRA'}
+
+class AllocateBlockTest(unittest.TestCase):
+
+    def allocate(self, client, size, max_workers=4):
+        self.address_ids = FakeAddressIds()
+        return action.allocate_block(client.range_id, size, PAYLOAD, client, self.address_ids, max_workers)
+
+    def test_block_after_used_addresses(self):
+        client = FakeClient('7', '10.0.0.0/28', used=['10.0.0.1', '10.0.0.2', '10.0.0.5'])
+        self.assertEqual(self.allocate(client, 4), ['10.0.0.6', '10.0.0.7', '10.0.0.8', '10.0.0.9'])
+        self.assertEqual(sorted(ip for ip, address_id in self.address_ids.ids.items() if address_id), ['10.0.0.6', '10.0.0.7', '10.0.0.8', '10.0.0.9'])
+
+    def test_no_room_left(self):
+        client = FakeClient('7', '10.0.0.0/29', used=['10.0.0.4'])
+        with self.assertRaisesRegex(Exception, "No block of 4 contiguous free addresses"):
+            self.allocate(client, 4)
+
+    def test_address_ids_are_only_cached_when_returned(self):
+        client = FakeClient('7', '10.0.0.0/29', with_ids=False)
+        self.assertEqual(self.allocate(client, 2), ['10.0.0.1', '10.0.0.2'])
+        self.assertEqual(self.address_ids.ids, {})
+
+    def test_partial_failure_is_rolled_back(self):
+        for max_workers in (1, 4):
+            with self.subTest(max_workers=max_workers):
+                client = FakeClient('7', '10.0.0.0/28', fail_reserve={'10.0.0.3': 'Address is in use'})
+                with self.assertRaisesRegex(Exception, r"^Unable to reserve 10\.0\.0\.3: Address is in use$"):
+                    self.allocate(client, 5, max_workers)
+                self.assertEqual(sorted(client.released), ['10.0.0.1', '10.0.0.2', '10.0.0.4', '10.0.0.5'])
+                self.assertEqual(client.addresses, {})
+                self.assertTrue(all(address_id is None for address_id in self.address_ids.ids.values()))
+
+    def test_failed_rollback_is_reported(self):
+        client = FakeClient('7', '10.0.0.0/28', fail_reserve={'10.0.0.3': 'Address is in use'}, fail_release=['10.0.0.4'])
+        with self.assertRaises(Exception) as raised:
+            self.allocate(client, 5)
+        self.assertEqual(str(raised.exception), "Unable to reserve 10.0.0.3: Address is in use (rollback failed to release 10.0.0.4 in range 7)")
+        self.assertEqual(str(raised.exception.__cause__), "Unable to reserve 10.0.0.3: Address is in use")
+        self.assertEqual(sorted(client.addresses), ['10.0.0.4'])
+        self.assertIsNone(self.address_ids.ids['10.0.0.4'])
+
+    def test_authentication_failure_survives_a_failed_rollback(self):
+        client = FakeClient('7', '10.0.0.0/28', fail_reserve={'10.0.0.2': AuthenticationException('Authentication Failure!')}, fail_release=['10.0.0.1'])
+        with self.assertRaises(AuthenticationException) as raised:
+            self.allocate(client, 3)
+        self.assertIn("rollback failed to release 10.0.0.1 in range 7", str(raised.exception))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,254 @@
+"""
+Checks how allocate_ip_range carves ranges out of an ip block: the search of a free aligned prefix,
+and the creation of the range against a fake phpIPAM client, including the retries when phpIPAM
+rejects an overlapping candidate and the cleanup when the range can't be completed.
+
+Usage (from the repository root):
+    python -m pytest src/test/python/unit
+"""
+
+import importlib.util
+import ipaddress
+import os
+import sys
+import unittest
+
+SOURCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'main', 'python')
+
+sys.path.insert(0, os.path.join(SOURCE_DIR, 'commons'))
+
+from vra_ipam_utils.geometry import find_free_prefix
+
+def load_action(name):
+    """ Imports the source.py of an action under a name of its own, every action having one """
+    spec = importlib.util.spec_from_file_location(f"{name}_source", os.path.join(SOURCE_DIR, name, 'source.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+action = load_action('allocate_ip_range')
+
+def bounds(cidr):
+    network = ipaddress.ip_network(cidr)
+    return int(network.network_address), int(network.broadcast_address)
+
+def subnet(subnet_id, cidr, **fields):
+    network = ipaddress.ip_network(cidr)
+    return dict({'id': subnet_id, 'subnet': str(network.network_address), 'mask': str(network.prefixlen), 'sectionId': '1'}, **fields)
+
+class FakeClient(object):
+
+    def __init__(self, section_subnets=()):
+        self.section_subnets = list(section_subnets)
+        self.streamed = []
+
+    def stream(self, *path):
+        self.streamed.append(path)
+        return iter(self.section_subnets)
+
+class GetSectionIntervalsTest(unittest.TestCase):
+
+    BLOCK = subnet('10', '10.0.0.0/16')
+
+    def test_block_and_its_parents_are_left_out(self):
+        client = FakeClient([
+            subnet('1', '10.0.0.0/8'),
+            self.BLOCK,
+            subnet('11', '10.0.4.0/24', masterSubnetId='10'),
+            subnet('12', '10.0.8.0/22', masterSubnetId='1'),
+            subnet('13', '10.1.0.0/24', masterSubnetId='1'),
+        ])
+        intervals = action.get_section_intervals(client, self.BLOCK, *bounds('10.0.0.0/16'))
+        self.assertEqual(sorted(intervals), [bounds('10.0.4.0/24'), bounds('10.0.8.0/22')])
+        self.assertEqual(client.streamed, [('sections', '1', 'subnets')])
+
+    def test_other_vrfs_and_folders_are_left_out(self):
+        client = FakeClient([
+            subnet('11', '10.0.4.0/24', vrfId='2'),
+            subnet('12', '10.0.8.0/24', vrfId='0'),
+            subnet('13', '10.0.9.0/24', vrfId=None),
+            {'id': '14', 'subnet': None, 'mask': None, 'isFolder': '1', 'sectionId': '1'},
+        ])
+        intervals = action.get_section_intervals(client, self.BLOCK, *bounds('10.0.0.0/16'))
+        self.assertEqual(sorted(intervals), [bounds('10.0.8.0/24'), bounds('10.0.9.0/24')])
+
+class FindFreePrefixTest(unittest.TestCase):
+
+    BLOCK = bounds('10.0.0.0/16')
+
+    def find(self, used, prefix_length, block=BLOCK):
+        start = find_free_prefix(block[0], block[1], [bounds(cidr) for cidr in used], 32 - prefix_length)
+        return None if start is None else f"{ipaddress.ip_address(start)}/{prefix_length}"
+
+    def test_empty_block(self):
+        self.assertEqual(self.find([], 24), '10.0.0.0/24')
+        self.assertEqual(self.find([], 16), '10.0.0.0/16')
+
+    def test_skips_used_prefixes(self):
+        self.assertEqual(self.find(['10.0.0.0/24', '10.0.1.0/24'], 24), '10.0.2.0/24')
+        self.assertEqual(self.find(['10.0.1.0/24'], 24), '10.0.0.0/24')
+
+    def test_candidates_stay_aligned(self):
+        # a /28 at the start pushes a /24 to the next /24 boundary, not to .16
+        self.assertEqual(self.find(['10.0.0.0/28'], 24), '10.0.1.0/24')
+        self.assertEqual(self.find(['10.0.0.0/28'], 28), '10.0.0.16/28')
+        self.assertEqual(self.find(['10.0.0.0/24', '10.0.2.0/23'], 23), '10.0.4.0/23')
+
+    def test_unaligned_used_intervals(self):
+        used = [(self.BLOCK[0] + 5, self.BLOCK[0] + 20)]
+        self.assertEqual(find_free_prefix(self.BLOCK[0], self.BLOCK[1], used, 4), self.BLOCK[0] + 32)
+        self.assertEqual(find_free_prefix(self.BLOCK[0], self.BLOCK[1], used, 2), self.BLOCK[0])
+
+    def test_nested_and_unsorted_children(self):
+        used = ['10.0.4.0/22', '10.0.0.0/22', '10.0.1.0/24', '10.0.5.128/25']
+        self.assertEqual(self.find(used, 22), '10.0.8.0/22')
+        self.assertEqual(self.find(used, 24), '10.0.8.0/24')
+
+    def test_full_block(self):
+        self.assertIsNone(self.find(['10.0.0.0/17', '10.0.128.0/17'], 24))
+        self.assertIsNone(self.find(['10.0.0.0/16'], 30))
+        self.assertIsNone(self.find(['10.0.0.0/24'], 16))
+
+    def test_last_prefix_of_the_block(self):
+        self.assertEqual(self.find(['10.0.0.0/17', '10.0.128.0/18', '10.0.192.0/19'], 19), '10.0.224.0/19')
+
+    def test_ipv6(self):
+        start, end = bounds('2001:db8::/48')
+        used = [bounds('2001:db8::/64'), bounds('2001:db8:0:1::/64')]
+        self.assertEqual(ipaddress.ip_address(find_free_prefix(start, end, used, 64)), ipaddress.ip_address('2001:db8:0:2::'))
+
+class FakeResponse(object):
+
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+
+    def json(self):
+        return self.body
+
+class FakeIpamClient(object):
+    """ An ip block 10.0.0.0/16 (id 10) in section 1. Creating a subnet over one of taken
+        creates it as if another deployment was first, and is rejected with a 409 like any
+        subnet overlapping one of the section. Reading back a created subnet fails if read_fails.
+    """
+
+    def __init__(self, subnets=(), taken=(), read_fails=False, create_status=409):
+        self.subnets = {record['id']: record for record in [subnet('10', '10.0.0.0/16')] + list(subnets)}
+        self.taken = list(taken)
+        self.read_fails = read_fails
+        self.create_status = create_status
+        self.created = []
+        self.deleted = []
+        self.addresses = []
+
+    def overlapping(self, network):
+        return [record for record in self.subnets.values()
+                if record['id'] != '10' and ipaddress.ip_network(f"{record['subnet']}/{record['mask']}").overlaps(network)]
+
+    def get(self, *path):
+        subnet_id = path[1]
+        if subnet_id not in self.subnets or (self.read_fails and subnet_id in self.created):
+            return FakeResponse(500, {'success': False, 'message': 'Internal error'})
+        return FakeResponse(200, {'success': True, 'data': dict(self.subnets[subnet_id], description='')})
+
+    def stream(self, *path):
+        if path[0] == 'sections':
+            return iter(list(self.subnets.values()))
+        return iter([record for record in self.subnets.values() if record.get('masterSubnetId') == path[1]])
+
+    def post(self, *path, data=None):
+        if path == ('addresses',):
+            self.addresses.append(data)
+            return FakeResponse(201, {'success': True, 'id': '100'})
+        network = ipaddress.ip_network(f"{data['subnet']}/{data['mask']}")
+        if str(network) in self.taken:
+            self.taken.remove(str(network))
+            new_id = str(len(self.subnets) + 100)
+            self.subnets[new_id] = subnet(new_id, str(network), masterSubnetId='10')
+        overlapping = self.overlapping(network)
+        if overlapping:
+            return FakeResponse(self.create_status, {'success': False, 'message': f"Subnet overlaps with {overlapping[0]['subnet']}/{overlapping[0]['mask']}"})
+        new_id = str(len(self.subnets) + 100)
+        self.subnets[new_id] = subnet(new_id, str(network), masterSubnetId=data['masterSubnetId'])
+        self.created.append(new_id)
+        return FakeResponse(201, {'success': True, 'id': int(new_id)})
+
+    def delete(self, *path):
+        self.deleted.append(path)
+        self.subnets.pop(path[1], None)
+        return FakeResponse(200, {'success': True})
+
+class AllocateInIpBlockTest(unittest.TestCase):
+
+    RESOURCE = {'name': 'net1'}
+
+    def allocate(self, client, prefix_length):
+        allocation = {'name': 'net1', 'ipBlockIds': ['10'], 'subnetCidr': f"10.0.0.0/{prefix_length}"}
+        return action.allocate_in_ip_block('10', self.RESOURCE, allocation, client)
+
+    def test_first_free_range(self):
+        client = FakeIpamClient([subnet('11', '10.0.0.0/24', masterSubnetId='10')])
+        result = self.allocate(client, 24)
+        self.assertEqual((result['name'], result['gatewayAddress']), ('10.0.1.0/24', '10.0.1.1'))
+        self.assertEqual([address['ip'] for address in client.addresses], ['10.0.1.1'])
+        self.assertEqual(client.deleted, [])
+
+    def test_retries_after_concurrent_allocations(self):
+        client = FakeIpamClient(taken=['10.0.0.0/24', '10.0.1.0/24'])
+        self.assertEqual(self.allocate(client, 24)['name'], '10.0.2.0/24')
+
+    def test_skips_overlapping_subnets_of_the_section(self):
+        # not a child of the block, so only phpIPAM's answer reveals it
+        client = FakeIpamClient([subnet('20', '10.0.0.0/22', masterSubnetId='0'), subnet('21', '10.0.4.0/23', masterSubnetId='0')])
+        self.assertEqual(self.allocate(client, 24)['name'], '10.0.6.0/24')
+        # one rejected candidate, then the section listing avoids every other overlap
+        self.assertEqual(len(client.created), 1)
+
+    def test_overlap_reported_without_409(self):
+        client = FakeIpamClient(taken=['10.0.0.0/24'], create_status=400)
+        self.assertEqual(self.allocate(client, 24)['name'], '10.0.1.0/24')
+
+    def test_gives_up_after_max_attempts(self):
+        taken = [f"10.0.{i}.0/24" for i in range(action.MAX_ATTEMPTS)]
+        client = FakeIpamClient(taken=taken)
+        with self.assertRaisesRegex(Exception, f"after {action.MAX_ATTEMPTS} attempts"):
+            self.allocate(client, 24)
+        self.assertEqual(client.created, [])
+
+    def test_other_errors_are_not_retried(self):
+        client = FakeIpamClient()
+        client.post = lambda *path, data=None: FakeResponse(500, {'success': False, 'message': 'Database error'})
+        with self.assertRaisesRegex(Exception, "Unable to create range 10.0.0.0/24: HTTP 500: Database error"):
+            self.allocate(client, 24)
+
+    def test_full_block(self):
+        client = FakeIpamClient([subnet('11', '10.0.0.0/17', masterSubnetId='10'), subnet('12', '10.0.128.0/17', masterSubnetId='10')])
+        with self.assertRaisesRegex(Exception, "No free /24 range left"):
+            self.allocate(client, 24)
+
+    def test_prefix_must_fit_in_block(self):
+        for prefix_length in (16, 8, 33):
+            with self.subTest(prefix_length=prefix_length):
+                with self.assertRaisesRegex(Exception, "can't hold"):
+                    self.allocate(FakeIpamClient(), prefix_length)
+
+    def test_range_is_deleted_when_it_cannot_be_read_back(self):
+        client = FakeIpamClient(read_fails=True)
+        with self.assertRaisesRegex(Exception, "Unable to read back range 10.0.0.0/24"):
+            self.allocate(client, 24)
+        self.assertEqual(client.deleted, [('subnets', client.created[0])])
+        self.assertNotIn(client.created[0], client.subnets)
+
+    def test_range_is_deleted_when_the_gateway_fails(self):
+        client = FakeIpamClient()
+        def post(*path, data=None, post=client.post):
+            if path == ('addresses',):
+                raise ConnectionError("Connection reset")
+            return post(*path, data=data)
+        client.post = post
+        with self.assertRaises(ConnectionError):
+            self.allocate(client, 24)
+        self.assertEqual(client.deleted, [('subnets', client.created[0])])
+
+if __name__ == '__main__':
+    unittest.main()
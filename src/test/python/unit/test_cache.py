@@ -0,0 +1,110 @@
+"""
+Checks that cached files are only trusted from a directory private to the current user, and that
+the endpoint certificate is rewritten when its cached copy doesn't hold it anymore.
+
+Usage (from the repository root):
+    python -m pytest src/test/python/unit
+"""
+
+import hashlib
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+SOURCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'main', 'python')
+
+sys.path.insert(0, os.path.join(SOURCE_DIR, 'commons'))
+
+from vra_ipam_utils import cache
+from vra_ipam_utils.ipam import IPAM
+
+CERTIFICATE = "-----BEGIN CERTIFICATE-----\nMIIB\n-----END CERTIFICATE-----\n"
+
+class CacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.cache_dir = os.path.join(temp_dir.name, 'vra_ipam_utils')
+        for name, value in (('CACHE_DIR', self.cache_dir), ('_private_dir', None)):
+            patcher = mock.patch.object(cache, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+class CachePathTest(CacheTestCase):
+
+    def test_creates_private_directory(self):
+        path = cache.cache_path('certs', 'a.pem')
+        self.assertEqual(path, os.path.join(self.cache_dir, 'certs', 'a.pem'))
+        self.assertEqual(os.stat(self.cache_dir).st_mode & 0o777, 0o700)
+
+    def test_directory_open_to_others_is_not_used(self):
+        os.makedirs(self.cache_dir)
+        os.chmod(self.cache_dir, 0o777)
+        with self.assertLogs(level='WARNING'):
+            path = cache.cache_path('tokens.json')
+        self.assertFalse(path.startswith(self.cache_dir))
+        self.assertEqual(os.stat(os.path.dirname(path)).st_mode & 0o777, 0o700)
+        # the fallback is kept for the following files
+        self.assertEqual(os.path.dirname(cache.cache_path('other.json')), os.path.dirname(path))
+        self.addCleanup(os.rmdir, os.path.dirname(path))
+
+    def test_symlink_is_not_followed(self):
+        target = self.cache_dir + '-target'
+        os.makedirs(target, mode=0o700)
+        os.symlink(target, self.cache_dir)
+        with self.assertLogs(level='WARNING'):
+            path = cache.cache_path('tokens.json')
+        self.assertFalse(path.startswith(self.cache_dir))
+        self.addCleanup(os.rmdir, os.path.dirname(path))
+
+    @unittest.skipUnless(hasattr(os, 'getuid') and os.getuid() == 0, "changing the owner requires root")
+    def test_directory_of_another_user_is_not_used(self):
+        os.makedirs(self.cache_dir, mode=0o700)
+        os.chown(self.cache_dir, 65534, -1)
+        with self.assertLogs(level='WARNING'):
+            path = cache.cache_path('tokens.json')
+        self.assertFalse(path.startswith(self.cache_dir))
+        self.addCleanup(os.rmdir, os.path.dirname(path))
+
+class GetCertTest(CacheTestCase):
+
+    def get_cert(self, certificate=CERTIFICATE):
+        ipam = mock.Mock(inputs={"endpointProperties": {"certificate": certificate}})
+        return IPAM._get_cert(ipam)
+
+    def read(self, path):
+        with open(path, newline='') as f:
+            return f.read()
+
+    def test_no_certificate(self):
+        ipam = mock.Mock(inputs={"endpointProperties": {}})
+        self.assertIs(IPAM._get_cert(ipam), True)
+
+    def test_written_once_under_its_hash(self):
+        cert = self.get_cert()
+        self.assertEqual(os.path.basename(cert), hashlib.sha256(CERTIFICATE.encode()).hexdigest() + '.pem')
+        self.assertEqual(self.read(cert), CERTIFICATE)
+        with mock.patch('vra_ipam_utils.ipam.write_private_file') as write:
+            self.assertEqual(self.get_cert(), cert)
+        write.assert_not_called()
+
+    def test_modified_copy_is_rewritten(self):
+        cert = self.get_cert()
+        with open(cert, 'w') as f:
+            f.write("-----BEGIN CERTIFICATE-----\nplanted\n-----END CERTIFICATE-----\n")
+        self.assertEqual(self.get_cert(), cert)
+        self.assertEqual(self.read(cert), CERTIFICATE)
+
+    def test_line_endings_are_kept(self):
+        certificate = CERTIFICATE.replace('\n', '\r\n')
+        cert = self.get_cert(certificate)
+        self.assertEqual(self.read(cert), certificate)
+        with mock.patch('vra_ipam_utils.ipam.write_private_file') as write:
+            self.get_cert(certificate)
+        write.assert_not_called()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+"""
+Checks the parsing of subnet filters and their split between phpIPAM and local evaluation.
+
+Usage (from the repository root):
+    python -m pytest src/test/python/unit
+"""
+
+import os
+import sys
+import unittest
+
+SOURCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'main', 'python')
+
+sys.path.insert(0, os.path.join(SOURCE_DIR, 'commons'))
+
+from vra_ipam_utils.exceptions import InvalidFilterException
+from vra_ipam_utils.filters import Condition, SubnetFilter, get_filter, parse_conditions
+
+class ParseConditionsTest(unittest.TestCase):
+
+    def test_operators_and_separators(self):
+        conditions = parse_conditions("sectionId=3; vlanId=100, 101\nsectionId!=4;custom_Env~^prod")
+        self.assertEqual([(c.field, c.operator) for c in conditions],
+                         [('sectionId', '='), ('vlanId', '='), ('sectionId', '!='), ('custom_Env', '~')])
+        self.assertEqual(conditions[1].values, ['100', '101'])
+        self.assertEqual(conditions[3].values[0].pattern, '^prod')
+
+    def test_value_containing_operator_characters(self):
+        conditions = parse_conditions("description=a=b!=c~d")
+        self.assertEqual(conditions, [Condition('description', '=', ['a=b!=c~d'])])
+
+    def test_regex_containing_operator_characters(self):
+        condition = parse_conditions("custom_Env~^a=b")[0]
+        self.assertEqual(condition.operator, '~')
+        self.assertEqual(condition.values[0].pattern, '^a=b')
+
+    def test_empty_clauses_are_ignored(self):
+        self.assertEqual(parse_conditions(" ;\n; "), [])
+        self.assertEqual(parse_conditions(None), [])
+
+    def test_missing_field_or_operator(self):
+        for text in ("=3", "sectionId", "  ~x"):
+            with self.subTest(text=text):
+                with self.assertRaises(InvalidFilterException):
+                    parse_conditions(text)
+
+    def test_invalid_regex(self):
+        with self.assertRaises(InvalidFilterException):
+            parse_conditions("custom_Env~^(prod")
+
+class GetFilterTest(unittest.TestCase):
+
+    def test_disabled(self):
+        self.assertIsNone(get_filter({"enableFilter": "false", "filterConditions": "sectionId=3"}))
+
+    def test_legacy_single_condition(self):
+        subnet_filter = get_filter({"enableFilter": "true", "filterField": "custom_vRA_Range", "filterValue": 1})
+        self.assertEqual(subnet_filter.conditions, [Condition('custom_vRA_Range', '=', ['1'])])
+        self.assertFalse(subnet_filter.match_any)
+
+    def test_match_any(self):
+        subnet_filter = get_filter({"enableFilter": "true", "filterConditions": "a=1;b=2", "filterMatch": "Any"})
+        self.assertTrue(subnet_filter.match_any)
+
+class PlanTest(unittest.TestCase):
+
+    def plan(self, text, match_any=False):
+        return SubnetFilter(parse_conditions(text), match_any).plan()
+
+    def test_no_conditions(self):
+        self.assertEqual(self.plan(""), (('subnets',), {}, []))
+
+    def test_all_pushes_section_and_single_value_equality(self):
+        path, params, residual = self.plan("custom_Env~^prod; sectionId=3; vlanId=100; custom_vRA_Range=1")
+        self.assertEqual(path, ('sections', '3', 'subnets'))
+        self.assertEqual(params, {'filter_by': 'vlanId', 'filter_value': '100'})
+        self.assertEqual([c.field for c in residual], ['custom_Env', 'custom_vRA_Range'])
+
+    def test_all_keeps_value_lists_and_regexes_local(self):
+        path, params, residual = self.plan("vlanId=100,101; custom_Env~^prod/x; sectionId!=4")
+        self.assertEqual(path, ('subnets',))
+        self.assertEqual(params, {})
+        self.assertEqual(len(residual), 3)
+
+    def test_all_never_requests_regex_matching(self):
+        for text in ("vlanId=100,101", "custom_Env~^prod", "sectionId=1,2"):
+            with self.subTest(text=text):
+                self.assertNotIn('filter_match', self.plan(text)[1])
+
+    def test_section_list_stays_local(self):
+        path, params, residual = self.plan("sectionId=1,2")
+        self.assertEqual(path, ('subnets',))
+        self.assertEqual(residual, [Condition('sectionId', '=', ['1', '2'])])
+
+    def test_any_of_several_conditions_stays_local(self):
+        path, params, residual = self.plan("vlanId=100; vlanId=101", match_any=True)
+        self.assertEqual((path, params), (('subnets',), {}))
+        self.assertEqual(len(residual), 2)
+
+    def test_any_of_one_condition_is_pushed_down(self):
+        path, params, residual = self.plan("custom_vRA_Range=1", match_any=True)
+        self.assertEqual(params, {'filter_by': 'custom_vRA_Range', 'filter_value': '1'})
+        self.assertEqual(residual, [])
+
+class MatchesTest(unittest.TestCase):
+
+    SUBNET = {'id': '7', 'sectionId': '3', 'vlanId': '100', 'custom_Env': 'production', 'custom_vRA_Range': None}
+
+    def matches(self, text, match_any=False, subnet=None):
+        return SubnetFilter(parse_conditions(text), match_any).matches(subnet or self.SUBNET)
+
+    def test_equality(self):
+        self.assertTrue(self.matches("vlanId=101,100"))
+        self.assertFalse(self.matches("vlanId=101"))
+
+    def test_not_equal(self):
+        self.assertTrue(self.matches("sectionId!=4,5"))
+        self.assertFalse(self.matches("sectionId!=4,3"))
+
+    def test_regex(self):
+        self.assertTrue(self.matches("custom_Env~^prod"))
+        self.assertFalse(self.matches("custom_Env~^dev"))
+
+    def test_missing_and_null_fields_are_empty(self):
+        self.assertFalse(self.matches("custom_Missing=1"))
+        self.assertTrue(self.matches("custom_Missing!=1"))
+        self.assertTrue(self.matches("custom_vRA_Range!=1"))
+        self.assertTrue(self.matches("custom_vRA_Range="))
+        self.assertTrue(self.matches("custom_Missing~^$"))
+
+    def test_all_and_any(self):
+        self.assertFalse(self.matches("vlanId=100; sectionId=4"))
+        self.assertTrue(self.matches("vlanId=100; sectionId=4", match_any=True))
+        self.assertFalse(self.matches("vlanId=1; sectionId=4", match_any=True))
+
+    def test_no_conditions_match_everything(self):
+        self.assertTrue(SubnetFilter([]).matches({}))
+
+if __name__ == '__main__':
+    unittest.main()
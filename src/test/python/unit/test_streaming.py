@@ -0,0 +1,85 @@
+"""
+Checks the incremental JSON decoding of vra_ipam_utils.streaming against json.loads.
+
+Every document is fed whole, byte by byte, and split in two at every offset, so that numbers,
+literals, escapes and multi-byte characters are cut at every possible point by a chunk boundary.
+
+Usage (from the repository root):
+    python -m pytest src/test/python/unit
+"""
+
+import json
+import os
+import sys
+import unittest
+
+SOURCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'main', 'python')
+
+sys.path.insert(0, os.path.join(SOURCE_DIR, 'commons'))
+
+from vra_ipam_utils.streaming import iter_json_array
+
+DOCUMENTS = [
+    '{"code":200,"success":true,"data":[3.14,-2.5e-3,1E+6,0,-0.0,42,1e5]}',
+    '{"code": 200, "success": true, "data": [{"id": "7", "subnet": "10.0.0.0", "mask": "24", "usage": {"used": 12.5, "freehosts_percent": 87.25}}]}',
+    '{"data":[{"hostname":"caf\\u00e9-01","description":"r\\u00e9serv\\u00e9 \\"vRA\\"\\n","tag":null,"is_gateway":false}],"time":0.012}',
+    '{"data":["été", "☃ snow", "\U0001F600"]}',
+    '{"success":true,"time":0.5,"data":[[1,2.0,[3e1]],{},[],{"a":{"b":[true,false,null]}}]}',
+    ' \n{ "message" : "Ok" , "data" : [ 1 , 2 ] , "more" : { "x" : 1.5 } } \n',
+    '{"code":200,"success":true,"data":[]}',
+    '{"code":404,"success":false,"message":"No subnets found"}',
+    '{"code":200,"data":{"id":"1"}}',
+    '{"data":[-1],"data2":[2]}',
+    '{}',
+]
+
+def expected(document):
+    data = json.loads(document).get('data')
+    return data if isinstance(data, list) else []
+
+def decode(chunks):
+    return list(iter_json_array(chunks))
+
+class IterJsonArrayTest(unittest.TestCase):
+
+    def test_whole_document(self):
+        for document in DOCUMENTS:
+            with self.subTest(document=document):
+                self.assertEqual(decode([document.encode()]), expected(document))
+
+    def test_every_split_offset(self):
+        for document in DOCUMENTS:
+            content = document.encode()
+            for offset in range(1, len(content)):
+                with self.subTest(document=document, offset=offset):
+                    self.assertEqual(decode([content[:offset], content[offset:]]), expected(document))
+
+    def test_byte_by_byte(self):
+        for document in DOCUMENTS:
+            content = document.encode()
+            with self.subTest(document=document):
+                self.assertEqual(decode([content[i:i + 1] for i in range(len(content))]), expected(document))
+
+    def test_empty_chunks_are_skipped(self):
+        self.assertEqual(decode([b'', b'{"data":[1', b'', b'.5]}', b'']), [1.5])
+
+    def test_number_split_after_decimal_point(self):
+        self.assertEqual(decode([b'{"data":[3.', b'14]}']), [3.14])
+
+    def test_number_split_in_exponent(self):
+        self.assertEqual(decode([b'{"data":[1e', b'-', b'3]}']), [0.001])
+
+    def test_truncated_document_raises(self):
+        for document in ('{"data":[1,2', '{"data":[{"id":"1"', '{"data":[tru'):
+            with self.subTest(document=document):
+                with self.assertRaises(ValueError):
+                    decode([document.encode()])
+
+    def test_malformed_document_raises(self):
+        for document in ('[1,2]', '{"data":[1;2]}', '{"data" [1]}'):
+            with self.subTest(document=document):
+                with self.assertRaises(ValueError):
+                    decode([document.encode()])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+"""
+Checks the containment and overlap queries of vra_ipam_utils.subnet_index against a linear scan
+of the same subnets, for nested and disjoint IPv4 and IPv6 subnets.
+
+Usage (from the repository root):
+    python -m pytest src/test/python/unit
+"""
+
+import ipaddress
+import os
+import random
+import sys
+import unittest
+
+SOURCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'main', 'python')
+
+sys.path.insert(0, os.path.join(SOURCE_DIR, 'commons'))
+
+from vra_ipam_utils.subnet_index import SubnetIndex
+
+def random_subnets(rng, count):
+    """ Subnets of 10.0.0.0/16 and 2001:db8::/48 with random prefix lengths, so that many are nested """
+    subnets = []
+    for i in range(count):
+        if rng.random() < 0.5:
+            network = ipaddress.ip_network(f"10.0.{rng.randrange(256)}.{rng.randrange(256)}/{rng.randint(16, 30)}", strict=False)
+        else:
+            network = ipaddress.ip_network(f"2001:db8:0:{rng.randrange(65536):x}::{rng.randrange(65536):x}/{rng.randint(48, 124)}", strict=False)
+        subnets.append({'id': str(i), 'subnet': str(network.network_address), 'mask': str(network.prefixlen)})
+    return subnets
+
+def network_of(subnet):
+    return ipaddress.ip_network(f"{subnet['subnet']}/{subnet['mask']}")
+
+class SubnetIndexTest(unittest.TestCase):
+
+    SUBNETS = [
+        {'id': '1', 'subnet': '10.0.0.0', 'mask': '16'},
+        {'id': '2', 'subnet': '10.0.1.0', 'mask': '24'},
+        {'id': '3', 'subnet': '10.0.1.128', 'mask': '25'},
+        {'id': '4', 'subnet': '10.0.4.0', 'mask': '22'},
+        {'id': '5', 'subnet': '2001:db8::', 'mask': '64'},
+        {'id': '6', 'subnet': None, 'mask': None, 'isFolder': '1'},
+    ]
+
+    def setUp(self):
+        self.index = SubnetIndex(self.SUBNETS)
+
+    def test_folders_are_skipped(self):
+        self.assertEqual(len(self.index), 5)
+
+    def test_find_most_specific(self):
+        self.assertEqual(self.index.find('10.0.1.200'), '3')
+        self.assertEqual(self.index.find('10.0.1.5'), '2')
+        self.assertEqual(self.index.find('10.0.2.5'), '1')
+        self.assertEqual(self.index.find('10.0.7.255'), '4')
+        self.assertEqual(self.index.find('2001:db8::1'), '5')
+        self.assertIsNone(self.index.find('10.1.0.1'))
+        self.assertIsNone(self.index.find('2001:db9::1'))
+
+    def test_overlapping(self):
+        start, end = int(ipaddress.ip_address('10.0.1.0')), int(ipaddress.ip_address('10.0.3.255'))
+        self.assertEqual([entry[3] for entry in self.index.overlapping(4, start, end)], ['2', '1', '3'])
+        start = int(ipaddress.ip_address('10.1.0.0'))
+        self.assertEqual(self.index.overlapping(4, start, start + 255), [])
+
+    def test_empty(self):
+        index = SubnetIndex()
+        self.assertIsNone(index.find('10.0.0.1'))
+        self.assertEqual(index.overlapping(6, 0, 1 << 64), [])
+
+    def test_matches_linear_scan(self):
+        rng = random.Random(15)
+        subnets = random_subnets(rng, 300)
+        networks = {subnet['id']: network_of(subnet) for subnet in subnets}
+        index = SubnetIndex(subnets)
+        for _ in range(500):
+            probe = network_of(random_subnets(rng, 1)[0])
+            with self.subTest(probe=str(probe)):
+                expected = {i for i, network in networks.items() if network.overlaps(probe)}
+                found = index.overlapping(probe.version, int(probe.network_address), int(probe.broadcast_address))
+                self.assertEqual({entry[3] for entry in found}, expected)
+
+                address = probe.network_address
+                containing = [network for network in networks.values() if address in network]
+                most_specific = max(containing, key=lambda network: network.prefixlen, default=None)
+                found_id = index.find(str(address))
+                self.assertEqual(None if found_id is None else networks[found_id].prefixlen,
+                                 None if most_specific is None else most_specific.prefixlen)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+"""
+Checks the retry of requests whose phpIPAM token was rejected against the simulator, and that
+every request sent on the way is recorded once in the metrics.
+
+Usage (from the repository root):
+    python -m pytest src/test/python/unit
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+TEST_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SOURCE_DIR = os.path.join(TEST_DIR, '..', '..', 'main', 'python')
+
+sys.path.insert(0, os.path.join(SOURCE_DIR, 'commons'))
+sys.path.insert(0, os.path.join(TEST_DIR, 'simulator'))
+
+from phpipam_sim import Inventory, Simulator
+from vra_ipam_utils import cache, metrics
+from vra_ipam_utils.client import PhpIpamClient
+
+class RejectedTokenTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.sim = Simulator(Inventory(2, 2))
+        cls.sim.__enter__()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.sim.__exit__(None, None, None)
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        patcher = mock.patch.object(cache, 'CACHE_DIR', temp_dir.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = PhpIpamClient(self.sim.host_name, self.sim.app_id, self.sim.credentials, True)
+        self.addCleanup(self.client.close)
+        self.collector = metrics.start_operation("test")
+
+    def routes(self):
+        return {route: summary["count"] for route, summary in self.collector.summary()["requests"]["routes"].items()}
+
+    def test_request_is_retried_with_a_new_token(self):
+        self.client.token_auth.token = "stale"
+        response = self.client.get('subnets')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r.status_code for r in response.history], [401])
+        self.assertNotEqual(response.request.headers['token'], "stale")
+        # the rejected request, the login and the retry
+        self.assertEqual(self.routes(), {"GET /subnets/": 2, "POST /user/": 1})
+        self.assertEqual(self.collector.summary()["requests"]["errors"], 1)
+
+    def test_accepted_token_is_recorded_once(self):
+        self.client.get('subnets')
+        self.collector = metrics.start_operation("test")
+        self.client.get('subnets')
+        self.assertEqual(self.routes(), {"GET /subnets/": 1})
+
+if __name__ == '__main__':
+    unittest.main()
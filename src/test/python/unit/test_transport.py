@@ -0,0 +1,94 @@
+"""
+Checks that the sessions built by vra_ipam_utils.transport trust the endpoint certificate.
+
+The server certificate in data/ is self-signed, like those of many phpIPAM servers. ABX doesn't
+set REQUESTS_CA_BUNDLE and the like, so the tests run without them: requests would otherwise
+verify against that bundle rather than against the SSL context of the endpoint.
+
+Usage (from the repository root):
+    python -m pytest src/test/python/unit
+"""
+
+import http.server
+import os
+import ssl
+import sys
+import threading
+import unittest
+from unittest import mock
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+SOURCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'main', 'python')
+
+sys.path.insert(0, os.path.join(SOURCE_DIR, 'commons'))
+
+import requests
+from vra_ipam_utils import transport
+
+CERT = os.path.join(DATA_DIR, 'localhost.pem')
+KEY = os.path.join(DATA_DIR, 'localhost.key')
+
+## Variables through which requests or OpenSSL could pick up a CA bundle from the environment
+CA_BUNDLE_VARIABLES = ("REQUESTS_CA_BUNDLE", "CURL_CA_BUNDLE", "SSL_CERT_FILE", "SSL_CERT_DIR")
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        body = b'{"code":200,"success":true}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class TransportTlsTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(CERT, KEY)
+        cls.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        cls.server.socket = context.wrap_socket(cls.server.socket, server_side=True)
+        cls.url = f"https://127.0.0.1:{cls.server.server_address[1]}/api/vra/"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        environment = mock.patch.dict(os.environ)
+        environment.start()
+        self.addCleanup(environment.stop)
+        for name in CA_BUNDLE_VARIABLES:
+            os.environ.pop(name, None)
+
+    def test_endpoint_certificate_is_trusted(self):
+        with transport.build_session(CERT, 2, 0, 0) as session:
+            self.assertEqual(session.get(self.url, timeout=5).status_code, 200)
+            # a second request reuses the pooled connection
+            self.assertEqual(session.get(self.url, timeout=5).status_code, 200)
+
+    def test_environment_bundle_does_not_replace_endpoint_certificate(self):
+        os.environ["REQUESTS_CA_BUNDLE"] = requests.certs.where()
+        with transport.build_session(CERT, 1, 0, 0) as session:
+            self.assertEqual(session.get(self.url, timeout=5).status_code, 200)
+
+    def test_default_trust_store_rejects_self_signed_certificate(self):
+        with transport.build_session(True, 1, 0, 0) as session:
+            with self.assertRaises(requests.exceptions.SSLError):
+                session.get(self.url, timeout=5)
+
+    def test_shared_context_is_not_modified(self):
+        context = transport.get_ssl_context(CERT)
+        before = context.cert_store_stats()
+        with transport.build_session(CERT, 1, 0, 0) as session:
+            session.get(self.url, timeout=5)
+        self.assertEqual(context.cert_store_stats(), before)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+"""
+Checks the validation of the responses returned to vRA against their schemas.
+
+Usage (from the repository root):
+    python -m pytest src/test/python/unit
+"""
+
+import os
+import random
+import sys
+import unittest
+from unittest import mock
+
+SOURCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'main', 'python')
+
+sys.path.insert(0, os.path.join(SOURCE_DIR, 'commons'))
+
+from vra_ipam_utils.ipam import IPAM
+from vra_ipam_utils.validation import validate_response, validation_enabled
+
+def allocation_inputs(count):
+    return {"ipAllocations": [{"id": f"nic-{i}", "ipRangeIds": ["7"], "size": 1} for i in range(count)]}
+
+def allocation(allocation_id, addresses=("10.0.0.5",)):
+    return {"ipAllocationId": allocation_id, "ipRangeId": "7", "ipVersion": "IPv4", "ipAddresses": list(addresses)}
+
+class ValidateResponseTest(unittest.TestCase):
+
+    def test_results_in_input_order(self):
+        inputs = allocation_inputs(5)
+        validate_response("allocate_ip", {"ipAllocations": [allocation(f"nic-{i}") for i in range(5)]}, inputs)
+
+    def test_results_in_any_order(self):
+        inputs = allocation_inputs(20)
+        results = [allocation(f"nic-{i}") for i in range(20)]
+        random.Random(21).shuffle(results)
+        validate_response("allocate_ip", {"ipAllocations": results}, inputs)
+
+    def test_unknown_id(self):
+        with self.assertRaisesRegex(AssertionError, r"ipAllocations\[1\] with id nic-9 doesn't match any of the inputs"):
+            validate_response("allocate_ip", {"ipAllocations": [allocation("nic-0"), allocation("nic-9")]}, allocation_inputs(2))
+
+    def test_duplicate_id(self):
+        with self.assertRaisesRegex(AssertionError, r"ipAllocations\[1\] with id nic-0 answers an input which already has a result"):
+            validate_response("allocate_ip", {"ipAllocations": [allocation("nic-0"), allocation("nic-0")]}, allocation_inputs(2))
+
+    def test_size_mismatch(self):
+        for count in (1, 3):
+            with self.subTest(count=count):
+                with self.assertRaisesRegex(AssertionError, "Size of ipAllocations"):
+                    validate_response("allocate_ip", {"ipAllocations": [allocation("nic-0"), allocation("nic-1")]}, allocation_inputs(count))
+
+    def test_empty_ip_addresses(self):
+        with self.assertRaisesRegex(AssertionError, r"ipAllocations\[0\]\['ipAddresses'\] must not be empty"):
+            validate_response("allocate_ip", {"ipAllocations": [allocation("nic-0", ())]}, allocation_inputs(1))
+
+    def test_ip_addresses_not_a_list(self):
+        result = allocation("nic-0")
+        result["ipAddresses"] = "10.0.0.5"
+        with self.assertRaisesRegex(AssertionError, "must be a list type"):
+            validate_response("allocate_ip", {"ipAllocations": [result]}, allocation_inputs(1))
+
+    def test_missing_field(self):
+        result = allocation("nic-0")
+        del result["ipRangeId"]
+        with self.assertRaisesRegex(AssertionError, r"ipAllocations\[0\]\['ipRangeId'\] is mandatory"):
+            validate_response("allocate_ip", {"ipAllocations": [result]}, allocation_inputs(1))
+
+    def test_missing_key(self):
+        with self.assertRaisesRegex(AssertionError, "ipRanges is mandatory"):
+            validate_response("get_ip_ranges", {}, {})
+        with self.assertRaisesRegex(AssertionError, "must be an object"):
+            validate_response("get_ip_ranges", [], {})
+
+    def test_single_result(self):
+        ip_range = {"id": "7", "name": "10.0.0.0/24", "startIPAddress": "10.0.0.1", "endIPAddress": "10.0.0.254",
+                    "ipVersion": "IPv4", "subnetPrefixLength": "24"}
+        validate_response("allocate_ip_range", {"ipRange": ip_range}, {})
+        del ip_range["endIPAddress"]
+        with self.assertRaisesRegex(AssertionError, r"ipRange\['endIPAddress'\] is mandatory"):
+            validate_response("allocate_ip_range", {"ipRange": ip_range}, {})
+
+    def test_message_only(self):
+        validate_response("validate_endpoint", {"message": "Validated successfully"}, {})
+
+class ValidationEnabledTest(unittest.TestCase):
+
+    def test_setting(self):
+        self.assertTrue(validation_enabled({}))
+        for value in ("true", "True", True, "yes"):
+            with self.subTest(value=value):
+                self.assertTrue(validation_enabled({"validateResponses": value}))
+        for value in ("false", "False", False):
+            with self.subTest(value=value):
+                self.assertFalse(validation_enabled({"validateResponses": value}))
+
+    def test_disabled_validation_accepts_any_response(self):
+        inputs = dict(allocation_inputs(2), endpoint={"endpointProperties": {"validateResponses": "false"}})
+        result = {"ipAllocations": [allocation("nic-9", ())]}
+        self.assertIs(IPAM._validate_response(mock.Mock(inputs=inputs), "allocate_ip", result), result)
+
+        inputs["endpoint"]["endpointProperties"]["validateResponses"] = "true"
+        with self.assertRaises(AssertionError):
+            IPAM._validate_response(mock.Mock(inputs=inputs), "allocate_ip", result)
+
+if __name__ == '__main__':
+    unittest.main()